@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class ChargingConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'Charging'
+
+    def ready(self):
+        import Charging.signals
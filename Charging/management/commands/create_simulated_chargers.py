@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+from Charging.models import Station, EVCharger
+
+class Command(BaseCommand):
+    help = 'Create the chargers driven by the fleet simulator (Simulators/homemade_simulator/simulator/fleet.py)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('station_code', help='Station the chargers are attached to')
+        parser.add_argument('--count', type=int, default=1000, help='Number of chargers')
+        parser.add_argument('--prefix', default='SIM', help='Serial numbers are PREFIX00000, PREFIX00001, ...')
+
+    def handle(self, *args, **options):
+        if options['count'] < 1:
+            raise CommandError("--count must be at least 1")
+        try:
+            station = Station.objects.get(station_code=options['station_code'])
+        except Station.DoesNotExist:
+            raise CommandError(f"Station {options['station_code']} does not exist")
+
+        chargers = [
+            EVCharger(station=station, serial_number=f"{options['prefix']}{i:05d}", model='Simulated', vendor='Fleet')
+            for i in range(options['count'])
+        ]
+        # Chargers created by an earlier run are left as they are
+        EVCharger.objects.bulk_create(chargers, batch_size=1000, ignore_conflicts=True)
+        self.stdout.write(self.style.SUCCESS(
+            f"{options['count']} simulated chargers {chargers[0].serial_number}..{chargers[-1].serial_number} "
+            f"available on station {station.station_code}"
+        ))
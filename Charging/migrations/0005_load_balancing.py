@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Charging', '0004_remove_evcharger_activity_remove_evcharger_connected_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='evcharger',
+            name='priority',
+            field=models.PositiveSmallIntegerField(default=1),
+        ),
+        migrations.AddField(
+            model_name='station',
+            name='max_current',
+            field=models.FloatField(blank=True, null=True),
+        ),
+    ]
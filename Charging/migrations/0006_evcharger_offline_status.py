@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Charging', '0005_load_balancing'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='evcharger',
+            name='offline_status',
+            field=models.CharField(blank=True, max_length=20, null=True),
+        ),
+    ]
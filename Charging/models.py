@@ -10,6 +10,8 @@ class Station(models.Model):
     station_code = models.CharField(max_length=100, unique=True, null=False)
     name = models.CharField(max_length=100)
     location = models.CharField(max_length=100)
+    # Current the chargers of the station may draw together, in A; not load balanced when empty
+    max_current = models.FloatField(null=True, blank=True)
 
     objects = StationManager()
 
@@ -40,7 +42,12 @@ class EVCharger(models.Model):
     model = models.CharField(max_length=100, null=True)
     vendor = models.CharField(max_length=100, null=True)
     capacity = models.IntegerField(null=True)
+    # Weight of the charger's share when the station's current is balanced (see Commanding.loadbalancer)
+    priority = models.PositiveSmallIntegerField(default=1)
     status = models.CharField(default='available', max_length=20, choices=STATUS_CHOICES)
+    # Status the charger had when it went silent and was marked unavailable, given back when it
+    # returns (see Commanding.liveness); cleared by every status the charger reports
+    offline_status = models.CharField(max_length=20, null=True, blank=True)
 
     objects = EVChargerManager()
 
@@ -0,0 +1,89 @@
+import logging
+from channels.db import database_sync_to_async
+from .models import EVCharger
+
+logger = logging.getLogger(__name__)
+
+class ChargerEntry:
+    """
+    The fields of an ``EVCharger`` the OCPP message path needs, kept in memory.
+    """
+    __slots__ = ('id', 'serial_number', 'station_id', 'status', 'offline_status')
+
+    def __init__(self, id, serial_number, station_id, status, offline_status=None):
+        self.id = id
+        self.serial_number = serial_number
+        self.station_id = station_id
+        self.status = status
+        self.offline_status = offline_status
+
+    def __repr__(self):
+        return f"<ChargerEntry {self.serial_number} ({self.status})>"
+
+class ChargerRegistry:
+    """
+    Process-wide cache of chargers keyed by serial number.
+
+    A consumer loads its charger once when the charge point connects; every message after
+    that reads the id, station and current status from memory. Entries are dropped by the
+    ``EVCharger`` save/delete signals, so edits made through the REST API or the admin are
+    picked up on the next load. Serial numbers that do not match any charger are cached as
+    well, so an unknown charge point does not cost a query per message either.
+    """
+
+    def __init__(self):
+        self._entries = {}
+
+    def __contains__(self, serial_number):
+        return serial_number in self._entries
+
+    def get(self, serial_number):
+        """Return the cached entry for ``serial_number``, or None if it is unknown or not loaded."""
+        return self._entries.get(serial_number)
+
+    def load_sync(self, serial_number, refresh=False):
+        """Return the entry for ``serial_number``, reading it from the database if needed."""
+        if not refresh and serial_number in self._entries:
+            return self._entries[serial_number]
+
+        row = EVCharger.objects.filter(serial_number=serial_number).values(
+            'id', 'serial_number', 'station_id', 'status', 'offline_status'
+        ).first()
+        entry = ChargerEntry(**row) if row else None
+        self._entries[serial_number] = entry
+        return entry
+
+    async def load(self, serial_number, refresh=False):
+        if not refresh and serial_number in self._entries:
+            return self._entries[serial_number]
+        return await database_sync_to_async(self.load_sync)(serial_number, refresh)
+
+    def set_status(self, serial_number, status, offline_status=None):
+        """
+        Record a status change for a loaded charger, and the status it had before it was marked
+        unavailable, if that is why. Returns True if the status changed.
+        """
+        entry = self._entries.get(serial_number)
+        if entry is None:
+            return False
+        entry.offline_status = offline_status
+        if entry.status == status:
+            return False
+        entry.status = status
+        return True
+
+    def invalidate(self, *serial_numbers):
+        for serial_number in serial_numbers:
+            if self._entries.pop(serial_number, None) is not None:
+                logger.debug(f"Charger {serial_number} evicted from the registry")
+
+    def invalidate_id(self, charger_id):
+        """Drop the entry of the charger with primary key ``charger_id``, whatever its serial number."""
+        stale = [serial_number for serial_number, entry in self._entries.items()
+                 if entry is not None and entry.id == charger_id]
+        self.invalidate(*stale)
+
+    def clear(self):
+        self._entries.clear()
+
+charger_registry = ChargerRegistry()
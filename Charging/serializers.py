@@ -8,7 +8,7 @@ class StationSerializer(serializers.ModelSerializer):
     )
     class Meta:
         model = Station
-        fields = ['organization', 'name', 'station_code', 'location']
+        fields = ['organization', 'name', 'station_code', 'location', 'max_current']
 
 class EVChargerSerializer(serializers.ModelSerializer):
     station = serializers.SlugRelatedField(
@@ -16,4 +16,4 @@ class EVChargerSerializer(serializers.ModelSerializer):
     )
     class Meta:
         model = EVCharger
-        fields = ['station', 'model', 'serial_number', 'vendor', 'capacity']
+        fields = ['station', 'model', 'serial_number', 'vendor', 'capacity', 'priority']
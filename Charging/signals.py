@@ -0,0 +1,11 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from .models import EVCharger
+from .registry import charger_registry
+
+@receiver(post_save, sender=EVCharger)
+@receiver(post_delete, sender=EVCharger)
+def invalidate_charger_registry(sender, instance, **kwargs):
+    # The serial number may have been edited, so also drop whatever entry still points at this row
+    charger_registry.invalidate(instance.serial_number)
+    charger_registry.invalidate_id(instance.pk)
@@ -1,3 +1,114 @@
-from django.test import TestCase
+import json
+import warnings
+from asgiref.sync import sync_to_async
+from datetime import datetime, timedelta, timezone
+from django.test import AsyncClient, TestCase, override_settings
+from rest_framework_simplejwt.tokens import AccessToken
+from Commanding.models import StatusInterval, HeartbeatLog
+from EVChargingSystem.testing import QueryBudgetMixin, create_organization, create_station
+from Users.models import User
+from .models import EVCharger
 
-# Create your tests here.
+class ListQueryBudgetTests(QueryBudgetMixin, TestCase):
+
+    def setUp(self):
+        self.organization = create_organization()
+
+    def create_stations(self, start, stop):
+        for i in range(start, stop):
+            # Each station belongs to its own organization so that every row has a distinct relation
+            create_station(f"ST{i}", create_organization(f"O{i}", f"org{i}"))
+
+    def create_chargers(self, start, stop):
+        for i in range(start, stop):
+            station = create_station(f"CS{i}", self.organization)
+            EVCharger.objects.create(station=station, serial_number=f"CHG{i}")
+
+    def test_list_stations(self):
+        self.assertQueryBudget('/charging/stations/', self.create_stations, budget=1)
+
+    def test_list_evchargers(self):
+        self.assertQueryBudget('/charging/evchargers/', self.create_chargers, budget=1)
+
+class ListPaginationTests(QueryBudgetMixin, TestCase):
+
+    def setUp(self):
+        station = create_station()
+        for i in range(25):
+            EVCharger.objects.create(station=station, serial_number=f"CHG{i:02}")
+        self.user = User.objects.create_user("admin", password="admin", type="admin")
+        self.client = self.api_client(self.user)
+
+    def test_cursor_pages(self):
+        url = '/charging/evchargers/?page_size=10'
+        serial_numbers = []
+        while url:
+            page = self.client.get(url).json()
+            self.assertLessEqual(len(page['results']), 10)
+            serial_numbers += [charger['serial_number'] for charger in page['results']]
+            url = page['next']
+        self.assertEqual(serial_numbers, [f"CHG{i:02}" for i in range(25)])
+
+    def test_stream(self):
+        response = self.client.get('/charging/evchargers/?stream=1')
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 25)
+        self.assertEqual(json.loads(lines[0])['serial_number'], "CHG00")
+
+    @override_settings(API_STREAM_CHUNK_SIZE=10)
+    async def test_stream_asgi(self):
+        token = await sync_to_async(AccessToken.for_user)(self.user)
+        with warnings.catch_warnings():
+            # Django warns when it has to consume a synchronous iterator whole
+            warnings.simplefilter('error')
+            response = await AsyncClient().get(
+                '/charging/evchargers/', {'stream': '1'}, headers={'Authorization': f"Bearer {token}"}
+            )
+            chunks = [chunk.decode() async for chunk in response.streaming_content]
+        # Each chunk is sent as soon as it is read
+        self.assertEqual([len(chunk.splitlines()) for chunk in chunks], [10, 10, 5])
+        self.assertEqual(json.loads(chunks[2].splitlines()[-1])['serial_number'], "CHG24")
+
+class StatusHistoryTests(QueryBudgetMixin, TestCase):
+
+    def setUp(self):
+        station = create_station()
+        self.charger = EVCharger.objects.create(station=station, serial_number="CHG")
+        self.client = self.api_client()
+        self.t0 = datetime(2025, 1, 1, tzinfo=timezone.utc)
+
+    def at(self, minutes):
+        return self.t0 + timedelta(minutes=minutes)
+
+    def test_transition(self):
+        StatusInterval.objects.transition(self.charger.id, "Available", self.at(0))
+        StatusInterval.objects.transition(self.charger.id, "Available", self.at(5))
+        StatusInterval.objects.transition(self.charger.id, "Charging", self.at(10))
+        intervals = list(StatusInterval.objects.order_by('start').values_list('status', 'start', 'end'))
+        self.assertEqual(intervals, [("Available", self.at(0), self.at(10)), ("Charging", self.at(10), None)])
+
+    def test_history(self):
+        for minutes, status in [(0, "Available"), (60, "Charging"), (120, "Available")]:
+            StatusInterval.objects.transition(self.charger.id, status, self.at(minutes))
+        # A heartbeat every 10 s for the first 90 minutes, then silence
+        HeartbeatLog.objects.bulk_create(
+            HeartbeatLog(charger=self.charger, received_at=self.t0 + timedelta(seconds=s)) for s in range(0, 5400, 10)
+        )
+        response = self.client.get(
+            '/charging/evcharger/CHG/history/?start=2025-01-01T00:30:00Z&end=2025-01-01T03:00:00Z'
+        )
+        self.assertEqual(response.status_code, 200, response.content)
+        data = response.json()
+        self.assertEqual([(s['status'], s['start'], s['end']) for s in data['statuses']], [
+            ("Available", "2025-01-01T00:30:00Z", "2025-01-01T01:00:00Z"),
+            ("Charging", "2025-01-01T01:00:00Z", "2025-01-01T02:00:00Z"),
+            ("Available", "2025-01-01T02:00:00Z", "2025-01-01T03:00:00Z"),
+        ])
+        self.assertEqual(data['heartbeat_gaps'], [
+            {'start': "2025-01-01T01:29:50Z", 'end': "2025-01-01T03:00:00Z", 'seconds': 5410.0},
+        ])
+
+    def test_invalid_range(self):
+        response = self.client.get('/charging/evcharger/CHG/history/?start=yesterday')
+        self.assertEqual(response.status_code, 400)
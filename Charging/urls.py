@@ -7,6 +7,7 @@ from .views import (
     create_station,
     list_evchargers,
     retrieve_evcharger,
+    evcharger_history,
     update_evcharger,
     delete_evcharger,
     create_evcharger,
@@ -23,6 +24,7 @@ urlpatterns = [
     path('evchargers/', list_evchargers, name='evchargers'),
     path('evcharger/new/', create_evcharger, name='evcharger-new'),
     path('evcharger/<str:serial_number>/', retrieve_evcharger, name='evcharger-retrieve'),
+    path('evcharger/<str:serial_number>/history/', evcharger_history, name='evcharger-history'),
     path('evcharger/<str:serial_number>/update/', update_evcharger, name='evcharger-update'),
     path('evcharger/<str:serial_number>/delete/', delete_evcharger, name='evcharger-delete'),
 ]
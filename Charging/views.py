@@ -1,3 +1,7 @@
+from datetime import timedelta, timezone as dt_timezone
+from django.conf import settings
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
@@ -5,20 +9,21 @@ from rest_framework import status
 from .models import Station, EVCharger
 from .serializers import StationSerializer, EVChargerSerializer
 from django.shortcuts import get_object_or_404
+from EVChargingSystem.pagination import list_response
+from Commanding.models import StatusInterval, HeartbeatLog
 
 # List API View
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def list_stations(request):
-    stations = Station.objects.all()
-    serializer = StationSerializer(stations, many=True)
-    return Response(serializer.data)
+    stations = Station.objects.select_related('organization')
+    return list_response(request, stations, StationSerializer)
 
 # Retrieve API View
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def retrieve_station(request, station_code):
-    station = get_object_or_404(Station, station_code=station_code)
+    station = get_object_or_404(Station.objects.select_related('organization'), station_code=station_code)
     serializer = StationSerializer(station)
 
     return Response(serializer.data)
@@ -68,18 +73,78 @@ def create_station(request):
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def list_evchargers(request):
-    evchargers = EVCharger.objects.all()
-    serializer = EVChargerSerializer(evchargers, many=True)
-    return Response(serializer.data)
+    evchargers = EVCharger.objects.select_related('station')
+    return list_response(request, evchargers, EVChargerSerializer)
 
 # Retrieve API View
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def retrieve_evcharger(request, serial_number):
-    evcharger = get_object_or_404(EVCharger, serial_number=serial_number)
+    evcharger = get_object_or_404(EVCharger.objects.select_related('station'), serial_number=serial_number)
     serializer = EVChargerSerializer(evcharger)
     return Response(serializer.data)
 
+def parse_time_param(request, name):
+    value = request.query_params.get(name)
+    if value is None:
+        return None
+    try:
+        parsed = parse_datetime(value)
+    except ValueError:
+        parsed = None
+    if parsed is None:
+        raise ValueError(f"'{name}' must be an ISO 8601 date and time")
+    return parsed if timezone.is_aware(parsed) else parsed.replace(tzinfo=dt_timezone.utc)
+
+# Status History API View
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def evcharger_history(request, serial_number):
+    """
+    Status timeline and heartbeat gaps of a charger between ``?start=`` and ``?end=`` (ISO 8601,
+    the last 24 hours by default). A heartbeat gap is a period longer than the presence TTL
+    without a heartbeat.
+    """
+    evcharger = get_object_or_404(EVCharger, serial_number=serial_number)
+    now = timezone.now()
+    try:
+        end = parse_time_param(request, 'end') or now
+        start = parse_time_param(request, 'start') or end - timedelta(hours=24)
+    except ValueError as e:
+        return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    max_days = getattr(settings, "STATUS_HISTORY_MAX_DAYS", 31)
+    if start >= end or end - start > timedelta(days=max_days):
+        return Response({"detail": f"'start' must be before 'end' and at most {max_days} days earlier."},
+                        status=status.HTTP_400_BAD_REQUEST)
+
+    # Nothing is known about the future; the timeline stops now
+    until = min(end, now)
+    statuses, gaps = [], []
+    if start < until:
+        threshold = timedelta(seconds=getattr(
+            settings, "CHARGER_PRESENCE_TTL", 3 * getattr(settings, "HEARTBEAT_INTERVAL", 10)
+        ))
+        statuses = [
+            {
+                'status': interval.status,
+                'start': max(interval.start, start),
+                'end': min(interval.end or until, until),
+            }
+            for interval in StatusInterval.objects.overlapping(evcharger, start, until)
+        ]
+        gaps = [
+            {'start': gap_start, 'end': gap_end, 'seconds': (gap_end - gap_start).total_seconds()}
+            for gap_start, gap_end in HeartbeatLog.objects.gaps(evcharger, start, until, threshold)
+        ]
+
+    return Response({
+        'serial_number': evcharger.serial_number,
+        'start': start,
+        'end': end,
+        'statuses': statuses,
+        'heartbeat_gaps': gaps,
+    })
+
 # Update API View
 @api_view(['PUT', 'PATCH'])
 @permission_classes([IsAuthenticated])
@@ -1,7 +1,8 @@
 from django.contrib import admin
 
-from .models import Transaction, StatusLog, HeartbeatLog
+from .models import Transaction, StatusLog, HeartbeatLog, CommandJob
 
 admin.site.register(Transaction)
 admin.site.register(StatusLog)
-admin.site.register(HeartbeatLog)
\ No newline at end of file
+admin.site.register(HeartbeatLog)
+admin.site.register(CommandJob)
\ No newline at end of file
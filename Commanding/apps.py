@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class CommandingConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'Commanding'
+
+    def ready(self):
+        from Commanding.consumers import ChargePoint
+        # Read and compile the OCPP schemas once at startup instead of on each action's first frame
+        ChargePoint.warm_validators()
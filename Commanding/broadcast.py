@@ -0,0 +1,149 @@
+import asyncio
+import logging
+from collections import defaultdict
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+class StatusBroadcaster:
+    """
+    Publishes charger status changes to the channel layer, coalescing bursts.
+
+    Consumers report the status of their charger after every frame; only a status that differs
+    from the last one published is queued. Queued changes are held for ``window`` seconds, so a
+    burst of transitions collapses into its final status (and into nothing if the charger ends up
+    where it started). When the window closes, each changed charger gets one ``broadcast_status``
+    event on its ``ev_charger_<serial>`` group, and each station gets a single
+    ``broadcast_status_batch`` event on ``ev_station_<station_code>`` listing all of its chargers
+    that changed.
+
+    Heartbeats are collected the same way with :meth:`heartbeat`: each station gets one
+    ``broadcast_heartbeat_batch`` event per window with the latest heartbeat time of each of its
+    chargers, for the dashboards subscribed to the whole station.
+
+    The last published status is only remembered for the chargers connected to this worker,
+    from :meth:`seed` until :meth:`forget`. If sending fails, the changes and heartbeats of the
+    window are queued again, unless newer ones replaced them, and retried in the next window.
+
+    Attributes:
+        channel_layer: The channel layer the events are sent through.
+        window (float): Seconds changes are collected before they are published.
+    """
+
+    def __init__(self, channel_layer, window=None):
+        self.channel_layer = channel_layer
+        self.window = window if window is not None else getattr(settings, "STATUS_BROADCAST_WINDOW", 0.5)
+        self._published = {}
+        self._pending = {}
+        self._heartbeats = defaultdict(dict)
+        self._loop = None
+        self._flush_task = None
+
+    def seed(self, serial_number, status):
+        """Record the status a charger's subscribers already know, without publishing it."""
+        self._published[serial_number] = status
+
+    def forget(self, serial_number):
+        """Stop remembering the status of a charger that disconnected; queued changes are still sent."""
+        self._published.pop(serial_number, None)
+
+    def publish(self, station_code, serial_number, status):
+        """
+        Queue a status report. Returns True if it is a change that will be broadcast.
+        """
+        if serial_number not in self._pending and self._published.get(serial_number) == status:
+            return False
+
+        self._pending[serial_number] = (station_code, status)
+        self._schedule()
+        return True
+
+    def heartbeat(self, station_code, serial_number, time):
+        """Queue a heartbeat received at ``time`` (ISO 8601) for the station's subscribers."""
+        self._heartbeats[station_code][serial_number] = time
+        self._schedule()
+
+    def _schedule(self):
+        if self._flush_task is None:
+            self._flush_task = asyncio.get_running_loop().create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.window)
+        self._flush_task = None
+        await self.flush()
+
+    async def flush(self):
+        pending, self._pending = self._pending, {}
+        heartbeats, self._heartbeats = self._heartbeats, defaultdict(dict)
+
+        changed = {
+            serial_number: (station_code, status) for serial_number, (station_code, status) in pending.items()
+            if self._published.get(serial_number) != status
+        }
+        by_station = defaultdict(list)
+        for serial_number, (station_code, status) in changed.items():
+            by_station[station_code].append({'charger_id': serial_number, 'status': status})
+
+        try:
+            await self._send(changed, by_station, heartbeats)
+        except Exception:
+            logger.exception("Failed to broadcast %d status changes, retrying in the next window", len(changed))
+            for serial_number, change in changed.items():
+                self._pending.setdefault(serial_number, change)
+            for station_code, times in heartbeats.items():
+                for serial_number, time in times.items():
+                    self._heartbeats[station_code].setdefault(serial_number, time)
+            self._schedule()
+            return
+
+        for serial_number, (_, status) in changed.items():
+            # Only the chargers of this worker are remembered, see forget()
+            if serial_number in self._published:
+                self._published[serial_number] = status
+        if by_station:
+            logger.debug(
+                "Broadcasted %d status changes to %d stations",
+                sum(len(updates) for updates in by_station.values()), len(by_station)
+            )
+
+    async def _send(self, changed, by_station, heartbeats):
+        for serial_number, (_, status) in changed.items():
+            await self.channel_layer.group_send(
+                f'ev_charger_{serial_number}',
+                {
+                    'type': 'broadcast_status',
+                    'charger_serial_number': serial_number,
+                    'status': status,
+                }
+            )
+        for station_code, updates in by_station.items():
+            await self.channel_layer.group_send(
+                f'ev_station_{station_code}',
+                {
+                    'type': 'broadcast_status_batch',
+                    'station_code': station_code,
+                    'updates': updates,
+                }
+            )
+        for station_code, times in heartbeats.items():
+            await self.channel_layer.group_send(
+                f'ev_station_{station_code}',
+                {
+                    'type': 'broadcast_heartbeat_batch',
+                    'station_code': station_code,
+                    'heartbeats': [{'charger_id': serial_number, 'time': time} for serial_number, time in times.items()],
+                }
+            )
+
+_broadcaster = None
+
+def get_status_broadcaster(channel_layer):
+    """
+    Return the status broadcaster for ``channel_layer`` on the running event loop.
+    """
+    global _broadcaster
+    loop = asyncio.get_running_loop()
+    if _broadcaster is None or _broadcaster.channel_layer is not channel_layer or _broadcaster._loop is not loop:
+        _broadcaster = StatusBroadcaster(channel_layer)
+        _broadcaster._loop = loop
+    return _broadcaster
@@ -0,0 +1,38 @@
+import json
+import logging
+from django.conf import settings
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+def _orjson_dumps(content):
+    return orjson.dumps(content).decode()
+
+CODECS = {
+    'json': (json.loads, json.dumps),
+}
+if orjson is not None:
+    CODECS['orjson'] = (orjson.loads, _orjson_dumps)
+
+# Codec names that were not available, warned about once
+_missing = set()
+
+def get_codec(name=None):
+    """
+    Return the ``(loads, dumps)`` pair used to decode and encode websocket frames.
+
+    The codec is chosen with the ``OCPP_JSON_CODEC`` setting. ``orjson`` falls back to the
+    standard library when the package is not installed, with a warning the first time. Callers
+    resolve the codec once, not per frame.
+    """
+    name = name or getattr(settings, "OCPP_JSON_CODEC", "json")
+    if name not in CODECS:
+        if name not in _missing:
+            _missing.add(name)
+            logger.warning("JSON codec '%s' is not available, falling back to 'json'", name)
+        name = 'json'
+    return CODECS[name]
@@ -0,0 +1,151 @@
+import asyncio
+import logging
+import math
+import time
+import uuid
+from django.conf import settings
+from ocpp.v16 import call
+from ocpp.charge_point import camel_to_snake_case, snake_to_camel_case, serialize_as_dict
+from ocpp.exceptions import OCPPError
+from Commanding.metrics import COMMANDS
+from Commanding.presence import ChargerPresence
+
+logger = logging.getLogger(__name__)
+
+# Outcome of a command -> HTTP status the REST API answers with
+COMPLETED = 'completed'
+RESULT_STATUSES = {
+    COMPLETED: 200,
+    'invalid': 400,
+    'not_connected': 404,
+    'busy': 429,
+    'error': 502,
+    'timeout': 504,
+}
+
+def command_timeout(command):
+    """Seconds to wait for the charger's answer to ``command`` (``COMMAND_TIMEOUTS``, ``COMMAND_TIMEOUT``)."""
+    timeouts = getattr(settings, "COMMAND_TIMEOUTS", {})
+    return timeouts.get(command, getattr(settings, "COMMAND_TIMEOUT", 30))
+
+def command_retries(command):
+    """
+    Times ``command`` is sent again when the charger does not answer: ``COMMAND_RETRIES`` for the
+    actions of ``COMMAND_RETRY_ACTIONS``, which are safe to repeat, and 0 for the others.
+    """
+    if command not in getattr(settings, "COMMAND_RETRY_ACTIONS", ()):
+        return 0
+    return getattr(settings, "COMMAND_RETRIES", 1)
+
+class CommandRunner:
+    """
+    Sends the commands routed to a charger's consumer and waits for their results.
+
+    OCPP 1.6 allows one outstanding CALL per direction, so the commands of a charger are sent one
+    at a time; ``max_in_flight`` (``COMMAND_MAX_IN_FLIGHT``) caps how many may be sent or waiting
+    to be sent, and further commands are refused as ``busy`` instead of queueing for minutes.
+    Each command waits ``command_timeout`` seconds for its CALLRESULT. Actions that are safe to
+    repeat are sent again, with the same unique id, up to ``COMMAND_RETRIES`` times when none
+    arrives (see :func:`command_retries`); a late answer to an earlier attempt then still
+    matches. A CALLERROR is not retried. A command given an ``expires_at`` (the caller stops
+    waiting then) that is still waiting for its turn at that time is dropped without being sent,
+    and its attempts never run past it.
+
+    Args:
+        charge_point: The ``ChargePoint`` of the connection.
+        max_in_flight (int): Commands the charger may have sent or queued at once.
+    """
+
+    def __init__(self, charge_point, max_in_flight=None):
+        self.charge_point = charge_point
+        self.max_in_flight = max_in_flight or getattr(settings, "COMMAND_MAX_IN_FLIGHT", 20)
+        self.in_flight = 0
+        self._lock = asyncio.Lock()
+
+    async def run(self, command, payload=None, command_id=None, timeout=None, retries=None, expires_at=None):
+        """
+        Send ``command`` with its camelCase ``payload`` and return the outcome.
+
+        ``expires_at`` is a ``time.time()`` timestamp, since it may come from another process.
+
+        Returns:
+            dict: ``status`` (a key of ``RESULT_STATUSES``) and, when completed, the camelCase
+            ``payload`` of the CALLRESULT, or the ``error`` of a failed command.
+        """
+        result = await self._run(command, payload, command_id or str(uuid.uuid4()), timeout, retries, expires_at)
+        COMMANDS.inc(command if hasattr(call, command) else 'unknown', result['status'])
+        return result
+
+    async def _run(self, command, payload, command_id, timeout, retries, expires_at):
+        try:
+            request = getattr(call, command)(**camel_to_snake_case(payload or {}))
+        except (AttributeError, TypeError) as e:
+            return {'status': 'invalid', 'error': f"Invalid command {command}: {e}"}
+        if self.in_flight >= self.max_in_flight:
+            return {'status': 'busy', 'error': f"{self.in_flight} commands are already pending"}
+
+        timeout = timeout or command_timeout(command)
+        retries = command_retries(command) if retries is None else retries
+        self.in_flight += 1
+        try:
+            async with self._lock:
+                for attempt in range(retries + 1):
+                    remaining = math.inf if expires_at is None else expires_at - time.time()
+                    if remaining <= 0:
+                        if attempt == 0:
+                            return {'status': 'timeout', 'error': "Expired before it could be sent"}
+                        break
+                    # The charge point's own response timeout, shared by every call, is left alone
+                    wait = min(timeout, remaining)
+                    try:
+                        response = await asyncio.wait_for(
+                            self.charge_point.call(request, suppress=False, unique_id=command_id), wait
+                        )
+                    except asyncio.TimeoutError:
+                        logger.warning("No answer to %s %s after %ss (attempt %d of %d)",
+                                       command, command_id, wait, attempt + 1, retries + 1)
+                        continue
+                    except OCPPError as e:
+                        return {'status': 'error', 'error': {
+                            'code': getattr(e, 'code', type(e).__name__),
+                            'description': e.description,
+                            'details': e.details,
+                        }}
+                    return {'status': COMPLETED, 'payload': snake_to_camel_case(serialize_as_dict(response))}
+                return {'status': 'timeout', 'error': f"No answer after {attempt + 1} attempts"}
+        finally:
+            self.in_flight -= 1
+
+async def send_command(channel_layer, serial_number, command, payload=None, timeout=None):
+    """
+    Send ``command`` to a charger, wherever its websocket is, and wait for the outcome.
+
+    The command is routed with :class:`ChargerPresence` to the charger's consumer together with
+    a command id, a reply channel and the time the caller stops waiting; the consumer's
+    :class:`CommandRunner` sends the result back on that channel once the charger answered, or
+    gave up, and drops the command if it could not be sent by then.
+
+    Returns:
+        dict: The result of :meth:`CommandRunner.run`, with the ``command_id``.
+    """
+    command_id = str(uuid.uuid4())
+    timeout = timeout or command_timeout(command)
+    # Every attempt may time out, in the time the consumer is given for the command; the margin
+    # covers the reply's trip back, beyond it the consumer is gone
+    expires_at = time.time() + timeout * (command_retries(command) + 1)
+    deadline = expires_at - time.time() + getattr(settings, "COMMAND_REPLY_MARGIN", 5)
+    reply_to = await channel_layer.new_channel('command-result.')
+    sent = await ChargerPresence(channel_layer).send_command(
+        serial_number, command, payload,
+        command_id=command_id, reply_to=reply_to, timeout=timeout, expires_at=expires_at,
+    )
+    if not sent:
+        return {'command_id': command_id, 'status': 'not_connected', 'error': "Charger is not connected"}
+
+    try:
+        reply = await asyncio.wait_for(channel_layer.receive(reply_to), deadline)
+    except asyncio.TimeoutError:
+        return {'command_id': command_id, 'status': 'timeout', 'error': f"No result after {deadline:.0f}s"}
+    result = {key: value for key, value in reply.items() if key != 'type'}
+    result['command_id'] = command_id
+    return result
@@ -1,33 +1,150 @@
+import asyncio
 import logging
-import json
+import time
+from datetime import timezone as dt_timezone
 from channels.db import database_sync_to_async
 from channels.generic.websocket import AsyncJsonWebsocketConsumer
 from django.contrib.auth.models import AnonymousUser
-from django.contrib.auth import get_user_model
-from rest_framework_simplejwt.tokens import AccessToken
-from Users.models import Customer
-from Charging.models import EVCharger
-from Commanding.models import Transaction, StatusLog, HeartbeatLog
+from Charging.models import EVCharger, Station
+from Charging.registry import charger_registry
+from Commanding.models import StatusLog, StatusInterval, HeartbeatLog, MeterValueChunk
+from Commanding.persistence import get_log_writer, get_meter_writer
+from Commanding.presence import ChargerPresence
+from Commanding.broadcast import get_status_broadcaster
+from Commanding.liveness import get_liveness_monitor
+from Commanding.sessions import ConnectorSessions, get_transaction_id_allocator
+from Commanding.loadbalancer import ACTIVE_STATUSES, get_load_reporter, measured_current
+from Commanding.codec import get_codec
+from Commanding.commands import CommandRunner, COMPLETED, send_command
+from Commanding.metrics import FRAMES, FRAME_ERRORS, STAGE_SECONDS, CONNECTED_CHARGERS, FrameTimer
+from Commanding.logs import ChargerLogAdapter
 from django.db import transaction
-from ocpp.routing import on
+from django.db.models import OuterRef, Subquery
+from ocpp.routing import on, create_route_map
 from ocpp.v16 import ChargePoint as cp
 from ocpp.v16.enums import RegistrationStatus, AuthorizationStatus
 from ocpp.v16 import call_result
+from ocpp.messages import Call, CallResult, CallError, MessageType, get_validator, _validate_payload
+from ocpp.exceptions import OCPPError, ProtocolError, PropertyConstraintViolationError
+from django.utils import timezone
 from django.utils.timezone import now
+from django.utils.dateparse import parse_datetime
 from django.conf import settings
 
 logger = logging.getLogger(__name__)
 connected_chargers = {}
 
+FRAME_TYPES = {
+    MessageType.Call: Call,
+    MessageType.CallResult: CallResult,
+    MessageType.CallError: CallError,
+}
+
+def parse_frame(msg):
+    """
+    Build a Call, CallResult or CallError from an OCPP frame that is already decoded from JSON.
+    """
+    if not isinstance(msg, list) or not msg:
+        raise ProtocolError(details={"cause": "OCPP message should be a non-empty list"})
+    try:
+        cls = FRAME_TYPES[msg[0]]
+    except (KeyError, TypeError):
+        raise PropertyConstraintViolationError(details={"cause": f"MessageTypeId '{msg[0]}' isn't valid"})
+    try:
+        return cls(*msg[1:])
+    except TypeError:
+        raise ProtocolError(details={"cause": "Message is missing elements."})
+
+class ValidatedCall(Call):
+    """
+    A CALL whose CALLRESULT is validated against its schema, on the event loop, when it is created.
+    """
+
+    def __init__(self, unique_id, action, payload, ocpp_version):
+        super().__init__(unique_id, action, payload)
+        self.ocpp_version = ocpp_version
+
+    def create_call_result(self, payload):
+        result = super().create_call_result(payload)
+        _validate_payload(result, self.ocpp_version)
+        return result
+
 class ChargePoint(cp):
-    def __init__(self, id, connection):
+    """
+    The OCPP 1.6 charge point of a charger connection.
+
+    ``ocpp`` validates payloads in the default thread pool. Validating a small OCPP payload
+    takes microseconds, far less than handing it to the thread pool, so with ``inline_validation``
+    (``OCPP_INLINE_VALIDATION``) this charge point validates the CALLs it handles, and its
+    answers to them, on the event loop instead. The setting only applies to this instance;
+    the ``ocpp`` module keeps its own behaviour.
+    """
+
+    def __init__(self, id, connection, inline_validation=None):
         super().__init__(id, connection)
         self.id = id
+        self.log = ChargerLogAdapter(logger, {'charger_id': id})
+        if inline_validation is None:
+            inline_validation = getattr(settings, "OCPP_INLINE_VALIDATION", True)
+        self.inline_validation = inline_validation
+        self._validated_actions = set()
+        if inline_validation:
+            # The route map is built per instance: ocpp skips its own validation of these actions
+            for action, handlers in self.route_map.items():
+                if not handlers.get('_skip_schema_validation', False):
+                    handlers['_skip_schema_validation'] = True
+                    self._validated_actions.add(action)
+
+    async def _handle_call(self, msg):
+        if msg.action in self._validated_actions:
+            _validate_payload(msg, self._ocpp_version)
+            msg = ValidatedCall(msg.unique_id, msg.action, msg.payload, self._ocpp_version)
+        return await super()._handle_call(msg)
+
+    @classmethod
+    def warm_validators(cls):
+        """
+        Load the request and response schema of every action we handle, so the first frame of an
+        action does not pay for reading and compiling its schema.
+        """
+        for action in create_route_map(cls(None, None)):
+            for message_type_id in (MessageType.Call, MessageType.CallResult):
+                try:
+                    get_validator(message_type_id, action, cls._ocpp_version)
+                except OSError:
+                    logger.warning("No %s schema found for OCPP %s", action, cls._ocpp_version)
+
+    async def dispatch(self, msg):
+        """
+        Route a frame that was already decoded by the consumer to the ``@on`` handlers.
+
+        This does the same as ``route_message`` without serializing the frame back to JSON
+        only to have it parsed again.
+
+        Args:
+            msg (list): The decoded OCPP frame.
+        """
+        try:
+            message = parse_frame(msg)
+        except OCPPError as e:
+            FRAME_ERRORS.inc('unknown', 'parse')
+            self.log.error("Unable to parse message %s: %s", msg, e)
+            return
+
+        if message.message_type_id == MessageType.Call:
+            try:
+                await self._handle_call(message)
+            except OCPPError as error:
+                FRAME_ERRORS.inc(message.action if message.action in METRIC_ACTIONS else 'unknown', 'ocpp')
+                self.log.exception("Error while handling request %s", message, extra={'action': message.action})
+                await self._send(message.create_call_error(error).to_json())
+        else:
+            self._response_queue.put_nowait(message)
 
     @on('BootNotification')
     async def on_boot_notification(self, charge_point_model, **kwargs):
         interval = getattr(settings, "HEARTBEAT_INTERVAL", 10)
-        logger.info(f"[{self.id}] BootNotification from model '{charge_point_model}'")
+        self.log.info("BootNotification from model %s", charge_point_model, extra={'action': 'BootNotification'})
         return call_result.BootNotification(
             current_time=now().isoformat(),
             interval=interval,
@@ -36,119 +153,225 @@ class ChargePoint(cp):
 
     @on('Heartbeat')
     async def on_heartbeat(self):
-        logger.info(f"[{self.id}] Received Heartbeat")
+        self.log.debug("Received Heartbeat", extra={'action': 'Heartbeat'})
         return call_result.Heartbeat(current_time=now().isoformat())
 
     @on('StatusNotification')
     async def on_status_notification(self, status, connector_id, **kwargs):
-        logger.info(f"[{self.id}] StatusNotification: {status} for connector {connector_id}")
+        self.log.debug("StatusNotification: %s for connector %s", status, connector_id,
+                      extra={'action': 'StatusNotification', 'status': status})
         return call_result.StatusNotification()
 
     @on('StartTransaction')
     async def on_start_transaction(self, id_tag, connector_id, meter_start, timestamp, **kwargs):
-        logger.info(f"[{self.id}] StartTransaction from {id_tag} on connector {connector_id}")
-        # In a real system, validate the id_tag and generate a real transaction_id
+        # In a real system, validate the id_tag
+        session = await self._connection.sessions.start(
+            connector_id, id_tag, meter_start, parse_timestamp(timestamp) or now(), await self._connection.get_customer()
+        )
+        self.log.info("StartTransaction %s from %s on connector %s", session.transaction_id, id_tag, connector_id,
+                      extra={'action': 'StartTransaction', 'transaction_id': session.transaction_id})
         return call_result.StartTransaction(
-            transaction_id=1,
+            transaction_id=session.transaction_id,
             id_tag_info={
                 'status': AuthorizationStatus.accepted.value
             }
         )
 
     @on('StopTransaction')
-    async def on_stop_transaction(self, meter_stop, timestamp, transaction_id, **kwargs):
-        logger.info(f"[{self.id}] StopTransaction for transaction {transaction_id}")
+    async def on_stop_transaction(self, meter_stop, timestamp, transaction_id, reason=None, **kwargs):
+        await self._connection.sessions.stop(transaction_id, meter_stop, parse_timestamp(timestamp) or now(), reason)
+        self.log.info("StopTransaction for transaction %s", transaction_id,
+                      extra={'action': 'StopTransaction', 'transaction_id': transaction_id})
         return call_result.StopTransaction()
 
+    @on('MeterValues')
+    async def on_meter_values(self, connector_id, meter_value, **kwargs):
+        self.log.debug("MeterValues for connector %s: %d samples", connector_id, len(meter_value), extra={'action': 'MeterValues'})
+        return call_result.MeterValues()
+
+# Actions reported under their own name in the metrics; anything else a charger sends is 'unknown'
+METRIC_ACTIONS = frozenset(create_route_map(ChargePoint(None, None)))
+
+# OCPP measurands we keep, mapped to the MeterValueChunk column and the unit it is stored in
+MEASURANDS = {
+    'Energy.Active.Import.Register': ('energy', 'Wh'),
+    'Power.Active.Import': ('power', 'W'),
+    'Current.Import': ('current', 'A'),
+    'Voltage': ('voltage', 'V'),
+}
+UNIT_SCALES = {'kWh': ('Wh', 1000), 'kW': ('W', 1000)}
+
+def parse_timestamp(value):
+    """
+    Parse an OCPP timestamp into an aware datetime, or return None if it is missing or invalid.
+
+    OCPP timestamps are UTC, but the schema does not require an offset: one without is taken as UTC.
+    """
+    if not isinstance(value, str):
+        return None
+    try:
+        timestamp = parse_datetime(value)
+    except ValueError:
+        # Well formed, but not a date, e.g. a 13th month
+        return None
+    if timestamp is not None and timezone.is_naive(timestamp):
+        timestamp = timestamp.replace(tzinfo=dt_timezone.utc)
+    return timestamp
+
+def parse_meter_values(meter_values):
+    """
+    Flatten the ``meterValue`` list of a MeterValues payload
+    into samples with a ``timestamp`` and the measurements in ``MEASURANDS``.
+    """
+    samples = []
+    for meter_value in meter_values:
+        sample = {'timestamp': parse_timestamp(meter_value.get('timestamp')) or now()}
+        for sampled_value in meter_value.get('sampledValue', []):
+            # Energy.Active.Import.Register is the default measurand in OCPP 1.6
+            measurand = sampled_value.get('measurand', 'Energy.Active.Import.Register')
+            if measurand not in MEASURANDS:
+                continue
+            name, unit = MEASURANDS[measurand]
+            try:
+                value = float(sampled_value['value'])
+            except (KeyError, TypeError, ValueError):
+                continue
+            sampled_unit = sampled_value.get('unit', unit)
+            if sampled_unit in UNIT_SCALES and UNIT_SCALES[sampled_unit][0] == unit:
+                value *= UNIT_SCALES[sampled_unit][1]
+            sample[name] = value
+        if len(sample) > 1:
+            samples.append(sample)
+    return samples
+
 class BaseConsumer(AsyncJsonWebsocketConsumer):
 
     def __init__(self, *args, **kwargs):
         self.charger_id = None
         self.station_id = None
         self.user = None
+        self.customer = None
+        self.sessions = None
         self.group_name = None
+        self.presence = None
+        self.presence_refreshed_at = 0
+        self.command_tasks = set()
+        self.log = ChargerLogAdapter(logger, {})
+        # Resolved once per connection rather than for every frame
+        self.loads, self.dumps = get_codec()
         super().__init__(*args, **kwargs)
 
     async def broadcast_status(self, event):
 
-        logger.info("Broadcasting status to all connected consumers.")
+        self.log.debug("Broadcasting status of %s", event['charger_serial_number'])
         await self.send_json({
             'event': 'status_update',
             'charger_id': event['charger_serial_number'],
             'status': event['status'],
         })
 
+    async def broadcast_status_batch(self, event):
+
+        self.log.debug("Broadcasting %d status changes for station %s", len(event['updates']), event['station_code'])
+        await self.send_json({
+            'event': 'status_batch',
+            'station_code': event['station_code'],
+            'updates': event['updates'],
+        })
+
     async def broadcast_heartbeat(self, event):
 
-        logger.info("Broadcasting heartbeat to all connected consumers.")
+        self.log.debug("Broadcasting heartbeat of %s", event['charger_serial_number'], extra={'action': 'Heartbeat'})
         await self.send_json({
             'event': 'heartbeat_update',
             'charger_id': event['charger_serial_number'],
             'time': event['time'],
         })
 
-    @database_sync_to_async
-    def save_status(self, serial_number, status, payload):
-        with transaction.atomic():
-            charger, _ = EVCharger.objects.get_or_create(serial_number=serial_number)
-            StatusLog.objects.create(charger=charger,
-                                     status=status,
-                                     payload=payload)
-            logger.info(
-                f"Status update received from charger {serial_number}: {status} - {payload}"
-            )
-
-    @database_sync_to_async
-    def save_heartbeat(self, serial_number, data):
-        charger, _ = EVCharger.objects.get_or_create(serial_number=serial_number)
-        HeartbeatLog.objects.create(charger=charger, payload=data)
-        logger.info(f"Heartbeat saved for charger {serial_number}: {data}")
-
-    @database_sync_to_async
-    def save_transaction(self, serial_number, command):
-        if not hasattr(self, 'user') or self.user is None or not self.user.is_authenticated:
-            logger.error("Cannot save transaction: No authenticated user")
-            return
+    async def broadcast_heartbeat_batch(self, event):
 
-        try:
-            customer = Customer.objects.get(user=self.user)
-        except Customer.DoesNotExist:
-            logger.error(f"No Customer found for user {self.user}")
-            return
+        self.log.debug("Broadcasting %d heartbeats for station %s", len(event['heartbeats']), event['station_code'])
+        await self.send_json({
+            'event': 'heartbeat_batch',
+            'station_code': event['station_code'],
+            'heartbeats': event['heartbeats'],
+        })
 
-        try:
-            charger = EVCharger.objects.get(serial_number=serial_number)
-        except EVCharger.DoesNotExist:
-            logger.error(f"No charger found with serial number {serial_number}")
-            return
+    async def decode_json(self, text_data):
+        return self.loads(text_data)
+
+    async def encode_json(self, content):
+        return self.dumps(content)
+
+    @property
+    def log_writer(self):
+        return get_log_writer()
+
+    @property
+    def status_broadcaster(self):
+        return get_status_broadcaster(self.channel_layer)
+
+    async def save_status(self, serial_number, status, payload):
+        await self.log_writer.put(StatusLog, serial_number,
+                                  status=status,
+                                  payload=payload,
+                                  date=now())
+        self.log.debug("Status update received: %s - %s", status, payload, extra={'action': 'StatusNotification'})
+
+    async def save_meter_values(self, serial_number, payload):
+        samples = parse_meter_values(payload.get('meterValue', []))
+        meter_writer = get_meter_writer()
+        for sample in samples:
+            await meter_writer.put(MeterValueChunk, serial_number, **sample)
+        self.log.debug("Queued %d meter samples", len(samples), extra={'action': 'MeterValues'})
+        return samples
+
+    async def save_heartbeat(self, serial_number, data):
+        await self.log_writer.put(HeartbeatLog, serial_number, payload=data, received_at=now())
+        self.log.debug("Heartbeat queued: %s", data, extra={'action': 'Heartbeat'})
+
+    async def get_customer(self):
+        """Return the customer of the authenticated user, or None."""
+        # Operators and admins have no customer; only a customer user without one is amiss
+        if self.customer is None and getattr(self.user, 'type', None) == 'customer':
+            self.log.warning("No Customer found for user %s", self.user)
+        return self.customer
+
+    async def update_charger_status(self, serial_number, status='available'):
+        charger = await charger_registry.load(serial_number)
+        changed_at = now()
+        # Always written through: the registry of this process may not have seen the liveness
+        # monitor's bulk UPDATE or another worker's writes. It only keeps the broadcast in step
+        charger_registry.set_status(serial_number, status)
+        await self.set_charger_status(charger.id, status, changed_at)
+        await self.log_writer.put(StatusLog, serial_number, status=status, date=changed_at)
+        self.log.debug("Updated charger %s status to %s", serial_number, status)
 
+    @database_sync_to_async
+    def set_charger_status(self, charger_id, status, changed_at):
         with transaction.atomic():
-            Transaction.objects.create(
-                charger=charger,
-                command=command,
-                customer=customer
+            EVCharger.objects.filter(id=charger_id).exclude(status=status, offline_status__isnull=True).update(
+                status=status, offline_status=None
             )
+            StatusInterval.objects.transition(charger_id, status, changed_at)
 
-        logger.info(f"Transaction saved for charger {serial_number} with command {command}")
-
-    @database_sync_to_async
-    def update_charger_status(self, serial_number, status='available'):
-
-        charger, _ = EVCharger.objects.get_or_create(serial_number=serial_number)
-        charger.status = status
-        charger.save()
-
-        StatusLog.objects.create(charger=charger, status=status)
-        logger.info(f"Updated charger {serial_number} status to {status}")
+    async def authenticate(self):
+        """
+        Takes the user the ``JWTAuthMiddleware`` authenticated from the connection's token, and
+        the user's customer. Sets ``self.user`` to an AnonymousUser if there is no valid token.
+        """
+        self.user = self.scope.get('user') or AnonymousUser()
+        self.customer = self.scope.get('customer')
+        if self.user.is_authenticated:
+            self.log.info("User authenticated: %s with ID %s", self.user.username, self.user.id)
+        else:
+            self.log.error("Connection without a valid token")
 
-    @database_sync_to_async
-    def get_latest_status(self, charger_id):
-        try:
-            return EVCharger.objects.get(
-                serial_number=charger_id
-            ).status
-        except EVCharger.DoesNotExist:
+    async def get_latest_status(self, charger_id):
+        charger = await charger_registry.load(charger_id)
+        if charger is None:
             return "Unknown"
+        return charger.status
 
 class MonitoringConsumer(BaseConsumer):
 
@@ -169,30 +392,8 @@ class MonitoringConsumer(BaseConsumer):
         self.station_id = self.scope['url_route']['kwargs']['station_code']
         self.charger_id = self.scope['url_route']['kwargs']['serial_number']
         self.group_name = f'ev_charger_{self.charger_id}'
-        # Extract token from the authorization header
-        token = None
-        for header in self.scope['headers']:
-            if header[0] == b'authorization':
-                token = header[1].decode().split(' ')[1]  # Extract token part from 'Bearer <token>'
-                break
-
-        # if not token:
-        #     await self.close()
-        #     return
-
-        logger.info(f"Token received: {'*' * 10}")
-
-        try:
-            # Decode and validate the token
-            access_token = AccessToken(token)
-            user_id = access_token['user_id']
-            self.user = await database_sync_to_async(get_user_model().objects.get)(id=user_id)
-            self.scope['user'] = self.user
-            logger.info(f"User authenticated: {self.user.username} with ID {user_id}")
-        except Exception as e:
-            logger.error(f"Token validation failed: {e}")
-            self.scope['user'] = AnonymousUser()
-            self.user = AnonymousUser()
+        self.log = ChargerLogAdapter(logger, {'charger_id': self.charger_id, 'station_id': self.station_id})
+        await self.authenticate()
 
         # Check if the user is authenticated
         # if not self.scope['user'].is_authenticated:
@@ -203,24 +404,42 @@ class MonitoringConsumer(BaseConsumer):
             self.group_name,
             self.channel_name
         )
-        logger.info(f"Scope user: {self.user}, Charger ID: {self.charger_id}")
+        await self.log_writer.acquire()
+        await get_meter_writer().acquire()
         subprotocols = self.scope.get("subprotocols", [])
         if "ocpp1.6" in subprotocols:
             await self.accept(subprotocol="ocpp1.6")
         else:
             await self.accept()
 
+        # Load the charger once per connection, later messages read it from the registry
+        charger = await charger_registry.load(self.charger_id, refresh=True)
+        self.sessions = ConnectorSessions(charger.id if charger else None, get_transaction_id_allocator())
+
         # Initialize ChargePoint instance and register router
         self.charge_point = ChargePoint(self.charger_id, self)
+        self.commands = CommandRunner(self.charge_point)
 
         # Store the charge point globally for later access
         connected_chargers[self.charger_id] = self.charge_point
+        CONNECTED_CHARGERS.inc()
+
+        # Claim the charger cluster-wide so commands from any worker are routed to this consumer
+        self.presence = ChargerPresence(self.channel_layer)
+        await self.presence.register(self.charger_id, self.channel_name)
+        self.presence_refreshed_at = time.monotonic()
+
+        # Start the charger's heartbeat deadline
+        self.liveness = get_liveness_monitor(self.channel_layer)
+        await self.mark_seen()
 
         # 🔁 Get the latest status and send it
         status = await self.get_latest_status(self.charger_id)
+        self.status_broadcaster.seed(self.charger_id, status)
+        self.report_load(status)
         await self.send_json({"status": status})
         await self.send_json({"message": f"Connected to charger {self.charger_id}"})
-        logger.info(f"Charger {self.charger_id} connected.")
+        self.log.info("Charger %s connected", self.charger_id)
 
     async def disconnect(self, close_code):
 
@@ -237,24 +456,44 @@ class MonitoringConsumer(BaseConsumer):
         """
         if self.charger_id in connected_chargers:
             del connected_chargers[self.charger_id]
+            CONNECTED_CHARGERS.dec()
+
+        if self.presence is not None:
+            await self.presence.unregister(self.charger_id, self.channel_name)
+            get_load_reporter(self.channel_layer).gone(self.charger_id, self.channel_name)
+            self.status_broadcaster.forget(self.charger_id)
+            await self.liveness.disconnected(self.charger_id, self.channel_name)
+
+        # The last charger to disconnect (e.g. on server shutdown) drains the pending log rows
+        await self.log_writer.release()
+        await get_meter_writer().release()
 
         if self.channel_layer is not None:
             await self.channel_layer.group_discard(
                 self.group_name,
                 self.channel_name
             )
-            logger.info(f"Station {self.charger_id} disconnected.")
+            self.log.info("Charger %s disconnected", self.charger_id)
         else:
             logger.error("Channel layer is not configured.")
 
+    async def receive(self, text_data=None, bytes_data=None, **kwargs):
+        # Start the frame's clock before the JSON is decoded, so the decode stage is measured too
+        self.frame_started = time.perf_counter()
+        await super().receive(text_data=text_data, bytes_data=bytes_data, **kwargs)
+
     async def receive_json(self, content, **kwargs):
         """
         Receives and processes JSON-decoded data sent from a charging station.
 
+        The time spent on each stage of the frame (decode, dispatch, persist, broadcast) is
+        recorded per action in ``Commanding.metrics``.
+
         Args:
             content (list or dict): Decoded JSON content from the charging station.
         """
-        logger.info("Receiving data from charging station.")
+        action = None
+        current = None
 
         try:
             msg = content  # Already decoded from JSON
@@ -262,122 +501,367 @@ class MonitoringConsumer(BaseConsumer):
             if isinstance(msg, list) and len(msg) > 0:
                 message_type = msg[0]
             else:
-                logger.warning(f"Unexpected message format: {msg}")
+                FRAME_ERRORS.inc('unknown', 'format')
+                self.log.warning("Unexpected message format: %s", msg)
+                return
+
+            if message_type == 2 and len(msg) > 2:
+                action = msg[2]
+                metric_action = action if action in METRIC_ACTIONS else 'unknown'
+            else:
+                metric_action = {3: 'CallResult', 4: 'CallError'}.get(message_type, 'unknown')
+            FRAMES.inc(metric_action)
+            timer = FrameTimer(STAGE_SECONDS, metric_action, getattr(self, 'frame_started', None))
+            timer.lap('decode')
+
+            await self.mark_seen()
+            await self.refresh_presence()
+
+            if message_type in (3, 4):
+                # CALLRESULT/CALLERROR answering a command we sent, hand it to the pending call()
+                await self.charge_point.dispatch(msg)
+                timer.lap('dispatch')
+                timer.done()
                 return
 
             if message_type != 2:
-                logger.warning(f"Unsupported message type: {msg}")
+                FRAME_ERRORS.inc(metric_action, 'format')
+                self.log.warning("Unsupported message type: %s", msg)
                 return
 
-            # Route the message through your internal handler
-            await self.charge_point.route_message(json.dumps(msg))
-            logger.debug(f"Message received: {msg}")
-            # Unpack action and payload
-            action = msg[2]
+            # Route the already decoded message through your internal handler
+            await self.charge_point.dispatch(msg)
+            timer.lap('dispatch')
+            # Unpack the payload
             payload = msg[3] if len(msg) > 3 else {}
 
             if action == "Heartbeat":
                 await self.save_heartbeat(self.charger_id, payload)
-                await self.channel_layer.group_send(
-                    self.group_name,
-                    {
-                        'type': 'broadcast_heartbeat',
-                        'charger_serial_number': self.charger_id,
-                        'time': str(now().isoformat()),
-                    }
-                )
-                logger.info(f"Broadcasted heartbeat to group {self.group_name}")
             elif action in ["StartTransaction", "StopTransaction"]:
-                await self.save_transaction(self.charger_id, action)
+                # The session itself was opened or closed by the ChargePoint handler
                 if action == "StartTransaction":
-                    status = "Charing"
+                    status = "Charging"
                 else:
                     status = "Available"
                 await self.update_charger_status(self.charger_id, status)
+            elif action == "MeterValues":
+                current = measured_current(await self.save_meter_values(self.charger_id, payload))
             elif action in ["StatusNotification", "DiagnosticsStatusNotification"]:
                 status = payload.get("status")
                 await self.save_status(self.charger_id, status, payload)
                 await self.update_charger_status(self.charger_id, status)
+            timer.lap('persist')
 
-            # Get latest charger info
-            status = await self.get_latest_status(self.charger_id)
-
-            # Broadcast status to group
-            if self.channel_layer is not None:
+            if action == "Heartbeat":
+                heartbeat_time = str(now().isoformat())
                 await self.channel_layer.group_send(
                     self.group_name,
                     {
-                        'type': 'broadcast_status',
+                        'type': 'broadcast_heartbeat',
                         'charger_serial_number': self.charger_id,
-                        'status': status,
+                        'time': heartbeat_time,
                     }
                 )
-                logger.info(f"Broadcasted status to group {self.group_name}")
+                # Station subscribers get it in the next heartbeat batch of the station
+                self.status_broadcaster.heartbeat(self.station_id, self.charger_id, heartbeat_time)
+                self.log.debug("Broadcasted heartbeat to group %s", self.group_name, extra={'action': action})
+
+            # Get latest charger info
+            status = await self.get_latest_status(self.charger_id)
+            self.report_load(status, current)
+
+            # Broadcast status to group, only if it changed (coalesced over STATUS_BROADCAST_WINDOW)
+            if self.channel_layer is not None:
+                if self.status_broadcaster.publish(self.station_id, self.charger_id, status):
+                    self.log.debug("Queued status %s for broadcast", status, extra={'action': action, 'status': status})
             else:
                 logger.error("Channel layer is not configured.")
+            timer.lap('broadcast')
+            timer.done()
+            # One structured record per frame; high-volume actions are sampled (OCPP_LOG_SAMPLING)
+            self.log.info("Handled %s", metric_action, extra={
+                'action': metric_action,
+                'latency_ms': round((time.perf_counter() - timer.started) * 1000, 3),
+            })
 
         except Exception as e:
-            logger.error(f"[{self.charger_id}] Error processing message: {e}")
+            FRAME_ERRORS.inc(action if action in METRIC_ACTIONS else 'unknown', 'exception')
+            self.log.exception("Error processing message: %s", e, extra={'action': action})
             await self.send_json({'error': str(e)})
 
+    async def mark_seen(self):
+        """
+        Pushes back the charger's liveness deadline. A charger that had been marked unavailable
+        gets back the status it had before.
+        """
+        self.liveness.seen(self.charger_id, self.station_id, self.channel_name)
+        await self.liveness.returned(self.charger_id, self.station_id)
+
+    def report_load(self, status, current=None):
+        """
+        Reports whether a car is plugged in and, after MeterValues, the current it draws, to the
+        load balancer of the charger's station (see ``Commanding.loadbalancer``).
+        """
+        active = bool(self.sessions and self.sessions.active) or str(status).lower() in ACTIVE_STATUSES
+        get_load_reporter(self.channel_layer).report(self.charger_id, self.channel_name, active, current)
+
+    async def refresh_presence(self):
+        """
+        Extends the charger's presence registration while it keeps talking to us. The key is only
+        rewritten once a third of its TTL has passed, not on every frame.
+        """
+        if time.monotonic() - self.presence_refreshed_at < self.presence.ttl / 3:
+            return
+        await self.presence.refresh(self.charger_id, self.channel_name)
+        self.presence_refreshed_at = time.monotonic()
+
+    async def send_command(self, event):
+        """
+        Sends a command routed to this consumer through ``ChargerPresence`` to the charge point.
+
+        Args:
+            event (dict): Channel layer message with the OCPP action in ``command``, its
+                camelCase payload in ``payload`` and, optionally, the ``command_id``, ``timeout``,
+                ``expires_at`` and ``reply_to`` channel the result is sent to.
+        """
+        # The CALLRESULT arrives through receive_json on this same consumer, so the call must not
+        # block the handler that is waiting for it.
+        task = asyncio.ensure_future(self.run_command(event))
+        self.command_tasks.add(task)
+        task.add_done_callback(self.command_tasks.discard)
+
+    async def run_command(self, event):
+        command = event['command']
+        self.log.info("Sending command %s", command, extra={'command': command})
+        result = await self.commands.run(
+            command, event.get('payload'), event.get('command_id'), event.get('timeout'),
+            expires_at=event.get('expires_at'),
+        )
+        if result['status'] != COMPLETED:
+            self.log.warning("Command %s %s: %s", command, result['status'], result.get('error'),
+                             extra={'command': command})
+        if event.get('reply_to'):
+            await self.channel_layer.send(event['reply_to'], {
+                'type': 'command.result',
+                'command_id': event.get('command_id'),
+                **result,
+            })
+
 class CommandingConsumer(BaseConsumer):
 
     async def connect(self):
         self.station_id = self.scope['url_route']['kwargs']['station_code']
         self.charger_id = self.scope['url_route']['kwargs']['serial_number']
         self.group_name = f'ev_charger_{self.charger_id}'
+        self.log = ChargerLogAdapter(logger, {'charger_id': self.charger_id, 'station_id': self.station_id})
+        self.presence = ChargerPresence(self.channel_layer)
         await self.accept()
-        logger.info(f"Connected to commanding consumer for charger {self.charger_id}")
+        self.log.info("Connected to commanding consumer for charger %s", self.charger_id)
+
+    @staticmethod
+    def parse_command(content):
+        """
+        Accepts either an OCPP CALL frame ``[2, id, action, payload]`` or ``{"action": ..., "payload": ...}``
+        and returns the action and its payload.
+        """
+        if isinstance(content, list) and len(content) > 2:
+            return content[2], content[3] if len(content) > 3 else {}
+        if isinstance(content, dict):
+            return content.get("action"), content.get("payload", {})
+        return None, {}
 
     async def receive_json(self, content, **kwargs):
-        command = content.get("action")
+        command, payload = self.parse_command(content)
         target_charger = self.charger_id
-        logger.info(f"Sending command {command} to charger {target_charger}")
+        if not command:
+            await self.send_json({'error': 'missing command action.'})
+            return
+        self.log.info("Sending command %s", command, extra={'command': command})
 
-        # Route the message through your internal handler
-        await self.charge_point.route_message(json.dumps(content))
-        try:
-            charger = EVCharger.objects.get(serial_number=target_charger)
-        except EVCharger.DoesNotExist:
-            logger.error(f"Charger {target_charger} does not exist.")
+        # Read afresh: the status may have been changed by another worker or the liveness monitor
+        charger = await charger_registry.load(target_charger, refresh=True)
+        if charger is None:
+            self.log.error("Charger %s does not exist", target_charger)
             return
         # Check if the charger is already busy or available
         if command.lower() == 'remotestarttransaction' and charger.status == 'charging':
-            logger.info(f"Charger {target_charger} is already charging, ignoring command.")
+            self.log.info("Charger %s is already charging, ignoring command", target_charger)
             await self.send_json({
                 'error': 'target charger is busy, cannot start charging.',
             })
             return
         elif command.lower() == 'remotestoptransaction' and charger.status == 'available':
-            logger.info(f"Charger {target_charger} is already available, ignoring command.")
+            self.log.info("Charger %s is already available, ignoring command", target_charger)
             await self.send_json({
                 'error': 'target charger is already idle, cannot stop charging.',
             })
             return
-        # If the command is compatible with the charger status, send it
+        # If the command is compatible with the charger status, send it. Waiting for the answer
+        # must not hold up the next command of this client, so it is done in a task
         else:
-            try:
-                await self.save_transaction(target_charger, command)
-                # Update charger status based on command
-                cmd = command.lower()
-                if 'start' in cmd:
-                    status = 'charging'
-                elif 'stop' in cmd:
-                    status = 'available'
-                else:
-                    logger.error(f"Command {command} not supported for charger {target_charger}.")
-                await self.update_charger_status(target_charger, status)
-                await self.charge_point.route_message(content)
+            task = asyncio.ensure_future(self.forward_command(target_charger, command, payload))
+            self.command_tasks.add(task)
+            task.add_done_callback(self.command_tasks.discard)
 
-                await self.channel_layer.group_send(
-                    self.group_name,
-                    {
-                        'type': 'broadcast_status',
-                        'charger_serial_number': self.charger_id,
-                        'status': status,
-                    }
-                )
-                logger.info(f"Command sent to charger {target_charger}: {command}")
-            except Exception as e:
-                logger.error(f"Error sending command to charger {target_charger}: {e}")
-                await self.send_json({'error': str(e)})
\ No newline at end of file
+    async def forward_command(self, target_charger, command, payload):
+        """
+        Sends ``command`` to whichever worker holds the charger's websocket, relays the result to
+        this client, and updates the charger status once the charger accepted a remote start or stop.
+        """
+        try:
+            result = await send_command(self.channel_layer, target_charger, command, payload)
+            if result['status'] == 'not_connected':
+                await self.send_json({'error': 'target charger is not connected.'})
+                return
+            await self.send_json({'event': 'command_result', 'command': command, **result})
+            if result['status'] != COMPLETED or result['payload'].get('status') != 'Accepted':
+                self.log.info("Command %s to charger %s: %s", command, target_charger, result['status'],
+                              extra={'command': command})
+                return
+
+            # Update charger status based on command
+            cmd = command.lower()
+            if 'start' in cmd:
+                status = 'charging'
+            elif 'stop' in cmd:
+                status = 'available'
+            else:
+                self.log.info("Command %s sent to charger %s", command, target_charger, extra={'command': command})
+                return
+            await self.update_charger_status(target_charger, status)
+            self.status_broadcaster.publish(self.station_id, self.charger_id, status)
+            self.log.info("Command %s sent to charger %s", command, target_charger, extra={'command': command})
+        except Exception as e:
+            self.log.error("Error sending command to charger %s: %s", target_charger, e, extra={'command': command})
+            await self.send_json({'error': str(e)})
+
+
+def followable_stations(station_codes, organization=None, user=None):
+    """
+    Resolve the stations in ``station_codes`` and those of the organization with the acronym
+    ``organization`` to the codes of the stations that exist. Given a ``user`` that is not staff,
+    only the stations the user's organization owns are kept.
+
+    Returns:
+        list: Station codes, sorted.
+    """
+    stations = Station.objects.filter(station_code__in=station_codes)
+    if organization:
+        stations = stations | Station.objects.filter(organization__acronym=organization)
+    if user is not None and not user.is_staff:
+        stations = stations.filter(organization__user=user)
+    return sorted(stations.values_list('station_code', flat=True).distinct())
+
+
+def load_snapshot(station_codes):
+    """
+    Read the chargers of the stations in ``station_codes``, with their status and last
+    heartbeat, in one query.
+
+    Returns:
+        list: ``{'station_code', 'charger_id', 'status', 'last_heartbeat'}`` dicts.
+    """
+    chargers = EVCharger.objects.filter(station__station_code__in=station_codes)
+    last_heartbeat = HeartbeatLog.objects.filter(charger=OuterRef('pk')).order_by('-received_at').values('received_at')[:1]
+    rows = chargers.annotate(last_heartbeat=Subquery(last_heartbeat)).order_by('station__station_code', 'serial_number')
+    return [
+        {
+            'station_code': station_code,
+            'charger_id': serial_number,
+            'status': status,
+            'last_heartbeat': heartbeat.isoformat() if heartbeat else None,
+        }
+        for station_code, serial_number, status, heartbeat in rows.values_list(
+            'station__station_code', 'serial_number', 'status', 'last_heartbeat'
+        )
+    ]
+
+class SubscriptionConsumer(BaseConsumer):
+    """
+    One websocket over which a dashboard follows whole stations or organizations.
+
+    The client sends ``{"action": "subscribe", "stations": [...]}`` (station codes) and/or
+    ``{"action": "subscribe", "organization": "<acronym>"}``, and ``"unsubscribe"`` likewise.
+    A subscription answers with a ``snapshot`` frame holding the status and last heartbeat of
+    every charger of the stations, read with one query, then joins their ``ev_station_<code>``
+    groups. From then on the status and heartbeat batches the ``StatusBroadcaster`` publishes per
+    station are merged, keeping the latest value per charger, and sent as one ``updates``
+    frame per ``SUBSCRIPTION_FLUSH_WINDOW`` seconds, however many stations are followed.
+
+    Users that are not staff only follow the stations their organization owns, whether or not
+    they have chargers yet; the others are left out of the snapshot and never joined.
+    """
+
+    async def connect(self):
+        await self.authenticate()
+        if not self.user.is_authenticated:
+            await self.close(code=4401)
+            return
+        self.stations = set()
+        self.max_stations = getattr(settings, "SUBSCRIPTION_MAX_STATIONS", 1000)
+        self.window = getattr(settings, "SUBSCRIPTION_FLUSH_WINDOW", 0.5)
+        self.pending_status = {}
+        self.pending_heartbeats = {}
+        self.flush_task = None
+        self.log = ChargerLogAdapter(logger, {'user': self.user.username})
+        await self.accept()
+
+    async def disconnect(self, close_code):
+        for station_code in getattr(self, 'stations', ()):
+            await self.channel_layer.group_discard(f'ev_station_{station_code}', self.channel_name)
+        if getattr(self, 'flush_task', None) is not None:
+            self.flush_task.cancel()
+
+    async def receive_json(self, content, **kwargs):
+        if not isinstance(content, dict) or content.get('action') not in ('subscribe', 'unsubscribe'):
+            await self.send_json({'error': 'expected {"action": "subscribe" or "unsubscribe", "stations": [...]}'})
+            return
+        station_codes = content.get('stations') or []
+        organization = content.get('organization')
+        if not isinstance(station_codes, list) or not all(isinstance(code, str) for code in station_codes):
+            await self.send_json({'error': 'stations must be a list of station codes'})
+            return
+
+        stations = await database_sync_to_async(followable_stations)(station_codes, organization, self.user)
+        if content['action'] == 'unsubscribe':
+            for station_code in set(stations) & self.stations:
+                await self.channel_layer.group_discard(f'ev_station_{station_code}', self.channel_name)
+                self.stations.discard(station_code)
+            await self.send_json({'event': 'unsubscribed', 'stations': sorted(self.stations)})
+            return
+
+        new = set(stations) - self.stations
+        if len(self.stations) + len(new) > self.max_stations:
+            await self.send_json({'error': f'at most {self.max_stations} stations can be followed'})
+            return
+        for station_code in new:
+            await self.channel_layer.group_add(f'ev_station_{station_code}', self.channel_name)
+        self.stations |= new
+        chargers = await database_sync_to_async(load_snapshot)(stations)
+        await self.send_json({'event': 'snapshot', 'stations': sorted(self.stations), 'chargers': chargers})
+        self.log.info("Subscribed to %d stations", len(new))
+
+    async def broadcast_status_batch(self, event):
+        for update in event['updates']:
+            self.pending_status[update['charger_id']] = {'station_code': event['station_code'], **update}
+        self.schedule_flush()
+
+    async def broadcast_heartbeat_batch(self, event):
+        for heartbeat in event['heartbeats']:
+            self.pending_heartbeats[heartbeat['charger_id']] = {'station_code': event['station_code'], **heartbeat}
+        self.schedule_flush()
+
+    def schedule_flush(self):
+        if self.flush_task is None:
+            self.flush_task = asyncio.ensure_future(self.flush_later())
+
+    async def flush_later(self):
+        await asyncio.sleep(self.window)
+        self.flush_task = None
+        status, self.pending_status = self.pending_status, {}
+        heartbeats, self.pending_heartbeats = self.pending_heartbeats, {}
+        await self.send_json({
+            'event': 'updates',
+            'status': list(status.values()),
+            'heartbeats': list(heartbeats.values()),
+        })
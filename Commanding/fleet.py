@@ -0,0 +1,160 @@
+import asyncio
+import logging
+import time
+from collections import Counter
+from channels.db import database_sync_to_async
+from datetime import timedelta
+from django.conf import settings
+from django.db.models import F
+from django.utils.timezone import now
+from Charging.models import EVCharger
+from Commanding.commands import send_command
+from Commanding.models import CommandJob, CommandJobResult
+
+logger = logging.getLogger(__name__)
+
+# Target keys of a bulk command -> EVCharger lookup they filter on
+TARGET_FILTERS = {
+    'station': 'station__station_code',
+    'organization': 'station__organization__acronym',
+    'status': 'status',
+    'model': 'model',
+    'vendor': 'vendor',
+    'serial_numbers': 'serial_number__in',
+}
+
+# Jobs being rolled out by this process, kept referenced until they finish
+_running = set()
+
+def resolve_targets(user, targets):
+    """
+    Return the ``(id, serial number)`` of the chargers matching ``targets``, a dict of
+    ``TARGET_FILTERS`` keys; users that are not staff only reach their organization's chargers.
+    """
+    chargers = EVCharger.objects.filter(**{TARGET_FILTERS[key]: value for key, value in targets.items()})
+    if not user.is_staff:
+        chargers = chargers.filter(station__organization__user=user)
+    return list(chargers.order_by('id').values_list('id', 'serial_number'))
+
+def interrupt_orphaned_jobs():
+    """
+    Mark as finished, at their last save, the running jobs that were not saved for
+    ``BULK_COMMAND_ORPHAN_AFTER`` seconds: the process rolling them out stopped, and with it the
+    rollout. Their state is then ``interrupted``.
+
+    Returns:
+        int: The number of jobs marked.
+    """
+    stale = now() - timedelta(seconds=getattr(settings, "BULK_COMMAND_ORPHAN_AFTER", 60))
+    interrupted = CommandJob.objects.filter(finished_at__isnull=True, updated_at__lt=stale).update(
+        finished_at=F('updated_at')
+    )
+    if interrupted:
+        logger.warning("Marked %d orphaned command jobs interrupted", interrupted)
+    return interrupted
+
+class FleetCommand:
+    """
+    Sends the command of a :class:`CommandJob` to every target charger.
+
+    Up to ``concurrency`` commands (``BULK_COMMAND_CONCURRENCY``) are in flight at once; each is
+    routed to the worker holding its charger's websocket by :func:`send_command`, so the
+    rollout spreads over all workers. Results are handed to :meth:`stream` as they arrive and
+    written to the job in batches, every ``BULK_COMMAND_FLUSH_SIZE`` results or
+    ``BULK_COMMAND_FLUSH_INTERVAL`` seconds, with the job's progress counts.
+
+    The rollout runs in a task of its own: a client that stops reading the stream does not stop
+    it, and its progress can still be followed on the job. The job is saved at least every
+    ``BULK_COMMAND_FLUSH_INTERVAL`` seconds, even while no result arrives, so that a job that
+    stopped being saved is known to be orphaned.
+
+    Args:
+        job (CommandJob): The job, already saved with its ``total``.
+        targets (list): ``(id, serial number)`` of the chargers.
+        channel_layer: The channel layer commands are routed through.
+    """
+
+    def __init__(self, job, targets, channel_layer, concurrency=None):
+        self.job = job
+        self.targets = targets
+        self.channel_layer = channel_layer
+        self.concurrency = concurrency or getattr(settings, "BULK_COMMAND_CONCURRENCY", 500)
+        self.flush_size = getattr(settings, "BULK_COMMAND_FLUSH_SIZE", 500)
+        self.flush_interval = getattr(settings, "BULK_COMMAND_FLUSH_INTERVAL", 1.0)
+        self.counts = Counter()
+        self.listening = True
+        self._results = asyncio.Queue()
+        self._unsaved = []
+        self._flushed_at = time.monotonic()
+
+    def start(self):
+        task = asyncio.get_running_loop().create_task(self.run())
+        _running.add(task)
+        task.add_done_callback(_running.discard)
+        return task
+
+    async def run(self):
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def send(charger_id, serial_number):
+            async with semaphore:
+                result = await send_command(self.channel_layer, serial_number, self.job.command, self.job.payload)
+            await self.record(charger_id, serial_number, result)
+
+        keepalive = asyncio.get_running_loop().create_task(self.keepalive())
+        try:
+            await asyncio.gather(*(send(charger_id, serial_number) for charger_id, serial_number in self.targets))
+        finally:
+            keepalive.cancel()
+            self.job.finished_at = now()
+            await self.flush()
+            self._results.put_nowait(None)
+            logger.info("Command job %s (%s) finished: %s", self.job.id, self.job.command, dict(self.counts))
+
+    async def keepalive(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            if time.monotonic() - self._flushed_at >= self.flush_interval:
+                await self.flush()
+
+    async def record(self, charger_id, serial_number, result):
+        status = result['status']
+        self.counts[status] += 1
+        response = result.get('payload') if 'payload' in result else result.get('error')
+        self._unsaved.append(CommandJobResult(
+            job_id=self.job.id, charger_id=charger_id, status=status, response=response
+        ))
+        if self.listening:
+            self._results.put_nowait({'charger': serial_number, **result})
+        if len(self._unsaved) >= self.flush_size or time.monotonic() - self._flushed_at >= self.flush_interval:
+            await self.flush()
+
+    async def flush(self):
+        unsaved, self._unsaved = self._unsaved, []
+        self._flushed_at = time.monotonic()
+        self.job.done += len(unsaved)
+        self.job.counts = dict(self.counts)
+        await database_sync_to_async(self.save)(unsaved)
+
+    def save(self, results):
+        CommandJobResult.objects.bulk_create(results, batch_size=1000)
+        self.job.save(update_fields=['done', 'counts', 'finished_at', 'updated_at'])
+
+    def stream(self):
+        """
+        Return an async iterator over the job as it started, then the result of each charger as it
+        arrives, then the finished job.
+        """
+        return self._stream(self.job.as_dict())
+
+    async def _stream(self, started):
+        try:
+            yield started
+            while True:
+                result = await self._results.get()
+                if result is None:
+                    break
+                yield result
+            yield self.job.as_dict()
+        finally:
+            self.listening = False
@@ -0,0 +1,264 @@
+import asyncio
+import logging
+import math
+import time
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils.timezone import now
+from ocpp.v16.enums import ChargePointStatus
+from Charging.models import EVCharger
+from Charging.registry import charger_registry
+from Commanding.broadcast import get_status_broadcaster
+from Commanding.metrics import CHARGERS_TIMED_OUT
+from Commanding.models import StatusInterval, StatusLog
+from Commanding.persistence import get_log_writer
+from Commanding.presence import ChargerPresence
+
+logger = logging.getLogger(__name__)
+
+UNAVAILABLE = ChargePointStatus.unavailable.value
+
+class TimerWheel:
+    """
+    Hashed timer wheel of deadlines, one per key.
+
+    Time is cut into ticks of ``resolution`` seconds and a deadline is stored in the slot of its
+    tick, modulo the number of slots. Scheduling, rescheduling and cancelling are O(1) set
+    operations, and :meth:`advance` only visits the slots of the ticks that passed, so its cost
+    is the number of keys expiring (plus keys of later turns of the wheel sharing those slots,
+    which a wheel spanning the usual timeout keeps rare) instead of the number of keys tracked.
+
+    Args:
+        resolution (float): Seconds per tick; deadlines fire at most this late.
+        slots (int): Number of slots of the wheel.
+        now (float): Current time, ``time.monotonic()`` by default.
+    """
+
+    def __init__(self, resolution=1.0, slots=64, now=None):
+        self.resolution = resolution
+        self.slots = [set() for _ in range(slots)]
+        self.deadlines = {}
+        self.tick = self._tick(time.monotonic() if now is None else now)
+
+    def __len__(self):
+        return len(self.deadlines)
+
+    def __contains__(self, key):
+        return key in self.deadlines
+
+    def _tick(self, at):
+        return math.floor(at / self.resolution)
+
+    def schedule(self, key, deadline):
+        """Set the deadline of ``key``, replacing any earlier one."""
+        tick = max(math.ceil(deadline / self.resolution), self.tick + 1)
+        current = self.deadlines.get(key)
+        if current == tick:
+            return
+        if current is not None:
+            self.slots[current % len(self.slots)].discard(key)
+        self.deadlines[key] = tick
+        self.slots[tick % len(self.slots)].add(key)
+
+    def cancel(self, key):
+        tick = self.deadlines.pop(key, None)
+        if tick is not None:
+            self.slots[tick % len(self.slots)].discard(key)
+
+    def advance(self, now):
+        """
+        Move the wheel to ``now`` and return the keys whose deadline passed, which are removed.
+        """
+        target = self._tick(now)
+        expired = []
+        # After a pause longer than a turn of the wheel every slot is visited once
+        for tick in range(self.tick + 1, min(target, self.tick + len(self.slots)) + 1):
+            slot = self.slots[tick % len(self.slots)]
+            due = [key for key in slot if self.deadlines[key] <= target]
+            for key in due:
+                slot.discard(key)
+                del self.deadlines[key]
+            expired.extend(due)
+        self.tick = max(self.tick, target)
+        return expired
+
+def mark_unavailable(serial_numbers, at):
+    """
+    Set the chargers among ``serial_numbers`` that are not already unavailable to unavailable,
+    with one UPDATE that keeps their status in ``offline_status``, and close their status
+    intervals.
+
+    Returns:
+        dict: Serial number -> status before, of the chargers that changed.
+    """
+    with transaction.atomic():
+        chargers = list(
+            EVCharger.objects.select_for_update()
+            .filter(serial_number__in=serial_numbers)
+            .exclude(status=UNAVAILABLE)
+            .values_list('id', 'serial_number', 'status')
+        )
+        if not chargers:
+            return {}
+        EVCharger.objects.filter(id__in=[charger_id for charger_id, _, _ in chargers]).update(
+            status=UNAVAILABLE, offline_status=F('status')
+        )
+        StatusInterval.objects.transition_many([charger_id for charger_id, _, _ in chargers], UNAVAILABLE, at)
+    return {serial_number: status for _, serial_number, status in chargers}
+
+def restore_statuses(statuses, at):
+    """
+    Set the chargers of ``statuses`` (serial number -> status) that are still unavailable back to
+    their status, and reopen their status intervals.
+
+    Returns:
+        list: The serial numbers of the chargers restored.
+    """
+    restored = []
+    with transaction.atomic():
+        chargers = EVCharger.objects.select_for_update().filter(serial_number__in=statuses, status=UNAVAILABLE)
+        for charger_id, serial_number in chargers.values_list('id', 'serial_number'):
+            EVCharger.objects.filter(id=charger_id).update(status=statuses[serial_number], offline_status=None)
+            StatusInterval.objects.transition(charger_id, statuses[serial_number], at)
+            restored.append(serial_number)
+    return restored
+
+class LivenessMonitor:
+    """
+    Marks chargers unavailable when they stop talking to this worker.
+
+    Consumers call :meth:`seen` for every frame their charger sends, which pushes its deadline
+    to ``timeout`` seconds later (``CHARGER_PRESENCE_TTL``, a few ``HEARTBEAT_INTERVAL`` handed
+    out in ``BootNotification``). A background task advances a :class:`TimerWheel` every
+    ``resolution`` seconds (``LIVENESS_TICK``); the chargers that missed their deadline are set
+    to unavailable together with a single UPDATE, and only then is a status change broadcast.
+
+    A charger that meanwhile reconnected to another worker is left alone: its presence
+    registration points at another channel, and the worker it is now connected to tracks it. A
+    charger seen again while it was being marked unavailable gets its status back. A charger
+    whose websocket closes is marked unavailable right away (:meth:`disconnected`).
+
+    The status a charger had is kept in ``EVCharger.offline_status``, and a charger that comes
+    back, with a frame or by reconnecting to any worker, is given it back (:meth:`returned`):
+    an OCPP 1.6 charger sends no ``StatusNotification`` for a status that did not change, so it
+    would otherwise stay unavailable. The ones it sends later override it as usual.
+
+    Attributes:
+        channel_layer: The channel layer status changes are broadcast on.
+        timeout (float): Seconds of silence after which a charger is unavailable.
+        wheel (TimerWheel): Deadlines of the chargers connected to this worker.
+    """
+
+    def __init__(self, channel_layer, timeout=None, resolution=None):
+        self.channel_layer = channel_layer
+        self.timeout = timeout or getattr(
+            settings, "CHARGER_PRESENCE_TTL", 3 * getattr(settings, "HEARTBEAT_INTERVAL", 10)
+        )
+        resolution = resolution or getattr(settings, "LIVENESS_TICK", 1.0)
+        # Two turns of the wheel per timeout keep nearly every slot down to the chargers expiring
+        self.wheel = TimerWheel(resolution, slots=max(8, 2 * math.ceil(self.timeout / resolution)))
+        self._owners = {}
+        self._loop = None
+        self._task = None
+
+    def seen(self, serial_number, station_code, channel_name):
+        """Record a frame from ``serial_number``, received by the consumer on ``channel_name``."""
+        self._owners[serial_number] = (station_code, channel_name)
+        self.wheel.schedule(serial_number, time.monotonic() + self.timeout)
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def returned(self, serial_number, station_code):
+        """
+        Give a charger that sent a frame the status it had before it was marked unavailable, if
+        it was. Costs nothing for the chargers that were not.
+        """
+        entry = charger_registry.get(serial_number)
+        if entry is None or entry.offline_status is None:
+            return
+        status = entry.offline_status
+        at = now()
+        if serial_number not in await database_sync_to_async(restore_statuses)({serial_number: status}, at):
+            # Its status changed meanwhile, from another worker: read it again when needed
+            charger_registry.invalidate(serial_number)
+            return
+        charger_registry.set_status(serial_number, status)
+        get_status_broadcaster(self.channel_layer).publish(station_code, serial_number, status)
+        await get_log_writer().put(StatusLog, serial_number, status=status, date=at)
+        logger.info("Charger %s is back, status restored to %s", serial_number, status)
+
+    async def disconnected(self, serial_number, channel_name):
+        """
+        Stop tracking a charger whose websocket on ``channel_name`` closed and mark it unavailable,
+        unless it is already talking to this worker on another channel.
+        """
+        owner = self._owners.get(serial_number)
+        if owner is None or owner[1] != channel_name:
+            return
+        self.wheel.cancel(serial_number)
+        try:
+            await self.expire([serial_number])
+        except Exception:
+            logger.exception("Could not mark disconnected charger %s unavailable", serial_number)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.wheel.resolution)
+            expired = self.wheel.advance(time.monotonic())
+            if not expired:
+                continue
+            try:
+                await self.expire(expired)
+            except Exception:
+                logger.exception("Could not mark %d chargers unavailable", len(expired))
+
+    async def expire(self, serial_numbers):
+        """Mark the chargers in ``serial_numbers``, which missed their deadline, unavailable."""
+        presence = ChargerPresence(self.channel_layer)
+        owners = {serial_number: self._owners.pop(serial_number) for serial_number in serial_numbers}
+        silent = []
+        for serial_number, (station_code, channel_name) in owners.items():
+            owner = await presence.lookup(serial_number)
+            # A charger with a deadline again sent a frame while we were looking
+            if (owner is None or owner == channel_name) and serial_number not in self.wheel:
+                silent.append(serial_number)
+        if not silent:
+            return
+
+        at = now()
+        changed = await self.mark_unavailable(silent, at)
+        revived = {serial_number: status for serial_number, status in changed.items() if serial_number in self.wheel}
+        if revived:
+            # Seen while the UPDATE ran: undo it rather than leave a live charger unavailable
+            await database_sync_to_async(restore_statuses)(revived, now())
+            changed = {serial_number: status for serial_number, status in changed.items() if serial_number not in revived}
+        broadcaster = get_status_broadcaster(self.channel_layer)
+        log_writer = get_log_writer()
+        for serial_number, status in changed.items():
+            charger_registry.set_status(serial_number, UNAVAILABLE, offline_status=status)
+            broadcaster.publish(owners[serial_number][0], serial_number, UNAVAILABLE)
+            await log_writer.put(StatusLog, serial_number, status=UNAVAILABLE, date=at)
+        CHARGERS_TIMED_OUT.inc(amount=len(changed))
+        if changed:
+            logger.warning(
+                "Marked %d chargers unavailable after %ss without a frame: %s",
+                len(changed), self.timeout, ", ".join(changed)
+            )
+
+    async def mark_unavailable(self, serial_numbers, at):
+        return await database_sync_to_async(mark_unavailable)(serial_numbers, at)
+
+_monitor = None
+
+def get_liveness_monitor(channel_layer):
+    """
+    Return the liveness monitor for ``channel_layer`` on the running event loop.
+    """
+    global _monitor
+    loop = asyncio.get_running_loop()
+    if _monitor is None or _monitor.channel_layer is not channel_layer or _monitor._loop is not loop:
+        _monitor = LivenessMonitor(channel_layer)
+        _monitor._loop = loop
+    return _monitor
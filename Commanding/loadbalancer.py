@@ -0,0 +1,390 @@
+import asyncio
+import logging
+import math
+import time
+import numpy as np
+from channels.consumer import AsyncConsumer
+from channels.db import database_sync_to_async
+from channels.exceptions import ChannelFull
+from django.conf import settings
+from django.utils.timezone import now
+from Charging.models import Station, EVCharger
+
+logger = logging.getLogger(__name__)
+
+# Charger statuses in which a car is plugged in and may draw current
+ACTIVE_STATUSES = frozenset({'preparing', 'charging', 'suspendedev', 'suspendedevse'})
+
+# Id of the ChargePointMaxProfile the load balancer installs; each new one replaces the previous
+CHARGING_PROFILE_ID = 100
+
+def allocate(groups, limits, demand, weights, minimum):
+    """
+    Share the current of every station between its chargers, for all stations at once.
+
+    Each charger either gets at least ``minimum`` (below which a car stops charging) or nothing:
+    chargers are admitted in order of weight until the minimums of the next one would exceed the
+    station's limit. What is left of the limit is then shared by weighted water-filling: every
+    admitted charger gets ``minimum + min(demand - minimum, weight * level)``, with the level of
+    its station chosen so that the limit is used up, or ``demand`` if the station can serve every
+    charger in full. Chargers that need less than their share leave the rest to the others.
+
+    The level is found without iterating over stations: chargers are sorted by station and by
+    ``(demand - minimum) / weight``, and within each station the first charger whose ratio is above
+    the level that its prefix of capped chargers leaves gives the station's level.
+
+    Args:
+        groups (ndarray): Index of the station of each charger into ``limits``.
+        limits (ndarray): Current each station may draw, in A.
+        demand (ndarray): Current each charger could use, at least ``minimum``, in A.
+        weights (ndarray): Positive weight of each charger; equal weights give a fair share.
+        minimum (float): Smallest current a charger can be limited to without stopping, in A.
+
+    Returns:
+        ndarray: The current allocated to each charger, in A.
+    """
+    groups = np.asarray(groups, dtype=np.int64)
+    limits = np.asarray(limits, dtype=np.float64)
+    demand = np.asarray(demand, dtype=np.float64)
+    weights = np.maximum(np.asarray(weights, dtype=np.float64), 1e-9)
+    allocated = np.zeros(len(groups))
+    if not len(groups):
+        return allocated
+    positions = np.arange(len(groups))
+
+    # Admission: the running total of minimums within a station, heaviest chargers first
+    order = np.lexsort((-weights, groups))
+    sorted_groups = groups[order]
+    starts = np.flatnonzero(np.r_[True, sorted_groups[1:] != sorted_groups[:-1]])
+    group_start = np.repeat(starts, np.diff(np.r_[starts, len(order)]))
+    totals = np.cumsum(np.full(len(order), float(minimum)))
+    totals -= np.r_[0.0, totals][group_start]
+    admitted = np.empty(len(groups), dtype=bool)
+    admitted[order] = totals <= limits[sorted_groups] + 1e-9
+    base = np.where(admitted, minimum, 0.0)
+    remaining = limits - np.bincount(groups, base, minlength=len(limits))
+
+    # Water-filling of the rest, chargers sorted by the level at which they reach their demand
+    extra = np.where(admitted, demand - minimum, 0.0)
+    ratios = extra / weights
+    order = np.lexsort((ratios, groups))
+    sorted_groups, sorted_extra, sorted_weights = groups[order], extra[order], weights[order]
+    sorted_ratios = ratios[order]
+    starts = np.flatnonzero(np.r_[True, sorted_groups[1:] != sorted_groups[:-1]])
+    group_start = np.repeat(starts, np.diff(np.r_[starts, len(order)]))
+    extra_totals, weight_totals = np.cumsum(sorted_extra), np.cumsum(sorted_weights)
+    capped_before = extra_totals - sorted_extra - np.r_[0.0, extra_totals][group_start]
+    weight_before = weight_totals - sorted_weights - np.r_[0.0, weight_totals][group_start]
+    weight_after = np.repeat(np.add.reduceat(sorted_weights, starts), np.diff(np.r_[starts, len(order)]))
+    weight_after -= weight_before
+    levels = (remaining[sorted_groups] - capped_before) / weight_after
+    # The first charger not saturated at the level left by the chargers before it sets the level
+    first = np.minimum.reduceat(np.where(levels <= sorted_ratios, positions, len(order)), starts)
+    level = np.full(len(limits), np.inf)
+    found = first < len(order)
+    level[sorted_groups[starts[found]]] = levels[first[found]]
+    allocated = base + np.minimum(extra, weights * np.maximum(level[groups], 0.0))
+    return allocated
+
+def measured_current(samples, voltage=230.0):
+    """
+    Return the current of the latest meter sample that has one, in A, computed from its power when
+    it was not measured; None if no sample tells.
+    """
+    for sample in reversed(samples):
+        if sample.get('current') is not None:
+            return sample['current']
+        if sample.get('power') is not None:
+            return sample['power'] / (sample.get('voltage') or voltage)
+    return None
+
+class LoadReporter:
+    """
+    Reports the load of the chargers connected to this worker to the load balancer.
+
+    Consumers call :meth:`report` after every frame, which only records the charger's latest
+    state; every ``interval`` seconds (``LOAD_REPORT_INTERVAL``) the states that changed are sent
+    together in one ``charger.loads`` message on the ``LOAD_BALANCER_CHANNEL`` channel. A frame
+    costs a dict update, and the balancer gets one message per worker and interval instead of
+    one per frame. Reporting is off when ``LOAD_BALANCER_CHANNEL`` is None.
+
+    Every ``refresh`` seconds (``LOAD_BALANCING_REFRESH``) the state of every charger is sent
+    again, changed or not, so a balancer that restarted or lost a message (a full channel, an
+    expired Redis key) learns about idle chargers too. States that could not be sent because
+    the channel was full are sent with the next message.
+
+    Attributes:
+        channel_layer: The channel layer the reports are sent through.
+        channel (str): Channel the load balancer worker listens on.
+        interval (float): Seconds states are collected before they are sent.
+        refresh (float): Seconds between two reports of the full state.
+    """
+
+    def __init__(self, channel_layer, channel=None, interval=None, refresh=None):
+        self.channel_layer = channel_layer
+        self.channel = channel or getattr(settings, "LOAD_BALANCER_CHANNEL", None)
+        self.interval = interval if interval is not None else getattr(settings, "LOAD_REPORT_INTERVAL", 1.0)
+        self.refresh = refresh if refresh is not None else getattr(settings, "LOAD_BALANCING_REFRESH", 60.0)
+        self._refresh_due = time.monotonic() + self.refresh
+        self._reported = {}
+        self._pending = {}
+        self._loop = None
+        self._flush_task = None
+
+    def report(self, serial_number, channel_name, active, current=None):
+        """
+        Record the state of a charger.
+
+        Args:
+            serial_number (str): The charger.
+            channel_name (str): Channel of the consumer holding its websocket.
+            active (bool): Whether a car is plugged in and may draw current.
+            current (float): Latest current measured, in A, or None if no new reading.
+        """
+        if self.channel is None:
+            return
+        pending = self._pending.get(serial_number)
+        if current is None and pending is not None:
+            # Keep the reading of an earlier frame that was not sent yet
+            current = pending[2]
+        state = (channel_name, active, current)
+        if current is None and self._reported.get(serial_number) == state:
+            if time.monotonic() >= self._refresh_due:
+                self._schedule()
+            return
+        self._pending[serial_number] = state
+        self._schedule()
+
+    def gone(self, serial_number, channel_name):
+        """Record that the charger disconnected from the consumer on ``channel_name``."""
+        if self.channel is None:
+            return
+        self._pending[serial_number] = (channel_name, None, None)
+        self._schedule()
+
+    def _schedule(self):
+        if self._flush_task is None:
+            self._flush_task = asyncio.get_running_loop().create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.interval)
+        self._flush_task = None
+        await self.flush()
+
+    async def flush(self):
+        pending, self._pending = self._pending, {}
+        full = time.monotonic() >= self._refresh_due
+        loads = {**self._reported, **pending} if full else pending
+        if not loads:
+            return
+        try:
+            await self.channel_layer.send(self.channel, {
+                'type': 'charger.loads',
+                'loads': [[serial_number, *state] for serial_number, state in loads.items()],
+            })
+        except ChannelFull:
+            logger.warning("Load balancer channel %s is full, %d charger loads sent again later", self.channel, len(loads))
+            # States recorded since are newer than the ones that were not sent
+            for serial_number, state in pending.items():
+                self._pending.setdefault(serial_number, state)
+            self._schedule()
+            return
+        if full:
+            self._refresh_due = time.monotonic() + self.refresh
+        for serial_number, (channel_name, active, current) in pending.items():
+            if active is None:
+                self._reported.pop(serial_number, None)
+            else:
+                self._reported[serial_number] = (channel_name, active, None)
+
+_reporter = None
+
+def get_load_reporter(channel_layer):
+    """
+    Return the load reporter for ``channel_layer`` on the running event loop.
+    """
+    global _reporter
+    loop = asyncio.get_running_loop()
+    if _reporter is None or _reporter.channel_layer is not channel_layer or _reporter._loop is not loop:
+        _reporter = LoadReporter(channel_layer)
+        _reporter._loop = loop
+    return _reporter
+
+def charging_profile(limit):
+    """The ``SetChargingProfile`` payload capping a whole charge point at ``limit`` A."""
+    return {
+        'connectorId': 0,
+        'csChargingProfiles': {
+            'chargingProfileId': CHARGING_PROFILE_ID,
+            'stackLevel': 0,
+            'chargingProfilePurpose': 'ChargePointMaxProfile',
+            'chargingProfileKind': 'Absolute',
+            'chargingSchedule': {
+                'startSchedule': now().isoformat(),
+                'chargingRateUnit': 'A',
+                'chargingSchedulePeriod': [{'startPeriod': 0, 'limit': limit}],
+            },
+        },
+    }
+
+def load_station_limits():
+    """
+    Read the stations that have a ``max_current`` and their chargers.
+
+    Returns:
+        tuple: ``{station id: max current}`` and ``{serial number: (station id, max current of
+        the charger, priority)}``.
+    """
+    default = getattr(settings, "LOAD_BALANCING_DEFAULT_CURRENT", 32.0)
+    stations = dict(Station.objects.filter(max_current__isnull=False).values_list('id', 'max_current'))
+    chargers = {
+        serial_number: (station_id, float(capacity or default), priority)
+        for serial_number, station_id, capacity, priority in EVCharger.objects.filter(
+            station_id__in=stations
+        ).values_list('serial_number', 'station_id', 'capacity', 'priority')
+    }
+    return stations, chargers
+
+class LoadBalancer:
+    """
+    Keeps the chargers of each station under the station's ``max_current``.
+
+    The balancer holds the latest state reported by the consumers (see :class:`LoadReporter`)
+    for every connected charger of a station that has a ``max_current``. Every ``interval``
+    seconds (``LOAD_BALANCING_INTERVAL``) it computes the limit of every charger of every station
+    in one pass of :func:`allocate`:
+
+    - A charger with a car plugged in asks for its ``capacity`` (in A,
+      ``LOAD_BALANCING_DEFAULT_CURRENT`` when unknown), unless its car draws clearly less than
+      its current limit, in which case it asks for what it draws plus ``headroom``
+      (``LOAD_BALANCING_HEADROOM``).
+    - Chargers with a car are served first, weighted by their ``priority``; idle chargers are then
+      given the minimum current, as far as it goes, so that cars arriving before the next pass
+      cannot overload the station.
+
+    Only the chargers whose limit went down, or up by at least ``LOAD_BALANCING_MIN_CHANGE`` A,
+    are sent a new ``ChargePointMaxProfile``, through the consumer that holds their websocket.
+
+    Attributes:
+        channel_layer: The channel layer the commands are sent through.
+        interval (float): Seconds between two passes.
+    """
+
+    def __init__(self, channel_layer, interval=None):
+        self.channel_layer = channel_layer
+        self.interval = interval or getattr(settings, "LOAD_BALANCING_INTERVAL", 5.0)
+        self.minimum = getattr(settings, "LOAD_BALANCING_MIN_CURRENT", 6.0)
+        self.headroom = getattr(settings, "LOAD_BALANCING_HEADROOM", 2.0)
+        self.min_change = getattr(settings, "LOAD_BALANCING_MIN_CHANGE", 1.0)
+        self.refresh_interval = getattr(settings, "LOAD_BALANCING_REFRESH", 60.0)
+        self.stations = {}
+        self.chargers = {}
+        self.refreshed_at = -math.inf
+        # Serial number -> [consumer channel, active, measured current, limit sent]
+        self.loads = {}
+
+    def update(self, loads):
+        """Apply the ``[serial number, channel, active, current]`` entries of a ``charger.loads`` message."""
+        for serial_number, channel_name, active, current in loads:
+            load = self.loads.get(serial_number)
+            if active is None:
+                # A disconnect reported after the charger reconnected elsewhere is stale
+                if load is not None and load[0] == channel_name:
+                    del self.loads[serial_number]
+                continue
+            if load is None or load[0] != channel_name:
+                # A new connection does not know which limit the previous one was sent
+                load = self.loads[serial_number] = [channel_name, active, math.nan, math.nan]
+            load[1] = active
+            if not active:
+                load[2] = math.nan
+            elif current is not None:
+                load[2] = current
+
+    def refresh(self):
+        self.stations, self.chargers = load_station_limits()
+        self.refreshed_at = time.monotonic()
+
+    def compute(self):
+        """
+        Compute the limit of every managed charger.
+
+        Returns:
+            dict: Serial number -> new limit in A, for the chargers that need a new profile.
+        """
+        serials = [serial_number for serial_number in self.loads if serial_number in self.chargers]
+        if not serials:
+            return {}
+        station_index = {station_id: i for i, station_id in enumerate(self.stations)}
+        limits = np.fromiter(self.stations.values(), dtype=np.float64, count=len(self.stations))
+        config = [self.chargers[serial_number] for serial_number in serials]
+        groups = np.fromiter((station_index[station_id] for station_id, _, _ in config), dtype=np.int64, count=len(serials))
+        capacity = np.fromiter((capacity for _, capacity, _ in config), dtype=np.float64, count=len(serials))
+        weights = np.fromiter((priority for _, _, priority in config), dtype=np.float64, count=len(serials))
+        loads = [self.loads[serial_number] for serial_number in serials]
+        active = np.fromiter((load[1] for load in loads), dtype=bool, count=len(serials))
+        current = np.fromiter((load[2] for load in loads), dtype=np.float64, count=len(serials))
+        sent = np.fromiter((load[3] for load in loads), dtype=np.float64, count=len(serials))
+
+        capacity = np.maximum(capacity, self.minimum)
+        # A car drawing close to its limit might take more; one drawing well below it will not. The
+        # margin is half the headroom, so a car held at its draw plus headroom stays there
+        saturated = np.isnan(current) | np.isnan(sent) | (current >= sent - self.headroom / 2)
+        demand = np.clip(np.where(saturated, capacity, current + self.headroom), self.minimum, capacity)
+
+        limit = np.zeros(len(serials))
+        limit[active] = allocate(groups[active], limits, demand[active], weights[active], self.minimum)
+        left = np.maximum(limits - np.bincount(groups[active], limit[active], minlength=len(limits)), 0.0)
+        idle = ~active
+        limit[idle] = allocate(groups[idle], left, np.full(idle.sum(), self.minimum), weights[idle], self.minimum)
+        # OCPP limits have one decimal; rounding down keeps the station under its limit
+        limit = np.floor(limit * 10 + 1e-6) / 10
+
+        changed = np.isnan(sent) | (limit < sent - 0.05) | (limit >= sent + self.min_change)
+        return {serials[i]: float(limit[i]) for i in np.flatnonzero(changed)}
+
+    async def tick(self):
+        """Run one pass and send the new profiles. Returns the number of chargers sent one."""
+        if time.monotonic() - self.refreshed_at >= self.refresh_interval:
+            await database_sync_to_async(self.refresh)()
+        started = time.perf_counter()
+        changes = {serial_number: (self.loads[serial_number], limit) for serial_number, limit in self.compute().items()}
+        await asyncio.gather(*(
+            self.channel_layer.send(load[0], {
+                'type': 'send_command',
+                'command': 'SetChargingProfile',
+                'payload': charging_profile(limit),
+            })
+            for load, limit in changes.values()
+        ))
+        for load, limit in changes.values():
+            load[3] = limit
+        logger.debug(
+            "Balanced %d chargers of %d stations in %.1f ms, %d new limits",
+            len(self.loads), len(self.stations), (time.perf_counter() - started) * 1000, len(changes)
+        )
+        return len(changes)
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.tick()
+            except Exception:
+                logger.exception("Load balancing pass failed")
+
+class LoadBalancerConsumer(AsyncConsumer):
+    """
+    Runs the :class:`LoadBalancer` in a worker of its own, fed with the ``charger.loads`` reports
+    of the websocket workers::
+
+        python manage.py runworker load-balancer
+    """
+
+    async def charger_loads(self, message):
+        balancer = getattr(self, 'balancer', None)
+        if balancer is None:
+            balancer = self.balancer = LoadBalancer(self.channel_layer)
+            self.balancer_task = asyncio.get_running_loop().create_task(balancer.run())
+            logger.info("Load balancer started, a pass every %ss", balancer.interval)
+        balancer.update(message['loads'])
@@ -0,0 +1,113 @@
+import atexit
+import json
+import logging
+import queue
+import sys
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+# Attributes every LogRecord has; anything else on a record came from ``extra`` and is a field
+RECORD_ATTRIBUTES = frozenset(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats a record as one JSON object per line: ``time``, ``level``, ``logger``, ``message``
+    and every field passed in ``extra`` (``charger_id``, ``action``, ``latency_ms``, ...).
+    """
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in RECORD_ATTRIBUTES and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+class SamplingFilter(logging.Filter):
+    """
+    Keeps one in ``1 / rate`` of the records of each sampled action.
+
+    ``rates`` maps an OCPP action (the ``action`` field of a record) to the share of its records
+    that are kept, e.g. ``{'Heartbeat': 0.01}`` keeps every hundredth heartbeat record. Warnings
+    and errors, and records without a sampled action, always pass.
+    """
+
+    def __init__(self, rates=None):
+        super().__init__()
+        self.intervals = {action: max(1, round(1 / rate)) if rate > 0 else 0 for action, rate in (rates or {}).items()}
+        self.seen = dict.fromkeys(self.intervals, 0)
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        action = getattr(record, 'action', None)
+        interval = self.intervals.get(action)
+        if interval is None:
+            return True
+        if interval == 0:
+            return False
+        self.seen[action] += 1
+        if self.seen[action] >= interval:
+            self.seen[action] = 0
+            return True
+        return False
+
+class DrainingQueueListener(QueueListener):
+    """A ``QueueListener`` that, when stopped, waits for room in a full queue to end its thread."""
+
+    def enqueue_sentinel(self):
+        self.queue.put(self._sentinel)
+
+class QueueLogHandler(QueueHandler):
+    """
+    Hands records to a background thread that formats and writes them.
+
+    ``emit`` formats the record, as the standard ``QueueHandler`` does, so its arguments are
+    read while they still hold the values they were logged with, and only puts the formatted
+    line on a bounded queue: logging on the event loop never waits for a stream or a file.
+    Records sampled out by the handler's filters are never formatted. When the queue is full
+    the record is dropped and counted in ``dropped`` rather than blocking the caller.
+
+    Args:
+        stream: Where the listener writes, ``sys.stderr`` by default.
+        maxsize (int): Number of records the queue holds.
+        formatter (logging.Formatter): Formatter of the records; JSON by default.
+    """
+
+    def __init__(self, stream=None, maxsize=10000, formatter=None):
+        super().__init__(queue.Queue(maxsize=maxsize))
+        self.dropped = 0
+        self.setFormatter(formatter or JsonFormatter())
+        # Records arrive formatted, the listener writes their message as it is
+        target = logging.StreamHandler(stream or sys.stderr)
+        self.listener = DrainingQueueListener(self.queue, target, respect_handler_level=True)
+        self.listener.start()
+        atexit.register(self.close)
+
+    def close(self):
+        # Writes the records still queued before the listener thread ends
+        if self.listener._thread is not None:
+            self.listener.stop()
+        super().close()
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+class ChargerLogAdapter(logging.LoggerAdapter):
+    """
+    Adds the charger's serial number (and any other fields given to the adapter) to the
+    ``extra`` of every record, merged with the fields passed to the call itself.
+    """
+
+    def process(self, msg, kwargs):
+        kwargs['extra'] = {**self.extra, **kwargs['extra']} if 'extra' in kwargs else self.extra
+        return msg, kwargs
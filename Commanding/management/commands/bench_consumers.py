@@ -0,0 +1,211 @@
+import asyncio
+import json
+import logging
+import platform
+import time
+from datetime import datetime, timezone
+from channels.testing import WebsocketCommunicator
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+# Frames sent for each benchmarked action, in the order a charger would send them
+FRAMES = {
+    'BootNotification': {
+        'chargePointVendor': 'ABB', 'chargePointModel': 'Terra AC Wallbox', 'firmwareVersion': '1.8.32',
+    },
+    'Heartbeat': {},
+    'StatusNotification': {
+        'connectorId': 1, 'errorCode': 'NoError', 'status': 'Charging',
+    },
+    'StartTransaction': {
+        'connectorId': 1, 'idTag': 'ABC12345', 'meterStart': 0, 'timestamp': '2025-01-01T00:00:00Z',
+    },
+    'MeterValues': {
+        'connectorId': 1, 'transactionId': 1, 'meterValue': [{
+            'timestamp': '2025-01-01T00:30:00Z',
+            'sampledValue': [
+                {'measurand': 'Energy.Active.Import.Register', 'unit': 'Wh', 'value': '600'},
+                {'measurand': 'Power.Active.Import', 'unit': 'W', 'value': '7200'},
+                {'measurand': 'Current.Import', 'unit': 'A', 'value': '31.3'},
+                {'measurand': 'Voltage', 'unit': 'V', 'value': '230'},
+            ],
+        }],
+    },
+    'StopTransaction': {
+        'transactionId': 1, 'meterStop': 1200, 'timestamp': '2025-01-01T01:00:00Z',
+    },
+}
+
+IN_MEMORY_LAYERS = {'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}}
+
+def percentile(sorted_values, percent):
+    index = min(len(sorted_values) - 1, int(len(sorted_values) * percent / 100))
+    return sorted_values[index]
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark the OCPP consumer path end to end: the ASGI application runs in-process on the '
+        'in-memory channel layer and a throwaway test database, and simulated chargers send each '
+        'action through WebsocketCommunicator at several concurrency levels'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--frames', type=int, default=200, help='Frames per action sent by each connection')
+        parser.add_argument('--concurrency', default='1,10,50', help='Comma-separated numbers of simultaneous chargers')
+        parser.add_argument('--output', help='Write the results to this JSON file')
+        parser.add_argument('--baseline', help='Compare the results against this JSON file of an earlier run')
+        parser.add_argument('--save-baseline', action='store_true', help='Write the results to --baseline instead of comparing')
+        parser.add_argument('--threshold', type=float, default=0.2,
+                            help='Fail if frames/sec drop, or p99 latency grows, by more than this fraction of the baseline')
+
+    def handle(self, *args, **options):
+        levels = sorted({int(level) for level in options['concurrency'].split(',')})
+        if options['save_baseline'] and not options['baseline']:
+            raise CommandError("--save-baseline needs --baseline")
+
+        # Consumer logging would dominate the measurement and the output; the replayed
+        # StopTransaction frames also warn about transaction ids the chargers were not given
+        logging.disable(logging.WARNING)
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            with override_settings(CHANNEL_LAYERS=IN_MEMORY_LAYERS):
+                token = self.setup_fleet(max(levels))
+                from EVChargingSystem.asgi import application
+                results = {
+                    str(level): asyncio.run(self.run_level(application, level, options['frames'], token))
+                    for level in levels
+                }
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            logging.disable(logging.NOTSET)
+
+        report = {
+            'meta': {
+                'date': datetime.now(timezone.utc).isoformat(),
+                'python': platform.python_version(),
+                'machine': platform.machine(),
+                'frames': options['frames'],
+            },
+            'results': results,
+        }
+        self.print_results(results)
+
+        if options['output']:
+            self.write(options['output'], report)
+        if options['save_baseline']:
+            self.write(options['baseline'], report)
+        elif options['baseline']:
+            self.compare(results, options['baseline'], options['threshold'])
+
+    def setup_fleet(self, count):
+        """Create one charger per connection and a customer whose token authenticates them."""
+        from Charging.models import EVCharger, Station
+        from Users.models import Customer, Organization, User
+
+        user = User.objects.create_user('bench-operator', password='bench', type='organization')
+        organization = Organization.objects.create(user=user, organization_name='Bench', acronym='BENCH')
+        station = Station.objects.create(organization=organization, station_code='BENCH', name='Bench', location='-')
+        EVCharger.objects.bulk_create(
+            EVCharger(station=station, serial_number=f'BENCH{i:05d}') for i in range(count)
+        )
+        customer = User.objects.create_user('bench-customer', password='bench', type='customer')
+        Customer.objects.create(user=customer, car_plate='BENCH')
+        return str(AccessToken.for_user(customer))
+
+    async def run_level(self, application, concurrency, frames, token):
+        communicators = []
+        for i in range(concurrency):
+            communicator = WebsocketCommunicator(
+                application,
+                f'/ws/charging/station/BENCH/BENCH{i:05d}/',
+                headers=[(b'authorization', f'Bearer {token}'.encode())],
+                subprotocols=['ocpp1.6'],
+            )
+            connected, _ = await communicator.connect(timeout=10)
+            if not connected:
+                raise CommandError(f"Charger BENCH{i:05d} could not connect")
+            # The consumer greets every charger with its status and a welcome message
+            await communicator.receive_json_from(timeout=10)
+            await communicator.receive_json_from(timeout=10)
+            communicators.append(communicator)
+
+        results = {}
+        try:
+            for action, payload in FRAMES.items():
+                started = time.perf_counter()
+                latencies = await asyncio.gather(*[
+                    self.send_frames(communicator, i, action, payload, frames)
+                    for i, communicator in enumerate(communicators)
+                ])
+                elapsed = time.perf_counter() - started
+                latencies = sorted(latency for connection_latencies in latencies for latency in connection_latencies)
+                results[action] = {
+                    'frames_per_sec': round(len(latencies) / elapsed, 1),
+                    'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+                    'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+                }
+        finally:
+            for communicator in communicators:
+                await communicator.disconnect()
+        return results
+
+    @staticmethod
+    async def send_frames(communicator, index, action, payload, frames):
+        """Send ``frames`` CALLs one after the other and return the round trip of each, in seconds."""
+        latencies = []
+        for n in range(frames):
+            unique_id = f'{index}-{action}-{n}'
+            started = time.perf_counter()
+            await communicator.send_json_to([2, unique_id, action, payload])
+            while True:
+                # Skip the broadcasts the consumer also relays to its charger
+                frame = await communicator.receive_json_from(timeout=10)
+                if isinstance(frame, list) and frame[1] == unique_id:
+                    break
+            latencies.append(time.perf_counter() - started)
+        return latencies
+
+    def print_results(self, results):
+        self.stdout.write(f"{'chargers':>8}  {'action':<20}{'frames/s':>12}{'p50 ms':>10}{'p99 ms':>10}")
+        for level, actions in results.items():
+            for action, result in actions.items():
+                self.stdout.write(
+                    f"{level:>8}  {action:<20}{result['frames_per_sec']:>12,.0f}"
+                    f"{result['p50_ms']:>10.2f}{result['p99_ms']:>10.2f}"
+                )
+
+    def write(self, path, report):
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=2)
+        self.stdout.write(f"Results written to {path}")
+
+    def compare(self, results, path, threshold):
+        try:
+            with open(path) as f:
+                baseline = json.load(f)['results']
+        except (OSError, ValueError, KeyError) as e:
+            raise CommandError(f"Cannot read baseline {path}: {e}")
+
+        regressions = []
+        for level, actions in results.items():
+            for action, result in actions.items():
+                expected = baseline.get(level, {}).get(action)
+                if expected is None:
+                    continue
+                if result['frames_per_sec'] < expected['frames_per_sec'] * (1 - threshold):
+                    regressions.append(
+                        f"{action} @ {level} chargers: {result['frames_per_sec']:,.0f} frames/s "
+                        f"(baseline {expected['frames_per_sec']:,.0f})"
+                    )
+                if result['p99_ms'] > expected['p99_ms'] * (1 + threshold):
+                    regressions.append(
+                        f"{action} @ {level} chargers: p99 {result['p99_ms']:.2f} ms (baseline {expected['p99_ms']:.2f} ms)"
+                    )
+
+        if regressions:
+            for regression in regressions:
+                self.stderr.write(self.style.ERROR(f"Regression: {regression}"))
+            raise CommandError(f"{len(regressions)} regressions beyond {threshold:.0%} of {path}")
+        self.stdout.write(self.style.SUCCESS(f"No regression beyond {threshold:.0%} of {path}"))
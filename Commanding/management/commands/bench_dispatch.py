@@ -0,0 +1,82 @@
+import asyncio
+import json
+import time
+from django.core.management.base import BaseCommand
+from Commanding.codec import CODECS
+from Commanding.consumers import ChargePoint
+from Commanding.sessions import ChargingSession
+
+FRAMES = {
+    'BootNotification': [2, '1', 'BootNotification', {
+        'chargePointVendor': 'ABB', 'chargePointModel': 'Terra AC Wallbox', 'firmwareVersion': '1.8.32',
+    }],
+    'Heartbeat': [2, '1', 'Heartbeat', {}],
+    'StatusNotification': [2, '1', 'StatusNotification', {
+        'connectorId': 1, 'errorCode': 'NoError', 'status': 'Charging',
+    }],
+    'StartTransaction': [2, '1', 'StartTransaction', {
+        'connectorId': 1, 'idTag': 'ABC12345', 'meterStart': 0, 'timestamp': '2025-01-01T00:00:00Z',
+    }],
+    'StopTransaction': [2, '1', 'StopTransaction', {
+        'transactionId': 1, 'meterStop': 1200, 'timestamp': '2025-01-01T01:00:00Z',
+    }],
+}
+
+class NullConnection:
+    """Stands in for the websocket consumer and discards everything the charge point sends."""
+
+    def __init__(self):
+        self.sessions = NullSessions()
+
+    async def send(self, message):
+        pass
+
+    async def get_customer(self):
+        return None
+
+class NullSessions:
+    """Opens and stops sessions in memory only, so the handlers do not touch the database."""
+
+    def __init__(self):
+        self._next = 0
+
+    async def start(self, connector_id, id_tag, meter_start, started_at, customer=None):
+        self._next += 1
+        return ChargingSession(self._next, connector_id, id_tag, meter_start)
+
+    async def stop(self, transaction_id, meter_stop, stopped_at, reason=None):
+        return None
+
+class Command(BaseCommand):
+    help = 'Measure OCPP frames/sec through route_message (legacy) and dispatch (fast path)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--frames', type=int, default=5000, help='Frames per action and mode')
+        parser.add_argument('--codec', default='orjson' if 'orjson' in CODECS else 'json',
+                            choices=sorted(CODECS), help='Codec used by the fast path')
+
+    def handle(self, *args, **options):
+        asyncio.run(self.run(options['frames'], options['codec']))
+
+    async def run(self, frames, codec):
+        legacy_point = ChargePoint('BENCH', NullConnection(), inline_validation=False)
+        charge_point = ChargePoint('BENCH', NullConnection(), inline_validation=True)
+        loads, _ = CODECS[codec]
+
+        self.stdout.write(f"{'action':<20}{'legacy f/s':>14}{'fast f/s':>14}{'speedup':>10}")
+        for action, frame in FRAMES.items():
+            raw = json.dumps(frame)
+
+            # What receive_json used to do: decode, re-encode, let route_message parse it again
+            # and validate it in the thread pool.
+            legacy = await self.measure(frames, lambda: legacy_point.route_message(json.dumps(json.loads(raw))))
+            fast = await self.measure(frames, lambda: charge_point.dispatch(loads(raw)))
+
+            self.stdout.write(f"{action:<20}{legacy:>14,.0f}{fast:>14,.0f}{fast / legacy:>9.1f}x")
+
+    @staticmethod
+    async def measure(frames, handle):
+        started = time.perf_counter()
+        for _ in range(frames):
+            await handle()
+        return frames / (time.perf_counter() - started)
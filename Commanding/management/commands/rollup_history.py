@@ -0,0 +1,21 @@
+import time
+from django.core.management.base import BaseCommand
+from Commanding.rollups import RollupEngine
+
+class Command(BaseCommand):
+    help = 'Roll raw meter and heartbeat history up into 1m/15m/1h/1d buckets and prune expired data'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=0,
+                            help='Keep running, starting a new pass every INTERVAL seconds')
+
+    def handle(self, *args, **options):
+        engine = RollupEngine()
+        while True:
+            written = engine.run()
+            self.stdout.write(self.style.SUCCESS(
+                "Rolled up " + ", ".join(f"{count} {resolution}" for resolution, count in written.items()) + " buckets"
+            ))
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,217 @@
+import bisect
+import math
+import time
+from collections import defaultdict
+from django.conf import settings
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Seconds; most OCPP frames are handled in well under a millisecond, DB writes take longer
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Metric:
+    """
+    Base class of the metrics kept by a :class:`MetricsRegistry`.
+
+    Label values are passed positionally, in the order of ``labels``, which keeps recording a
+    sample down to a tuple lookup and an addition. Instead of being updated, a metric can be
+    given a ``callback`` returning its value, or a dict of ``{label values: value}``, which is
+    called at every scrape. A metric without labels is exposed as 0 until it is first updated.
+    Updates are ignored while ``enabled`` is False (see :class:`MetricsRegistry`).
+    """
+    type = None
+
+    def __init__(self, name, documentation, labels=(), callback=None):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.callback = callback
+        self.enabled = True
+        self._values = defaultdict(int)
+
+    def values(self):
+        if self.callback is None:
+            values = self._values
+        else:
+            values = self.callback()
+            if not isinstance(values, dict):
+                values = {(): values}
+        if not values and not self.labels:
+            return {(): 0}
+        return values
+
+    def samples(self):
+        """Yield ``(suffix, label string, value)`` for the exposition format."""
+        for label_values, value in sorted(self.values().items()):
+            yield '', _format_labels(self.labels, label_values), value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type}']
+        for suffix, labels, value in self.samples():
+            lines.append(f'{self.name}{suffix}{labels} {_format_value(value)}')
+        return '\n'.join(lines)
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, *label_values, amount=1):
+        if self.enabled:
+            self._values[label_values] += amount
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def set(self, value, *label_values):
+        if self.enabled:
+            self._values[label_values] = value
+
+    def inc(self, *label_values, amount=1):
+        if self.enabled:
+            self._values[label_values] += amount
+
+    def dec(self, *label_values, amount=1):
+        if self.enabled:
+            self._values[label_values] -= amount
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [count per bucket (the last one is +Inf), sum]
+        self._values = {}
+
+    def observe(self, value, *label_values):
+        if not self.enabled:
+            return
+        series = self._values.get(label_values)
+        if series is None:
+            series = self._values[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def samples(self):
+        for label_values, (counts, total) in sorted(self._values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                yield '_bucket', _format_labels(self.labels, label_values, f'le="{_format_value(bound)}"'), cumulative
+            yield '_sum', _format_labels(self.labels, label_values), total
+            yield '_count', _format_labels(self.labels, label_values), cumulative
+
+class MetricsRegistry:
+    """
+    The metrics of this process, rendered in the Prometheus text exposition format.
+
+    Metrics are plain in-process counters updated from the event loop, so recording a sample
+    costs a dictionary lookup. Each worker process exposes its own values; Prometheus sums them
+    across the scrape targets. A disabled registry does not record anything.
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self._metrics = {}
+
+    def register(self, metric):
+        metric.enabled = self.enabled
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labels=(), callback=None):
+        return self.register(Counter(name, documentation, labels, callback))
+
+    def gauge(self, name, documentation, labels=(), callback=None):
+        return self.register(Gauge(name, documentation, labels, callback))
+
+    def histogram(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labels, buckets))
+
+    def render(self):
+        return '\n'.join(metric.render() for metric in self._metrics.values()) + '\n'
+
+registry = MetricsRegistry(enabled=getattr(settings, "METRICS_ENABLED", True))
+
+class FrameTimer:
+    """
+    Splits the handling time of one frame into stages.
+
+    Each call to :meth:`lap` records the time since the previous lap (or since ``started``)
+    under the given stage; :meth:`done` records the time since ``started`` as the ``total``
+    stage. Does nothing when metrics are disabled.
+    """
+    __slots__ = ('histogram', 'action', 'started', 'last')
+
+    def __init__(self, histogram, action, started=None):
+        self.histogram = histogram
+        self.action = action
+        self.started = self.last = started if started is not None else time.perf_counter()
+
+    def lap(self, stage):
+        if not registry.enabled:
+            return
+        now = time.perf_counter()
+        self.histogram.observe(now - self.last, self.action, stage)
+        self.last = now
+
+    def done(self):
+        if not registry.enabled:
+            return
+        self.histogram.observe(time.perf_counter() - self.started, self.action, 'total')
+
+def _sync_to_async_executors():
+    from asgiref.sync import SyncToAsync
+    return [SyncToAsync.single_thread_executor, *list(SyncToAsync.context_to_thread_executor.values())]
+
+def _writer_stat(key):
+    def read():
+        from Commanding.persistence import _writers
+        return {(writer_class.__name__,): writer.stats()[key] for writer_class, writer in list(_writers.items())}
+    return read
+
+FRAMES = registry.counter(
+    'ocpp_frames_total', 'OCPP frames received from chargers.', ['action'])
+FRAME_ERRORS = registry.counter(
+    'ocpp_frame_errors_total', 'OCPP frames that could not be parsed or handled.', ['action', 'kind'])
+STAGE_SECONDS = registry.histogram(
+    'ocpp_frame_stage_seconds',
+    'Time spent handling a received frame, per stage (decode, dispatch, persist, broadcast, total).',
+    ['action', 'stage'])
+CONNECTED_CHARGERS = registry.gauge(
+    'ocpp_connected_chargers', 'Chargers with an open websocket on this process.')
+CHARGERS_TIMED_OUT = registry.counter(
+    'ocpp_chargers_timed_out_total', 'Chargers marked unavailable after missing their heartbeat deadline.')
+COMMANDS = registry.counter(
+    'ocpp_commands_total', 'Commands sent to chargers, by outcome.', ['command', 'status'])
+registry.gauge(
+    'sync_to_async_queue_depth', 'database_sync_to_async calls waiting for a thread.',
+    callback=lambda: sum(executor._work_queue.qsize() for executor in _sync_to_async_executors()))
+registry.gauge(
+    'sync_to_async_executors', 'Thread-sensitive executors database_sync_to_async calls run in.',
+    callback=lambda: len(_sync_to_async_executors()))
+registry.gauge(
+    'ocpp_writer_queue_depth', 'Rows waiting in the write-behind queues.', ['writer'],
+    callback=_writer_stat('queue_depth'))
+registry.counter(
+    'ocpp_writer_rows_written_total', 'Rows written by the write-behind queues.', ['writer'],
+    callback=_writer_stat('rows_written'))
+registry.counter(
+    'ocpp_writer_rows_dropped_total', 'Rows the write-behind queues failed to write.', ['writer'],
+    callback=_writer_stat('rows_dropped'))
+registry.gauge(
+    'ocpp_writer_last_flush_seconds', 'Duration of the last write-behind flush.', ['writer'],
+    callback=_writer_stat('last_flush_latency'))
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:16
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Commanding', '0005_statuslog_payload'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='heartbeatlog',
+            name='received_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+        migrations.AlterField(
+            model_name='statuslog',
+            name='date',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+    ]
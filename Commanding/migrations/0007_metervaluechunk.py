@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:22
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Charging', '0004_remove_evcharger_activity_remove_evcharger_connected_and_more'),
+        ('Commanding', '0006_log_timestamps_default_now'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MeterValueChunk',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hour', models.DateTimeField()),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('offsets', models.BinaryField(default=b'')),
+                ('energy', models.BinaryField(default=b'')),
+                ('power', models.BinaryField(default=b'')),
+                ('current', models.BinaryField(default=b'')),
+                ('voltage', models.BinaryField(default=b'')),
+                ('charger', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='meter_chunks', to='Charging.evcharger')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('charger', 'hour'), name='unique_meter_chunk_per_hour')],
+            },
+        ),
+    ]
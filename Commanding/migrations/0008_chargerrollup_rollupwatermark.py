@@ -0,0 +1,44 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:23
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Charging', '0004_remove_evcharger_activity_remove_evcharger_connected_and_more'),
+        ('Commanding', '0007_metervaluechunk'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RollupWatermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('resolution', models.CharField(max_length=3, unique=True)),
+                ('position', models.DateTimeField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ChargerRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('resolution', models.CharField(choices=[('1m', '1 minute'), ('15m', '15 minutes'), ('1h', '1 hour'), ('1d', '1 day')], max_length=3)),
+                ('bucket', models.DateTimeField()),
+                ('samples', models.PositiveIntegerField(default=0)),
+                ('power_min', models.FloatField(null=True)),
+                ('power_max', models.FloatField(null=True)),
+                ('power_avg', models.FloatField(null=True)),
+                ('energy_delta', models.FloatField(null=True)),
+                ('energy_end', models.FloatField(null=True)),
+                ('heartbeats', models.PositiveIntegerField(default=0)),
+                ('uptime', models.FloatField(default=0)),
+                ('charger', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rollups', to='Charging.evcharger')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['resolution', 'bucket'], name='Commanding__resolut_089bb4_idx')],
+                'constraints': [models.UniqueConstraint(fields=('charger', 'resolution', 'bucket'), name='unique_rollup_bucket')],
+            },
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Charging', '0004_remove_evcharger_activity_remove_evcharger_connected_and_more'),
+        ('Commanding', '0008_chargerrollup_rollupwatermark'),
+        ('Users', '0004_alter_user_last_login'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='statuslog',
+            name='status',
+            field=models.CharField(max_length=20),
+        ),
+        migrations.AlterField(
+            model_name='transaction',
+            name='command',
+            field=models.CharField(max_length=20),
+        ),
+        migrations.AddIndex(
+            model_name='heartbeatlog',
+            index=models.Index(fields=['charger', 'received_at'], name='Commanding__charger_45f816_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='statuslog',
+            index=models.Index(fields=['charger', 'date'], name='Commanding__charger_b016f7_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['charger', 'date'], name='Commanding__charger_a51f99_idx'),
+        ),
+    ]
@@ -0,0 +1,91 @@
+from datetime import timedelta, timezone as dt_timezone
+from django.conf import settings
+from django.db import migrations
+from django.utils import timezone
+
+# Model -> timestamp column its table is range partitioned by
+PARTITIONED = {
+    'StatusLog': 'date',
+    'HeartbeatLog': 'received_at',
+}
+
+def upcoming_periods(now):
+    """
+    Yield ``(name suffix, start, end)`` of the current period and the ``LOG_PARTITIONS_AHEAD``
+    next ones, named like ``Commanding.partitions.TimePartitions`` names its partitions.
+    """
+    start = now.astimezone(dt_timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+    monthly = getattr(settings, "LOG_PARTITION_PERIOD", 'day') == 'month'
+    if monthly:
+        start = start.replace(day=1)
+    for _ in range(getattr(settings, "LOG_PARTITIONS_AHEAD", 3) + 1):
+        if monthly:
+            end = start.replace(year=start.year + start.month // 12, month=start.month % 12 + 1)
+        else:
+            end = start + timedelta(days=1)
+        yield start.strftime('%Y%m' if monthly else '%Y%m%d'), start, end
+        start = end
+
+def partition_table(schema_editor, model, column):
+    """
+    Replace the table of ``model`` by a table partitioned by range of ``column`` holding the same
+    rows, with partitions for the current and upcoming periods and a default partition, which
+    receives the existing history.
+    """
+    connection = schema_editor.connection
+    quote = schema_editor.quote_name
+    table = model._meta.db_table
+    old = f'{table}_unpartitioned'
+    charger = model._meta.get_field('charger')
+
+    schema_editor.execute(f"ALTER TABLE {quote(table)} RENAME TO {quote(old)}")
+    # The partition key has to be part of the primary key
+    schema_editor.execute(
+        f"CREATE TABLE {quote(table)} (LIKE {quote(old)} INCLUDING DEFAULTS INCLUDING IDENTITY, "
+        f"PRIMARY KEY (id, {quote(column)})) PARTITION BY RANGE ({quote(column)})"
+    )
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT pg_get_serial_sequence(%s, 'id')", [quote(table)])
+        if cursor.fetchone()[0] is None:
+            # A serial (not identity) id keeps using its sequence, which must outlive the old table
+            cursor.execute("SELECT pg_get_serial_sequence(%s, 'id')", [quote(old)])
+            schema_editor.execute(f"ALTER SEQUENCE {cursor.fetchone()[0]} OWNED BY {quote(table)}.id")
+    schema_editor.execute(f"CREATE TABLE {quote(table + '_default')} PARTITION OF {quote(table)} DEFAULT")
+    # Older rows go to the default partition; they are deleted row by row once they expire
+    for suffix, start, end in upcoming_periods(timezone.now()):
+        schema_editor.execute(
+            f"CREATE TABLE {quote(f'{table}_p{suffix}')} PARTITION OF {quote(table)} FOR VALUES FROM (%s) TO (%s)",
+            [start, end],
+        )
+    schema_editor.execute(f"INSERT INTO {quote(table)} SELECT * FROM {quote(old)}")
+    schema_editor.execute(
+        f"SELECT setval(pg_get_serial_sequence(%s, 'id'), COALESCE(MAX(id), 0) + 1, false) FROM {quote(table)}",
+        [quote(table)],
+    )
+    schema_editor.execute(f"DROP TABLE {quote(old)}")
+
+    schema_editor.execute(
+        f"ALTER TABLE {quote(table)} ADD CONSTRAINT {quote(table + '_charger_id_fk')} "
+        f"FOREIGN KEY ({quote(charger.column)}) "
+        f"REFERENCES {quote(charger.related_model._meta.db_table)} (id) DEFERRABLE INITIALLY DEFERRED"
+    )
+    for index in model._meta.indexes:
+        schema_editor.add_index(model, index)
+
+def partition_logs(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for model_name, column in PARTITIONED.items():
+        partition_table(schema_editor, apps.get_model('Commanding', model_name), column)
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Commanding', '0009_charger_date_indexes'),
+    ]
+
+    operations = [
+        # Partitioned tables answer every query of the earlier migrations like the plain ones did,
+        # so going back does not convert them back
+        migrations.RunPython(partition_logs, migrations.RunPython.noop),
+    ]
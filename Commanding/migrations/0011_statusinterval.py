@@ -0,0 +1,47 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:16
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def build_intervals(apps, schema_editor):
+    """Derive the intervals from the status history still in StatusLog."""
+    StatusLog = apps.get_model('Commanding', 'StatusLog')
+    StatusInterval = apps.get_model('Commanding', 'StatusInterval')
+    intervals = []
+    current = None
+    for charger_id, status, date in StatusLog.objects.order_by('charger_id', 'date').values_list(
+            'charger_id', 'status', 'date').iterator(chunk_size=10000):
+        if current is not None and current.charger_id == charger_id:
+            if current.status == status:
+                continue
+            current.end = date
+        current = StatusInterval(charger_id=charger_id, status=status, start=date)
+        intervals.append(current)
+    StatusInterval.objects.bulk_create(intervals, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Charging', '0004_remove_evcharger_activity_remove_evcharger_connected_and_more'),
+        ('Commanding', '0010_partition_status_and_heartbeat_logs'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StatusInterval',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(max_length=20)),
+                ('start', models.DateTimeField()),
+                ('end', models.DateTimeField(null=True)),
+                ('charger', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='status_intervals', to='Charging.evcharger')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['charger', 'start'], name='Commanding__charger_52b272_idx')],
+                'constraints': [models.UniqueConstraint(condition=models.Q(('end__isnull', True)), fields=('charger',), name='one_open_status_interval')],
+            },
+        ),
+        migrations.RunPython(build_intervals, migrations.RunPython.noop),
+    ]
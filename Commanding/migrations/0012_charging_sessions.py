@@ -0,0 +1,61 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Commanding', '0011_statusinterval'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IdSequence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('next_value', models.BigIntegerField(default=1)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='transaction',
+            name='connector_id',
+            field=models.PositiveSmallIntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='transaction',
+            name='energy',
+            field=models.FloatField(null=True),
+        ),
+        migrations.AddField(
+            model_name='transaction',
+            name='id_tag',
+            field=models.CharField(max_length=20, null=True),
+        ),
+        migrations.AddField(
+            model_name='transaction',
+            name='meter_start',
+            field=models.IntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='transaction',
+            name='meter_stop',
+            field=models.IntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='transaction',
+            name='stop_reason',
+            field=models.CharField(max_length=20, null=True),
+        ),
+        migrations.AddField(
+            model_name='transaction',
+            name='stopped_at',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.AddField(
+            model_name='transaction',
+            name='transaction_id',
+            field=models.PositiveIntegerField(null=True, unique=True),
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:48
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Charging', '0005_load_balancing'),
+        ('Commanding', '0012_charging_sessions'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CommandJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('command', models.CharField(max_length=50)),
+                ('payload', models.JSONField(default=dict)),
+                ('targets', models.JSONField(default=dict)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('finished_at', models.DateTimeField(null=True)),
+                ('total', models.PositiveIntegerField(default=0)),
+                ('done', models.PositiveIntegerField(default=0)),
+                ('counts', models.JSONField(default=dict)),
+                ('created_by', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='command_jobs', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='CommandJobResult',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(max_length=20)),
+                ('response', models.JSONField(null=True)),
+                ('charger', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='command_results', to='Charging.evcharger')),
+                ('job', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='results', to='Commanding.commandjob')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('job', 'charger'), name='unique_job_charger')],
+            },
+        ),
+    ]
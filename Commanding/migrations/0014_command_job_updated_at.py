@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Commanding', '0013_command_jobs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='commandjob',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
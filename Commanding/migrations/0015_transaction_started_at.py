@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:52
+
+import django.utils.timezone
+from django.db import migrations, models
+from django.db.models import F
+
+
+def backfill_started_at(apps, schema_editor):
+    # Earlier sessions only know when they were received
+    Transaction = apps.get_model('Commanding', 'Transaction')
+    Transaction.objects.update(started_at=F('date'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Commanding', '0014_command_job_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transaction',
+            name='started_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.RunPython(backfill_started_at, migrations.RunPython.noop),
+    ]
@@ -1,27 +1,432 @@
-from django.db import models
+from collections import defaultdict
+from datetime import timezone as dt_timezone
+import numpy as np
+from django.db import models, transaction
+from django.db.models import F, Window
+from django.db.models.functions import Lag
+from django.utils import timezone
 from Users.models import *
 from Charging.models import *
 
+class IdSequenceManager(models.Manager):
+
+    def reserve(self, name, size):
+        """
+        Reserve the next ``size`` values of the sequence ``name``.
+
+        Returns:
+            tuple: The first value of the block and the value after its last one.
+        """
+        with transaction.atomic():
+            self.get_or_create(name=name)
+            sequence = self.select_for_update().get(name=name)
+            start = sequence.next_value
+            sequence.next_value = start + size
+            sequence.save(update_fields=['next_value'])
+        return start, start + size
+
+class IdSequence(models.Model):
+    """
+    A named counter values are reserved from in blocks, see ``Commanding.sessions.TransactionIdAllocator``.
+    """
+    name = models.CharField(max_length=50, unique=True)
+    next_value = models.BigIntegerField(default=1)
+
+    objects = IdSequenceManager()
+
+    def __str__(self):
+        return f"{self.name} from {self.next_value}"
+
 class Transaction(models.Model):
+    """
+    A charging session, from the charger's StartTransaction to its StopTransaction. ``command``
+    is the last of the two received; meter readings are in Wh, ``energy`` in kWh, and ``amount``
+    is set when the session stops. ``started_at`` is the start the charger reported, which for a
+    session replayed after the charger was offline is earlier than ``date``, when it was
+    received; sessions are billed by ``started_at``.
+    """
     customer = models.ForeignKey(Customer, on_delete=models.CASCADE, related_name='customer_transaction')
-    command = models.CharField(max_length=10)
+    command = models.CharField(max_length=20)
     amount = models.FloatField(null=True)
     date = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(default=timezone.now)
     charger = models.ForeignKey(EVCharger, on_delete=models.CASCADE)
+    transaction_id = models.PositiveIntegerField(unique=True, null=True)
+    connector_id = models.PositiveSmallIntegerField(null=True)
+    id_tag = models.CharField(max_length=20, null=True)
+    meter_start = models.IntegerField(null=True)
+    meter_stop = models.IntegerField(null=True)
+    energy = models.FloatField(null=True)
+    stopped_at = models.DateTimeField(null=True)
+    stop_reason = models.CharField(max_length=20, null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['charger', 'date']),
+        ]
 
     def __str__(self):
         return f"Customer: {self.customer.user.username} consumed {self.amount} on charger {self.charger.serial_number}"
 
 class StatusLog(models.Model):
     charger = models.ForeignKey(EVCharger, on_delete=models.CASCADE, related_name='charger')
-    status = models.CharField(max_length=10)
+    status = models.CharField(max_length=20)
     payload = models.JSONField(null=True)
-    date = models.DateTimeField(auto_now_add=True)
+    date = models.DateTimeField(default=timezone.now, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['charger', 'date']),
+        ]
+
+class StatusIntervalManager(models.Manager):
+
+    def transition(self, charger_id, status, at):
+        """
+        Close the open interval of the charger at ``at`` and open one with ``status``, unless the
+        charger is already in ``status``.
+
+        Returns:
+            StatusInterval: The open interval of the charger.
+        """
+        with transaction.atomic():
+            current = self.select_for_update().filter(charger_id=charger_id, end__isnull=True).first()
+            if current is not None:
+                if current.status == status:
+                    return current
+                current.end = at
+                current.save(update_fields=['end'])
+            return self.create(charger_id=charger_id, status=status, start=at)
+
+    def transition_many(self, charger_ids, status, at):
+        """
+        Move several chargers that are not in ``status`` to it at ``at``, closing their open
+        intervals with one UPDATE and opening the new ones with one INSERT.
+        """
+        with transaction.atomic():
+            self.filter(charger_id__in=charger_ids, end__isnull=True).update(end=at)
+            self.bulk_create(self.model(charger_id=charger_id, status=status, start=at) for charger_id in charger_ids)
+
+    def overlapping(self, charger, start, end):
+        """
+        Return the intervals of ``charger`` overlapping ``[start, end)``, oldest first.
+
+        The intervals of a charger follow each other without overlapping, so these are the last
+        interval starting before ``start`` and the ones starting inside the range: two seeks on
+        the ``(charger, start)`` index instead of a scan of the charger's history.
+        """
+        previous = self.filter(charger=charger, start__lt=start).order_by('-start').first()
+        inside = list(self.filter(charger=charger, start__gte=start, start__lt=end).order_by('start'))
+        if previous is not None and (previous.end is None or previous.end > start):
+            inside.insert(0, previous)
+        return inside
+
+class StatusInterval(models.Model):
+    """
+    A period during which a charger kept the same status; ``end`` is null while it still has it.
+    Maintained by the consumers on every status change, so a status timeline is read from a
+    handful of intervals instead of every ``StatusLog`` row.
+    """
+    charger = models.ForeignKey(EVCharger, on_delete=models.CASCADE, related_name='status_intervals')
+    status = models.CharField(max_length=20)
+    start = models.DateTimeField()
+    end = models.DateTimeField(null=True)
+
+    objects = StatusIntervalManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['charger'], condition=models.Q(end__isnull=True), name='one_open_status_interval'
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['charger', 'start']),
+        ]
+
+    def __str__(self):
+        return f"{self.charger.serial_number} {self.status} from {self.start} to {self.end or 'now'}"
+
+class HeartbeatLogManager(models.Manager):
+
+    def gaps(self, charger, start, end, threshold):
+        """
+        Return the periods of ``[start, end)`` in which ``charger`` went longer than ``threshold``
+        without a heartbeat, oldest first, as ``(start, end)`` tuples clipped to the range.
+
+        The gaps between heartbeats are found by the database with a window over the range, read
+        from the ``(charger, received_at)`` index; only the gaps are returned.
+        """
+        heartbeats = self.filter(charger=charger)
+        in_range = heartbeats.filter(received_at__gte=start, received_at__lt=end)
+        edge = heartbeats.filter(received_at__lt=start).order_by('-received_at').values_list(
+            'received_at', flat=True).first() or start
+        first = in_range.order_by('received_at').values_list('received_at', flat=True).first()
+        if first is None:
+            return [(start, end)] if end - edge > threshold else []
+
+        gaps = [(start, first)] if first - edge > threshold else []
+        gaps.extend(
+            in_range.annotate(previous=Window(Lag('received_at'), order_by=F('received_at').asc()))
+            .filter(previous__lt=F('received_at') - threshold)
+            .order_by('received_at')
+            .values_list('previous', 'received_at')
+        )
+        last = in_range.order_by('-received_at').values_list('received_at', flat=True).first()
+        if end - last > threshold:
+            gaps.append((last, end))
+        return gaps
 
 class HeartbeatLog(models.Model):
     charger = models.ForeignKey(EVCharger, on_delete=models.CASCADE, related_name='heartbeats')
-    received_at = models.DateTimeField(auto_now_add=True)
+    received_at = models.DateTimeField(default=timezone.now, editable=False)
     payload = models.JSONField(null=True)
 
+    objects = HeartbeatLogManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['charger', 'received_at']),
+        ]
+
+    def __str__(self):
+        return f"Heartbeat from {self.charger.serial_number} at {self.received_at}"
+
+# Layout of one meter sample inside a MeterValueChunk. Time is stored as milliseconds since the
+# start of the chunk's hour, which always fits in 32 bits.
+SAMPLE_DTYPE = np.dtype([
+    ('offset', '<u4'),
+    ('energy', '<f8'),
+    ('power', '<f4'),
+    ('current', '<f4'),
+    ('voltage', '<f4'),
+])
+MEASUREMENTS = ('energy', 'power', 'current', 'voltage')
+
+def truncate_to_hour(timestamp):
+    return timestamp.astimezone(dt_timezone.utc).replace(minute=0, second=0, microsecond=0)
+
+class MeterValueChunkManager(models.Manager):
+
+    def append_samples(self, samples):
+        """
+        Append meter samples to the chunks they belong to, creating missing chunks.
+
+        The chunks are read with ``select_for_update()`` in the transaction that writes them
+        back, so workers appending to the same chunk at once do not overwrite each other's
+        samples. Two workers creating the same chunk at once conflict on the unique constraint
+        instead, and the writer's retry then appends to the chunk the other one created.
+
+        Args:
+            samples (dict): Maps a charger id to a list of samples, each a dict with a ``timestamp``
+                and any of the ``MEASUREMENTS`` (missing ones are stored as NaN).
+        """
+        grouped = defaultdict(list)
+        for charger_id, rows in samples.items():
+            for row in rows:
+                timestamp = row['timestamp']
+                if timezone.is_naive(timestamp):
+                    timestamp = timestamp.replace(tzinfo=dt_timezone.utc)
+                hour = truncate_to_hour(timestamp)
+                offset = int((timestamp - hour).total_seconds() * 1000)
+                grouped[(charger_id, hour)].append(
+                    (offset,) + tuple(row.get(name, np.nan) for name in MEASUREMENTS)
+                )
+        if not grouped:
+            return
+
+        with transaction.atomic():
+            existing = {
+                (chunk.charger_id, chunk.hour): chunk
+                for chunk in self.select_for_update().filter(
+                    charger_id__in={charger_id for charger_id, _ in grouped},
+                    hour__in={hour for _, hour in grouped},
+                )
+            }
+            to_create, to_update = [], []
+            for (charger_id, hour), rows in grouped.items():
+                chunk = existing.get((charger_id, hour))
+                if chunk is None:
+                    chunk = self.model(charger_id=charger_id, hour=hour)
+                    to_create.append(chunk)
+                else:
+                    to_update.append(chunk)
+                chunk.extend(np.array(rows, dtype=SAMPLE_DTYPE))
+
+            self.bulk_create(to_create)
+            self.bulk_update(to_update, ['count', 'offsets', *MEASUREMENTS])
+
+    def range(self, charger, start, end):
+        """
+        Return the samples of ``charger`` with ``start <= timestamp < end`` as NumPy arrays.
+
+        Returns:
+            dict: ``timestamp`` (datetime64[ms], UTC) and one float array per measurement, sorted by time.
+        """
+        chunks = self.filter(
+            charger=charger, hour__gte=truncate_to_hour(start), hour__lt=end
+        ).order_by('hour')
+
+        parts = []
+        for chunk in chunks:
+            samples = chunk.samples()
+            timestamps = np.datetime64(chunk.hour.replace(tzinfo=None), 'ms') + samples['offset'].astype('timedelta64[ms]')
+            parts.append((timestamps, samples))
+
+        if parts:
+            timestamps = np.concatenate([timestamps for timestamps, _ in parts])
+            samples = np.concatenate([samples for _, samples in parts])
+        else:
+            timestamps = np.array([], dtype='datetime64[ms]')
+            samples = np.array([], dtype=SAMPLE_DTYPE)
+
+        start_ms = np.datetime64(start.astimezone(dt_timezone.utc).replace(tzinfo=None), 'ms')
+        end_ms = np.datetime64(end.astimezone(dt_timezone.utc).replace(tzinfo=None), 'ms')
+        mask = (timestamps >= start_ms) & (timestamps < end_ms)
+        result = {'timestamp': timestamps[mask]}
+        for name in MEASUREMENTS:
+            result[name] = samples[name][mask]
+        return result
+
+class MeterValueChunk(models.Model):
+    """
+    One hour of meter samples of a charger, stored column by column as packed arrays
+    (see ``SAMPLE_DTYPE``) instead of one row per sample.
+    """
+    charger = models.ForeignKey(EVCharger, on_delete=models.CASCADE, related_name='meter_chunks')
+    hour = models.DateTimeField()
+    count = models.PositiveIntegerField(default=0)
+    offsets = models.BinaryField(default=b'')
+    energy = models.BinaryField(default=b'')
+    power = models.BinaryField(default=b'')
+    current = models.BinaryField(default=b'')
+    voltage = models.BinaryField(default=b'')
+
+    objects = MeterValueChunkManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['charger', 'hour'], name='unique_meter_chunk_per_hour'),
+        ]
+
+    def samples(self):
+        """Return the chunk's samples as a structured array of ``SAMPLE_DTYPE``."""
+        samples = np.empty(self.count, dtype=SAMPLE_DTYPE)
+        samples['offset'] = np.frombuffer(bytes(self.offsets), dtype=SAMPLE_DTYPE['offset'])
+        for name in MEASUREMENTS:
+            samples[name] = np.frombuffer(bytes(getattr(self, name)), dtype=SAMPLE_DTYPE[name])
+        return samples
+
+    def extend(self, new_samples):
+        """Merge ``new_samples`` into the chunk, keeping it sorted by time."""
+        samples = np.concatenate([self.samples(), new_samples]) if self.count else new_samples
+        samples = samples[np.argsort(samples['offset'], kind='stable')]
+        self.count = len(samples)
+        self.offsets = samples['offset'].tobytes()
+        for name in MEASUREMENTS:
+            setattr(self, name, np.ascontiguousarray(samples[name]).tobytes())
+
+    def __str__(self):
+        return f"{self.count} meter samples from {self.charger.serial_number} at {self.hour}"
+
+class ChargerRollup(models.Model):
+    """
+    Aggregated meter and heartbeat history of a charger over one time bucket.
+    Maintained by ``Commanding.rollups.RollupEngine``.
+    """
+    RESOLUTION_CHOICES = [
+        ('1m', '1 minute'),
+        ('15m', '15 minutes'),
+        ('1h', '1 hour'),
+        ('1d', '1 day'),
+    ]
+    charger = models.ForeignKey(EVCharger, on_delete=models.CASCADE, related_name='rollups')
+    resolution = models.CharField(max_length=3, choices=RESOLUTION_CHOICES)
+    bucket = models.DateTimeField()
+    samples = models.PositiveIntegerField(default=0)
+    power_min = models.FloatField(null=True)
+    power_max = models.FloatField(null=True)
+    power_avg = models.FloatField(null=True)
+    energy_delta = models.FloatField(null=True)
+    energy_end = models.FloatField(null=True)
+    heartbeats = models.PositiveIntegerField(default=0)
+    uptime = models.FloatField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['charger', 'resolution', 'bucket'], name='unique_rollup_bucket'),
+        ]
+        indexes = [
+            models.Index(fields=['resolution', 'bucket']),
+        ]
+
+    def __str__(self):
+        return f"{self.get_resolution_display()} rollup of {self.charger.serial_number} at {self.bucket}"
+
+class RollupWatermark(models.Model):
+    """
+    The point in time up to which a rollup resolution has been computed.
+    """
+    resolution = models.CharField(max_length=3, unique=True)
+    position = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.resolution} rolled up to {self.position}"
+
+class CommandJob(models.Model):
+    """
+    One OCPP command sent to a set of chargers through the bulk command API, with the progress
+    of the rollout. ``counts`` holds the number of chargers per result status (see
+    ``Commanding.commands.RESULT_STATUSES``). Maintained by ``Commanding.fleet.FleetCommand``,
+    which saves the job at least every ``BULK_COMMAND_FLUSH_INTERVAL`` seconds while it runs; a
+    job left unfinished by a process that stopped is marked ``interrupted`` (see
+    ``Commanding.fleet.interrupt_orphaned_jobs``).
+    """
+    command = models.CharField(max_length=50)
+    payload = models.JSONField(default=dict)
+    targets = models.JSONField(default=dict)
+    created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, related_name='command_jobs')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(null=True)
+    total = models.PositiveIntegerField(default=0)
+    done = models.PositiveIntegerField(default=0)
+    counts = models.JSONField(default=dict)
+
+    @property
+    def state(self):
+        if self.finished_at is None:
+            return 'running'
+        return 'finished' if self.done >= self.total else 'interrupted'
+
+    def as_dict(self):
+        return {
+            'job': self.id,
+            'command': self.command,
+            'state': self.state,
+            'total': self.total,
+            'done': self.done,
+            'counts': self.counts,
+            'created_at': self.created_at.isoformat(),
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+        }
+
+    def __str__(self):
+        return f"{self.command} to {self.total} chargers ({self.done} done)"
+
+class CommandJobResult(models.Model):
+    """
+    The result of a :class:`CommandJob` for one charger: its status and the charger's answer.
+    """
+    job = models.ForeignKey(CommandJob, on_delete=models.CASCADE, related_name='results')
+    charger = models.ForeignKey(EVCharger, on_delete=models.CASCADE, related_name='command_results')
+    status = models.CharField(max_length=20)
+    response = models.JSONField(null=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['job', 'charger'], name='unique_job_charger'),
+        ]
+
     def __str__(self):
-        return f"Heartbeat from {self.charger.serial_number} at {self.received_at}"
\ No newline at end of file
+        return f"{self.job.command} to {self.charger.serial_number}: {self.status}"
@@ -0,0 +1,218 @@
+import logging
+from datetime import datetime, timedelta, timezone as dt_timezone
+from django.conf import settings
+from django.db import DatabaseError, connections, transaction
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+def _floor_day(timestamp):
+    return timestamp.astimezone(dt_timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+
+def _floor_month(timestamp):
+    return _floor_day(timestamp).replace(day=1)
+
+def _next_month(start):
+    return start.replace(year=start.year + start.month // 12, month=start.month % 12 + 1)
+
+# Period -> (start of the period containing a timestamp, start of the next period, partition name suffix)
+PERIODS = {
+    'day': (_floor_day, lambda start: start + timedelta(days=1), '%Y%m%d'),
+    'month': (_floor_month, _next_month, '%Y%m'),
+}
+
+class TimePartitions:
+    """
+    Range partitions of an append-only log table, one per day or month of ``column``.
+
+    On PostgreSQL the table is declaratively partitioned (see migration
+    ``0010_partition_status_and_heartbeat_logs``): inserts go through the parent and are routed
+    to the partition of their timestamp, a query filtering on ``column`` only scans the
+    partitions of its range, and expired history is removed by dropping whole partitions. Rows
+    outside every partition, including the history that predates the migration, land in a
+    ``_default`` partition; rows of a partition created later are moved out of it. Upcoming
+    partitions are created by :func:`ensure_upcoming_partitions` as the log rows are written,
+    and by every ``rollup_history`` pass. On other databases the table is a plain table and only the ``DELETE``
+    part of :meth:`prune` applies.
+
+    Args:
+        model: The partitioned model.
+        column (str): The timestamp column the table is partitioned by.
+        period (str): ``'day'`` or ``'month'``, ``LOG_PARTITION_PERIOD`` by default.
+        using (str): Database alias.
+    """
+
+    def __init__(self, model, column, period=None, using='default'):
+        self.model = model
+        self.column = column
+        self.period = period or getattr(settings, "LOG_PARTITION_PERIOD", 'day')
+        self.using = using
+        self.floor, self.next, self.suffix = PERIODS[self.period]
+
+    @property
+    def connection(self):
+        return connections[self.using]
+
+    @property
+    def table(self):
+        return self.model._meta.db_table
+
+    def quote(self, name):
+        return self.connection.ops.quote_name(name)
+
+    def partition_name(self, start):
+        return f'{self.table}_p{start.strftime(self.suffix)}'
+
+    def is_partitioned(self):
+        if self.connection.vendor != 'postgresql':
+            return False
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s)", [self.quote(self.table)]
+            )
+            return cursor.fetchone() is not None
+
+    def partitions(self):
+        """
+        Return the time partitions of the table, oldest first.
+
+        Returns:
+            list: ``(name, start, end)`` tuples; the ``_default`` partition is not included.
+        """
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                """
+                SELECT child.relname FROM pg_inherits
+                JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+                WHERE pg_inherits.inhparent = to_regclass(%s)
+                """,
+                [self.quote(self.table)],
+            )
+            names = [name for name, in cursor.fetchall()]
+
+        prefix = f'{self.table}_p'
+        partitions = []
+        for name in names:
+            if not name.startswith(prefix):
+                continue
+            suffix = name[len(prefix):]
+            # Partitions keep the layout they were created with if LOG_PARTITION_PERIOD changes
+            period = 'day' if len(suffix) == 8 else 'month'
+            start = datetime.strptime(suffix, PERIODS[period][2]).replace(tzinfo=dt_timezone.utc)
+            partitions.append((name, start, PERIODS[period][1](start)))
+        return sorted(partitions, key=lambda partition: partition[1])
+
+    def create(self, start, end):
+        """
+        Create the missing partitions covering ``[start, end)``.
+
+        Rows of a new partition's range that were inserted into the ``_default`` partition are
+        moved into it in the same transaction.
+
+        Returns:
+            list: Names of the partitions created.
+        """
+        if not self.is_partitioned():
+            return []
+        existing = self.partitions()
+        created = []
+        position = self.floor(start)
+        while position < end:
+            period_end = self.next(position)
+            # A partition created with another period may already cover part of this one
+            if not any(s < period_end and position < e for _, s, e in existing):
+                self.attach(position, period_end)
+                created.append(self.partition_name(position))
+            position = period_end
+        if created:
+            logger.info(f"Created partitions {', '.join(created)} of {self.table}")
+        return created
+
+    def attach(self, start, end):
+        table, column = self.quote(self.table), self.quote(self.column)
+        partition = self.quote(self.partition_name(start))
+        default = self.quote(f'{self.table}_default')
+        with transaction.atomic(using=self.using), self.connection.cursor() as cursor:
+            cursor.execute(f"CREATE TABLE {partition} (LIKE {table} INCLUDING DEFAULTS)")
+            cursor.execute(
+                f"""
+                WITH moved AS (
+                    DELETE FROM {default} WHERE {column} >= %s AND {column} < %s RETURNING *
+                )
+                INSERT INTO {partition} SELECT * FROM moved
+                """,
+                [start, end],
+            )
+            cursor.execute(f"ALTER TABLE {table} ATTACH PARTITION {partition} FOR VALUES FROM (%s) TO (%s)", [start, end])
+
+    def drop_before(self, cutoff):
+        """
+        Drop the partitions that end at or before ``cutoff``.
+
+        Returns:
+            list: Names of the partitions dropped.
+        """
+        if not self.is_partitioned():
+            return []
+        dropped = []
+        for name, start, end in self.partitions():
+            if end > cutoff:
+                break
+            with self.connection.cursor() as cursor:
+                cursor.execute(f"DROP TABLE {self.quote(name)}")
+            dropped.append(name)
+        if dropped:
+            logger.info(f"Dropped partitions {', '.join(dropped)} of {self.table}")
+        return dropped
+
+    def prune(self, cutoff):
+        """
+        Remove the rows older than ``cutoff``: whole partitions are dropped, and the rows before
+        the cutoff in the partition it falls into (or in the table, when it is not partitioned)
+        are deleted.
+
+        Returns:
+            int: Number of rows deleted, not counting the dropped partitions.
+        """
+        self.drop_before(cutoff)
+        return self.model.objects.using(self.using).filter(**{f'{self.column}__lt': cutoff}).delete()[0]
+
+def log_partitions():
+    """The partitioned log tables: ``StatusLog`` by ``date`` and ``HeartbeatLog`` by ``received_at``."""
+    from Commanding.models import StatusLog, HeartbeatLog
+    return [TimePartitions(StatusLog, 'date'), TimePartitions(HeartbeatLog, 'received_at')]
+
+def create_upcoming_partitions(now=None, ahead=None):
+    """
+    Make sure the log tables have partitions from the current period to ``ahead`` periods
+    (``LOG_PARTITIONS_AHEAD``) in the future, so new rows never land in the default partition.
+    """
+    now = now or timezone.now()
+    ahead = ahead if ahead is not None else getattr(settings, "LOG_PARTITIONS_AHEAD", 3)
+    for partitions in log_partitions():
+        end = partitions.floor(now)
+        for _ in range(ahead + 1):
+            end = partitions.next(end)
+        partitions.create(now, end)
+
+_partitions_checked_on = None
+
+def ensure_upcoming_partitions(now=None):
+    """
+    Call :func:`create_upcoming_partitions` once a day in this process, so the upcoming partitions
+    exist even where ``rollup_history`` does not run. Called by the log writer before it writes.
+
+    A failure (e.g. another process creating the same partition) is logged and tried again on
+    the next call; meanwhile rows go to the default partition.
+    """
+    global _partitions_checked_on
+    now = now or timezone.now()
+    today = _floor_day(now)
+    if _partitions_checked_on == today:
+        return
+    try:
+        create_upcoming_partitions(now)
+    except DatabaseError as e:
+        logger.warning(f"Could not create the upcoming log partitions: {e}")
+        return
+    _partitions_checked_on = today
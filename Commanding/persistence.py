@@ -0,0 +1,287 @@
+import asyncio
+import logging
+import time
+from collections import defaultdict
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db import transaction
+from Charging.models import EVCharger
+from Charging.registry import charger_registry
+from Commanding.models import MeterValueChunk
+from Commanding.partitions import ensure_upcoming_partitions
+from Commanding.rollups import rewind_watermarks
+
+logger = logging.getLogger(__name__)
+
+class LogWriter:
+    """
+    Write-behind queue for the log rows produced on the OCPP message path.
+
+    Consumers hand rows (``HeartbeatLog``, ``StatusLog``, ...) to :meth:`put` instead of
+    saving them one by one. A background task collects them and writes them with
+    ``bulk_create`` once ``batch_size`` rows are waiting or ``flush_interval`` seconds
+    have passed, whichever comes first, and keeps writing full batches without waiting while
+    a backlog is queued. The queue is bounded: when it is full, ``put`` waits until the next
+    flush makes room, which pushes back on the producing consumers instead of growing memory
+    without limit.
+
+    A batch that fails to write is tried again ``retries`` times, to ride out a dropped
+    connection or a lock timeout. If it still fails it is split in halves that are written on
+    their own, so a single row the database refuses is dropped by itself instead of with the
+    rows of every other charger in the batch.
+
+    Rows of serial numbers that match no charger are dropped and counted in ``rows_unknown``,
+    once, before the batch is written: a charger cannot be created from its serial number
+    alone, since it needs a station.
+
+    On PostgreSQL the log tables are partitioned by time; the writer creates the upcoming
+    partitions once a day before writing (see ``Commanding.partitions``).
+
+    Attributes:
+        batch_size (int): Number of queued rows that triggers an immediate flush.
+        flush_interval (float): Maximum time in seconds a row waits before being flushed.
+        max_queue_size (int): Number of rows the queue holds before ``put`` blocks.
+        retries (int): Times a failed batch is written again before it is split.
+    """
+
+    def __init__(self, batch_size=None, flush_interval=None, max_queue_size=None, retries=None):
+        self.batch_size = batch_size or getattr(settings, "OCPP_LOG_BATCH_SIZE", 500)
+        self.flush_interval = flush_interval or getattr(settings, "OCPP_LOG_FLUSH_INTERVAL", 1.0)
+        self.max_queue_size = max_queue_size or getattr(settings, "OCPP_LOG_QUEUE_MAXSIZE", 10000)
+        self.retries = getattr(settings, "OCPP_LOG_WRITE_RETRIES", 2) if retries is None else retries
+        self.retry_delay = getattr(settings, "OCPP_LOG_RETRY_DELAY", 0.5)
+
+        self._queue = asyncio.Queue(maxsize=self.max_queue_size)
+        self._batch_ready = asyncio.Event()
+        self._loop = None
+        self._task = None
+        self._closing = False
+        self._users = 0
+
+        # Metrics
+        self.rows_written = 0
+        self.rows_dropped = 0
+        self.rows_unknown = 0
+        self.flushes = 0
+        self.last_flush_latency = 0.0
+        self.max_flush_latency = 0.0
+
+    @property
+    def depth(self):
+        """Number of rows waiting to be written."""
+        return self._queue.qsize()
+
+    def stats(self):
+        return {
+            "queue_depth": self.depth,
+            "queue_maxsize": self.max_queue_size,
+            "rows_written": self.rows_written,
+            "rows_dropped": self.rows_dropped,
+            "rows_unknown": self.rows_unknown,
+            "flushes": self.flushes,
+            "last_flush_latency": self.last_flush_latency,
+            "max_flush_latency": self.max_flush_latency,
+        }
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._closing = False
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def acquire(self):
+        """Register a consumer that produces rows, starting the flusher if needed."""
+        self._users += 1
+        self.start()
+
+    async def release(self):
+        """Unregister a consumer; the last one to leave drains the queue."""
+        self._users = max(self._users - 1, 0)
+        if self._users == 0:
+            await self.close()
+
+    async def put(self, model, serial_number, **fields):
+        """
+        Queue a row of ``model`` for the charger identified by ``serial_number``.
+
+        Waits while the queue is full.
+        """
+        self.start()
+        await self._queue.put((model, serial_number, fields))
+        if self._queue.qsize() >= self.batch_size:
+            self._batch_ready.set()
+
+    async def flush(self):
+        """Write everything that is currently queued."""
+        batch = self._drain()
+        if batch:
+            await self._write(batch)
+
+    async def close(self):
+        """Flush the remaining rows and stop the background task."""
+        if self._task is None:
+            return
+        self._closing = True
+        self._batch_ready.set()
+        await self._task
+        self._task = None
+
+    async def _run(self):
+        while not self._closing or not self._queue.empty():
+            # A backlog of full batches, or the rest of the queue when closing, is written at once
+            if not self._closing and self._queue.qsize() < self.batch_size:
+                try:
+                    await asyncio.wait_for(self._batch_ready.wait(), self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+            self._batch_ready.clear()
+            batch = self._drain()
+            if batch:
+                await self._write(batch)
+
+    def _drain(self):
+        batch = []
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except asyncio.QueueEmpty:
+                break
+        return batch
+
+    async def _write(self, batch):
+        started = time.perf_counter()
+        # Resolved once, by the first attempt that reaches the database, and kept for the others
+        rows = None
+        for attempt in range(self.retries + 1):
+            try:
+                if rows is None:
+                    rows = await database_sync_to_async(self._resolve)(batch)
+                written = await database_sync_to_async(self._bulk_create)(rows)
+                break
+            except Exception as e:
+                logger.warning("Failed to write %d rows (attempt %d of %d): %s",
+                               len(batch), attempt + 1, self.retries + 1, e)
+                if attempt < self.retries:
+                    await asyncio.sleep(self.retry_delay * 2 ** attempt)
+        else:
+            if rows is None:
+                logger.error("Dropping %d rows: their chargers cannot be read", len(batch))
+                rows, written = batch, 0
+            else:
+                written = await self._write_split(rows)
+        latency = time.perf_counter() - started
+
+        self.rows_written += written
+        self.rows_dropped += len(rows) - written
+        self.flushes += 1
+        self.last_flush_latency = latency
+        self.max_flush_latency = max(self.max_flush_latency, latency)
+        logger.debug(
+            "Flushed %d log rows in %.1f ms (queue depth %d)", written, latency * 1000, self.depth
+        )
+
+    async def _write_split(self, rows):
+        """Write ``rows`` in halves, down to single rows, dropping the rows that fail on their own."""
+        if len(rows) == 1:
+            logger.error("Dropping %s for charger %s: it cannot be written", rows[0][0].__name__, rows[0][1])
+            return 0
+        written = 0
+        middle = len(rows) // 2
+        for half in (rows[:middle], rows[middle:]):
+            try:
+                written += await database_sync_to_async(self._bulk_create)(half)
+            except Exception:
+                written += await self._write_split(half)
+        return written
+
+    def _charger_ids(self, batch):
+        """Map the serial numbers in ``batch`` to charger ids."""
+        # Connected chargers are in the registry; only query the ones that are not
+        charger_ids = {}
+        for _, serial_number, _ in batch:
+            entry = charger_registry.get(serial_number)
+            if entry is not None:
+                charger_ids[serial_number] = entry.id
+        missing = {serial_number for _, serial_number, _ in batch} - charger_ids.keys()
+        if missing:
+            charger_ids.update(
+                EVCharger.objects.filter(serial_number__in=missing).values_list('serial_number', 'id')
+            )
+        return charger_ids
+
+    def _resolve(self, batch):
+        """
+        Return the ``(model, serial number, charger id, fields)`` of the rows of ``batch``,
+        dropping and counting the rows of unknown chargers.
+        """
+        charger_ids = self._charger_ids(batch)
+        rows = []
+        for model, serial_number, fields in batch:
+            charger_id = charger_ids.get(serial_number)
+            if charger_id is None:
+                self.rows_unknown += 1
+                logger.warning("Dropping %s for unknown charger %s", model.__name__, serial_number)
+                continue
+            rows.append((model, serial_number, charger_id, fields))
+        return rows
+
+    def _bulk_create(self, rows):
+        ensure_upcoming_partitions()
+        objs = defaultdict(list)
+        for model, _, charger_id, fields in rows:
+            objs[model].append(model(charger_id=charger_id, **fields))
+
+        with transaction.atomic():
+            for model, model_objs in objs.items():
+                model.objects.bulk_create(model_objs)
+        return len(rows)
+
+class MeterValueWriter(LogWriter):
+    """
+    Write-behind queue for meter samples.
+
+    Samples are queued like log rows, but a flush groups them by charger and hour and appends
+    each group to the charger's ``MeterValueChunk`` for that hour, so a batch costs one read of
+    the affected chunks plus one bulk insert and one bulk update. Samples older than the rollup
+    watermarks move them back, so late samples are rolled up too.
+    """
+
+    def __init__(self, batch_size=None, flush_interval=None, max_queue_size=None, retries=None):
+        super().__init__(
+            batch_size=batch_size or getattr(settings, "METER_VALUES_BATCH_SIZE", 2000),
+            flush_interval=flush_interval or getattr(settings, "METER_VALUES_FLUSH_INTERVAL", 5.0),
+            max_queue_size=max_queue_size,
+            retries=retries,
+        )
+
+    def _bulk_create(self, rows):
+        samples = defaultdict(list)
+        for _, _, charger_id, fields in rows:
+            samples[charger_id].append(fields)
+
+        if samples:
+            with transaction.atomic():
+                MeterValueChunk.objects.append_samples(samples)
+                rewind_watermarks(min(fields['timestamp'] for _, _, _, fields in rows))
+        return len(rows)
+
+_writers = {}
+
+def _get_writer(writer_class):
+    loop = asyncio.get_running_loop()
+    writer = _writers.get(writer_class)
+    if writer is None or writer._loop is not loop:
+        writer = _writers[writer_class] = writer_class()
+        writer._loop = loop
+    return writer
+
+def get_log_writer():
+    """
+    Return the log writer bound to the running event loop, creating it on first use.
+    """
+    return _get_writer(LogWriter)
+
+def get_meter_writer():
+    """
+    Return the meter sample writer bound to the running event loop, creating it on first use.
+    """
+    return _get_writer(MeterValueWriter)
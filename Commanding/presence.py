@@ -0,0 +1,111 @@
+import logging
+import time
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Only delete the key if it still points at the given channel, so a worker whose charger has
+# already reconnected to another worker does not remove the new registration.
+COMPARE_AND_DELETE = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+# Fallback storage for channel layers that are not backed by Redis (e.g. InMemoryChannelLayer),
+# which only deliver messages inside one process anyway.
+_local_presence = {}
+
+class ChargerPresence:
+    """
+    Cluster-wide map of connected chargers to the channel of the consumer that owns their websocket.
+
+    Every ``MonitoringConsumer`` registers ``serial_number -> channel_name`` in the Redis instance
+    behind the channel layer when its charge point connects, and refreshes the key while frames keep
+    arriving. Keys expire after ``ttl`` seconds, so chargers held by a worker that died without
+    cleaning up disappear on their own. Any worker can then deliver a command to a charger with one
+    ``GET`` and a ``channel_layer.send`` to the owning consumer, whichever process it runs in.
+
+    Attributes:
+        channel_layer: The channel layer whose Redis hosts store the registry.
+        ttl (int): Seconds a registration stays valid without being refreshed.
+    """
+
+    def __init__(self, channel_layer, ttl=None):
+        self.channel_layer = channel_layer
+        self.ttl = ttl or getattr(
+            settings, "CHARGER_PRESENCE_TTL", 3 * getattr(settings, "HEARTBEAT_INTERVAL", 10)
+        )
+
+    def _key(self, serial_number):
+        prefix = getattr(self.channel_layer, "prefix", "asgi")
+        return f"{prefix}:charger:{serial_number}"
+
+    def _connection(self, key):
+        layer = self.channel_layer
+        if hasattr(layer, "connection") and hasattr(layer, "consistent_hash"):
+            return layer.connection(layer.consistent_hash(key))
+        return None
+
+    async def register(self, serial_number, channel_name):
+        """Claim ``serial_number`` for ``channel_name``, or extend an existing claim."""
+        key = self._key(serial_number)
+        connection = self._connection(key)
+        if connection is None:
+            _local_presence[key] = (channel_name, time.monotonic() + self.ttl)
+        else:
+            await connection.set(key, channel_name, ex=self.ttl)
+
+    refresh = register
+
+    async def unregister(self, serial_number, channel_name):
+        key = self._key(serial_number)
+        connection = self._connection(key)
+        if connection is None:
+            owner = _local_presence.get(key)
+            if owner is not None and owner[0] == channel_name:
+                del _local_presence[key]
+        else:
+            await connection.eval(COMPARE_AND_DELETE, 1, key, channel_name)
+
+    async def lookup(self, serial_number):
+        """Return the channel name owning ``serial_number``, or None if the charger is not connected."""
+        key = self._key(serial_number)
+        connection = self._connection(key)
+        if connection is None:
+            owner = _local_presence.get(key)
+            if owner is None:
+                return None
+            channel_name, expires_at = owner
+            if expires_at < time.monotonic():
+                del _local_presence[key]
+                return None
+            return channel_name
+
+        channel_name = await connection.get(key)
+        if channel_name is None:
+            return None
+        return channel_name.decode() if isinstance(channel_name, bytes) else channel_name
+
+    async def send_command(self, serial_number, command, payload=None, **options):
+        """
+        Deliver ``command`` to the consumer of ``serial_number``, wherever it runs.
+
+        ``options`` (``command_id``, ``reply_to``, ``timeout``, ``expires_at``) are passed along in the event; with
+        a ``reply_to`` channel the consumer sends the result there (see ``Commanding.commands``).
+
+        Returns False if the charger is not connected to any worker.
+        """
+        channel_name = await self.lookup(serial_number)
+        if channel_name is None:
+            logger.warning(f"Charger {serial_number} is not connected, dropping command {command}")
+            return False
+
+        await self.channel_layer.send(channel_name, {
+            'type': 'send_command',
+            'command': command,
+            'payload': payload or {},
+            **options,
+        })
+        return True
@@ -0,0 +1,312 @@
+import logging
+from datetime import datetime, timedelta, timezone as dt_timezone
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Min, OuterRef, Subquery
+from django.db.models.functions import TruncMinute
+from django.utils import timezone
+from Charging.models import EVCharger
+from .partitions import create_upcoming_partitions, log_partitions
+from .models import (
+    ChargerRollup,
+    RollupWatermark,
+    MeterValueChunk,
+    HeartbeatLog,
+    truncate_to_hour,
+)
+
+logger = logging.getLogger(__name__)
+
+# Resolution -> (bucket size in seconds, resolution it is rolled up from, seconds processed per transaction)
+RESOLUTIONS = {
+    '1m': (60, None, 3600),
+    '15m': (900, '1m', 6 * 3600),
+    '1h': (3600, '15m', 86400),
+    '1d': (86400, '1h', 7 * 86400),
+}
+
+ROLLUP_FIELDS = [
+    'samples', 'power_min', 'power_max', 'power_avg', 'energy_delta', 'energy_end', 'heartbeats', 'uptime',
+]
+
+def floor_time(timestamp, seconds):
+    epoch = int(timestamp.timestamp())
+    return datetime.fromtimestamp(epoch - epoch % seconds, tz=dt_timezone.utc)
+
+def rewind_watermarks(timestamp, now=None):
+    """
+    Move the watermarks back to the bucket of ``timestamp``, so the buckets from there on are
+    computed again by the next run, for raw data that arrived after they were rolled up.
+
+    Data older than the raw retention is not rolled up again: the raw rows it would be
+    aggregated with may already be pruned.
+    """
+    raw_days = getattr(settings, "ROLLUP_RETENTION", {}).get('raw')
+    if raw_days is not None:
+        timestamp = max(timestamp, (now or timezone.now()) - timedelta(days=raw_days))
+    for resolution, (size, _, _) in RESOLUTIONS.items():
+        position = floor_time(timestamp, size)
+        RollupWatermark.objects.filter(resolution=resolution, position__gt=position).update(position=position)
+
+def _min(a, b):
+    return b if a is None else a if b is None else min(a, b)
+
+def _max(a, b):
+    return b if a is None else a if b is None else max(a, b)
+
+class RollupEngine:
+    """
+    Incrementally aggregates raw charger history into 1-minute, 15-minute, hourly and daily buckets.
+
+    1-minute buckets are computed from the raw ``MeterValueChunk`` samples and ``HeartbeatLog``
+    rows; every coarser resolution is computed from the one below it. Each resolution keeps a
+    ``RollupWatermark``: the end of the last bucket it completed. A run only processes the time
+    between the watermark and ``now - ROLLUP_LATENESS``, writes the buckets and advances the
+    watermark in the same transaction, so an interrupted run simply resumes where it stopped.
+    Meter samples arriving later than that move the watermarks back (:func:`rewind_watermarks`),
+    and their buckets are computed again by the next run. A watermark is only advanced from the
+    position its window was computed from: one moved back meanwhile is kept, and the run goes
+    on from there.
+
+    Each bucket holds the min/max/average power, the energy delivered (difference of the
+    ``Energy.Active.Import.Register`` readings), the number of heartbeats and the uptime
+    percentage, i.e. the share of the bucket covered by heartbeats at ``HEARTBEAT_INTERVAL``.
+
+    Once rolled up, the raw rows the buckets are computed from (meter chunks and heartbeats)
+    older than ``ROLLUP_RETENTION['raw']`` days are deleted, and so are rollups older than the
+    retention of their resolution. ``StatusLog`` is not rolled up, so it is never pruned here.
+    Each run also creates the upcoming partitions of the log tables (see
+    ``Commanding.partitions``) and drops the expired heartbeat partitions.
+    """
+
+    def __init__(self, lateness=None, retention=None):
+        self.lateness = timedelta(seconds=lateness if lateness is not None else getattr(settings, "ROLLUP_LATENESS", 120))
+        self.retention = retention or getattr(settings, "ROLLUP_RETENTION", {})
+        self.heartbeat_interval = getattr(settings, "HEARTBEAT_INTERVAL", 10)
+
+    def run(self, now=None):
+        """
+        Bring every resolution up to date and prune expired data.
+
+        Returns:
+            dict: Number of buckets written per resolution.
+        """
+        now = now or timezone.now()
+        create_upcoming_partitions(now)
+        horizon = now - self.lateness
+        written = {}
+        watermarks = {}
+        for resolution, (size, source, step) in RESOLUTIONS.items():
+            position = self.get_watermark(resolution, size, source)
+            end = floor_time(horizon if source is None else watermarks[source], size)
+            written[resolution] = 0
+            while position is not None and position < end:
+                window_end = min(end, position + timedelta(seconds=step))
+                rows = self.rollup_raw(position, window_end) if source is None else \
+                    self.rollup_children(resolution, size, source, position, window_end)
+                with transaction.atomic():
+                    self.save(resolution, rows)
+                    advanced = self.advance_watermark(resolution, position, window_end)
+                written[resolution] += len(rows)
+                if advanced:
+                    position = window_end
+                else:
+                    # Rewound for late samples while the window was computed
+                    position = self.get_watermark(resolution, size, source)
+            watermarks[resolution] = position or end
+            logger.info(f"Rolled up {written[resolution]} {resolution} buckets up to {watermarks[resolution]}")
+
+        self.prune(now, watermarks['1m'])
+        return written
+
+    def advance_watermark(self, resolution, position, end):
+        """
+        Move the watermark of ``resolution`` from ``position`` to ``end``.
+
+        Returns:
+            bool: False if the watermark was no longer at ``position``.
+        """
+        if RollupWatermark.objects.filter(resolution=resolution, position=position).update(position=end):
+            return True
+        _, created = RollupWatermark.objects.get_or_create(resolution=resolution, defaults={'position': end})
+        return created
+
+    def get_watermark(self, resolution, size, source):
+        watermark = RollupWatermark.objects.filter(resolution=resolution).first()
+        if watermark is not None:
+            return watermark.position
+
+        # First run: start at the oldest data we have to roll up from
+        if source is not None:
+            oldest = [ChargerRollup.objects.filter(resolution=source).aggregate(oldest=Min('bucket'))['oldest']]
+        else:
+            oldest = [
+                HeartbeatLog.objects.aggregate(oldest=Min('received_at'))['oldest'],
+                MeterValueChunk.objects.aggregate(oldest=Min('hour'))['oldest'],
+            ]
+        oldest = [timestamp for timestamp in oldest if timestamp is not None]
+        if not oldest:
+            return None
+        return floor_time(min(oldest), size)
+
+    def rollup_raw(self, start, end):
+        """Compute the 1-minute buckets of ``[start, end)`` from the raw meter samples and heartbeats."""
+        size = RESOLUTIONS['1m'][0]
+        rows = {}
+        start_s, end_s = start.timestamp(), end.timestamp()
+
+        chunks = MeterValueChunk.objects.filter(
+            hour__gte=truncate_to_hour(start), hour__lt=end
+        ).order_by('charger_id', 'hour')
+        for chunk in chunks.iterator():
+            samples = chunk.samples()
+            times = chunk.hour.timestamp() + samples['offset'] / 1000.0
+            mask = (times >= start_s) & (times < end_s)
+            if not mask.any():
+                continue
+            samples = samples[mask]
+            buckets = (times[mask] // size).astype(np.int64) * size
+
+            # Samples are sorted by time, so every bucket is a contiguous run starting at these indices
+            starts = np.concatenate([[0], np.flatnonzero(np.diff(buckets)) + 1])
+            power = samples['power'].astype(np.float64)
+            valid = ~np.isnan(power)
+            counts = np.add.reduceat(valid.astype(np.int64), starts)
+            sums = np.add.reduceat(np.where(valid, power, 0.0), starts)
+            power_min = np.fmin.reduceat(power, starts)
+            power_max = np.fmax.reduceat(power, starts)
+            # The energy register only grows, so its first and last reading are its min and max
+            energy_first = np.fmin.reduceat(samples['energy'], starts)
+            energy_last = np.fmax.reduceat(samples['energy'], starts)
+
+            for i, bucket in enumerate(buckets[starts]):
+                rows[(chunk.charger_id, int(bucket))] = self.new_row(
+                    samples=int(counts[i]),
+                    power_min=float(power_min[i]) if counts[i] else None,
+                    power_max=float(power_max[i]) if counts[i] else None,
+                    power_avg=float(sums[i] / counts[i]) if counts[i] else None,
+                    energy_first=None if np.isnan(energy_first[i]) else float(energy_first[i]),
+                    energy_end=None if np.isnan(energy_last[i]) else float(energy_last[i]),
+                )
+
+        heartbeats = HeartbeatLog.objects.filter(
+            received_at__gte=start, received_at__lt=end
+        ).annotate(minute=TruncMinute('received_at')).values('charger_id', 'minute').annotate(count=Count('id'))
+        for group in heartbeats:
+            key = (group['charger_id'], int(group['minute'].timestamp()))
+            rows.setdefault(key, self.new_row())['heartbeats'] = group['count']
+
+        self.compute_energy_deltas(rows, start)
+        for row in rows.values():
+            row.pop('energy_first')
+            row['uptime'] = self.uptime(row['heartbeats'], size)
+        return rows
+
+    def compute_energy_deltas(self, rows, start):
+        """
+        Set the energy delivered in each 1-minute bucket: its last register reading minus the last
+        reading before it, which may be in an earlier window.
+        """
+        charger_ids = {charger_id for charger_id, _ in rows}
+        previous = ChargerRollup.objects.filter(
+            charger=OuterRef('pk'), resolution='1m', bucket__lt=start, energy_end__isnull=False
+        ).order_by('-bucket').values('energy_end')[:1]
+        last_reading = dict(
+            EVCharger.objects.filter(id__in=charger_ids).annotate(
+                energy_end=Subquery(previous)
+            ).values_list('id', 'energy_end')
+        )
+
+        for charger_id, bucket in sorted(rows):
+            row = rows[(charger_id, bucket)]
+            if row['energy_end'] is None:
+                continue
+            before = last_reading.get(charger_id)
+            if before is None or row['energy_end'] < before:
+                # No earlier reading, or the register was reset: only count this bucket's own readings
+                before = row['energy_first']
+            row['energy_delta'] = row['energy_end'] - before
+            last_reading[charger_id] = row['energy_end']
+
+    def rollup_children(self, resolution, size, source, start, end):
+        """Compute the ``resolution`` buckets of ``[start, end)`` from the ``source`` buckets."""
+        rows = {}
+        children = ChargerRollup.objects.filter(
+            resolution=source, bucket__gte=start, bucket__lt=end
+        ).order_by('charger_id', 'bucket').values_list('charger_id', 'bucket', *ROLLUP_FIELDS)
+        for charger_id, bucket, *values in children.iterator():
+            child = dict(zip(ROLLUP_FIELDS, values))
+            key = (charger_id, int(bucket.timestamp()) // size * size)
+            row = rows.setdefault(key, self.new_row())
+            if child['samples']:
+                row['power_avg'] = (
+                    (row['power_avg'] or 0) * row['samples'] + child['power_avg'] * child['samples']
+                ) / (row['samples'] + child['samples'])
+                row['samples'] += child['samples']
+                row['power_min'] = _min(row['power_min'], child['power_min'])
+                row['power_max'] = _max(row['power_max'], child['power_max'])
+            if child['energy_delta'] is not None:
+                row['energy_delta'] = (row['energy_delta'] or 0) + child['energy_delta']
+            if child['energy_end'] is not None:
+                row['energy_end'] = child['energy_end']
+            row['heartbeats'] += child['heartbeats']
+
+        for row in rows.values():
+            row.pop('energy_first')
+            row['uptime'] = self.uptime(row['heartbeats'], size)
+        return rows
+
+    @staticmethod
+    def new_row(**values):
+        row = {
+            'samples': 0, 'power_min': None, 'power_max': None, 'power_avg': None, 'energy_first': None,
+            'energy_delta': None, 'energy_end': None, 'heartbeats': 0,
+        }
+        row.update(values)
+        return row
+
+    def uptime(self, heartbeats, size):
+        return min(100.0, 100.0 * heartbeats * self.heartbeat_interval / size)
+
+    def save(self, resolution, rows):
+        ChargerRollup.objects.bulk_create(
+            [
+                ChargerRollup(
+                    charger_id=charger_id,
+                    resolution=resolution,
+                    bucket=datetime.fromtimestamp(bucket, tz=dt_timezone.utc),
+                    **row,
+                )
+                for (charger_id, bucket), row in rows.items()
+            ],
+            batch_size=1000,
+            update_conflicts=True,
+            unique_fields=['charger', 'resolution', 'bucket'],
+            update_fields=ROLLUP_FIELDS,
+        )
+
+    def prune(self, now, rolled_up_to):
+        """
+        Delete the raw rows the rollups are computed from that are both rolled up and older than
+        the raw retention, and rollups older than the retention of their resolution. Retentions are
+        in days; None keeps data forever.
+        """
+        raw_days = self.retention.get('raw')
+        if raw_days is not None and rolled_up_to is not None:
+            cutoff = min(rolled_up_to, now - timedelta(days=raw_days))
+            heartbeats, = [partitions for partitions in log_partitions() if partitions.model is HeartbeatLog]
+            deleted = {
+                # Whole partitions before the cutoff are dropped, only the rest is deleted row by row
+                'HeartbeatLog': heartbeats.prune(cutoff),
+                # A chunk can only go once its whole hour is before the cutoff
+                'MeterValueChunk': MeterValueChunk.objects.filter(hour__lt=cutoff - timedelta(hours=1)).delete()[0],
+            }
+            logger.info(f"Pruned raw history before {cutoff}: {deleted}")
+
+        for resolution in RESOLUTIONS:
+            days = self.retention.get(resolution)
+            if days is not None:
+                ChargerRollup.objects.filter(
+                    resolution=resolution, bucket__lt=now - timedelta(days=days)
+                ).delete()
@@ -1,7 +1,13 @@
 from django.urls import re_path
-from . import consumers
+from . import consumers, loadbalancer
 
 websocket_urlpatterns = [
+    re_path(r'ws/charging/subscribe/?$', consumers.SubscriptionConsumer.as_asgi()),
     re_path(r'ws/charging/station/(?P<station_code>[-\w]+)/(?P<serial_number>[-\w]+)/?$', consumers.MonitoringConsumer.as_asgi()),
     re_path(r'ws/charging/station/(?P<station_code>[-\w]+)/(?P<serial_number>[-\w]+)/charge/?$', consumers.CommandingConsumer.as_asgi()),
-]
\ No newline at end of file
+]
+
+# Channels served by `manage.py runworker <channel>` instead of by websockets
+channel_routes = {
+    'load-balancer': loadbalancer.LoadBalancerConsumer.as_asgi(),
+}
@@ -0,0 +1,160 @@
+import asyncio
+import logging
+from channels.db import database_sync_to_async
+from django.conf import settings
+from Commanding.models import IdSequence, Transaction
+
+logger = logging.getLogger(__name__)
+
+class TransactionIdAllocator:
+    """
+    Hands out OCPP transaction ids from blocks reserved in the database.
+
+    A worker reserves ``block_size`` consecutive ids (``TRANSACTION_ID_BLOCK_SIZE``) at once by
+    advancing the ``transaction`` :class:`IdSequence` row under a row lock, then allocates from
+    that block in memory. Only one allocation in ``block_size`` waits for the database, and ids
+    stay unique across workers; whatever is left of a block when the worker stops is skipped.
+    """
+
+    def __init__(self, block_size=None, name='transaction'):
+        self.block_size = block_size or getattr(settings, "TRANSACTION_ID_BLOCK_SIZE", 1000)
+        self.name = name
+        self._next = self._end = 0
+        self._lock = asyncio.Lock()
+        self._loop = None
+
+    async def allocate(self):
+        if self._next >= self._end:
+            async with self._lock:
+                # Another allocation may have reserved a block while this one waited
+                if self._next >= self._end:
+                    self._next, self._end = await database_sync_to_async(IdSequence.objects.reserve)(
+                        self.name, self.block_size
+                    )
+                    logger.debug("Reserved transaction ids %d to %d", self._next, self._end - 1)
+        value = self._next
+        self._next += 1
+        return value
+
+_allocator = None
+
+def get_transaction_id_allocator():
+    """
+    Return the transaction id allocator of the running event loop, creating it on first use.
+    """
+    global _allocator
+    loop = asyncio.get_running_loop()
+    if _allocator is None or _allocator._loop is not loop:
+        _allocator = TransactionIdAllocator()
+        _allocator._loop = loop
+    return _allocator
+
+class ChargingSession:
+    """
+    A charging session open on a connector, as tracked in memory.
+    """
+    __slots__ = ('transaction_id', 'connector_id', 'id_tag', 'meter_start')
+
+    def __init__(self, transaction_id, connector_id, id_tag, meter_start):
+        self.transaction_id = transaction_id
+        self.connector_id = connector_id
+        self.id_tag = id_tag
+        self.meter_start = meter_start
+
+    def __repr__(self):
+        return f"<ChargingSession {self.transaction_id} on connector {self.connector_id}>"
+
+def create_transaction(session, charger_id, customer, started_at):
+    Transaction.objects.create(
+        transaction_id=session.transaction_id,
+        charger_id=charger_id,
+        customer=customer,
+        command='StartTransaction',
+        connector_id=session.connector_id,
+        id_tag=session.id_tag,
+        meter_start=session.meter_start,
+        started_at=started_at,
+    )
+
+def finish_transaction(transaction_id, meter_stop, stopped_at, reason=None):
+    """
+    Record the end of a session and compute its energy and amount.
+
+    Saved with ``save()`` rather than ``update()`` so that the invoice totals follow (see
+    ``Invoicing.signals``). A session that already stopped is left as it is.
+
+    Returns:
+        Transaction: The session, or None if no session has this transaction id.
+    """
+    session = Transaction.objects.filter(transaction_id=transaction_id).first()
+    if session is None or session.stopped_at is not None:
+        return session
+    session.command = 'StopTransaction'
+    session.meter_stop = meter_stop
+    session.stopped_at = stopped_at
+    session.stop_reason = reason
+    session.energy = max(meter_stop - (session.meter_start or 0), 0) / 1000
+    session.amount = round(session.energy * getattr(settings, "ENERGY_PRICE_PER_KWH", 0.25), 2)
+    session.save(update_fields=['command', 'meter_stop', 'stopped_at', 'stop_reason', 'energy', 'amount'])
+    return session
+
+class ConnectorSessions:
+    """
+    The charging sessions of one charge point, with a state machine per connector.
+
+    A connector is either idle or charging. ``StartTransaction`` on an idle connector allocates a
+    transaction id and opens a session. Repeated for the session that is already open (the
+    charger retrying after a lost response) it returns that session again; with another id tag
+    or meter reading, the open session is first stopped at the new meter reading, since the
+    register only counts up. ``StopTransaction`` stops the session of its transaction id and
+    leaves the connector idle.
+
+    Sessions are persisted as :class:`Transaction` rows when they start, if the customer is
+    known, with the start time the charger reported, and completed with the meter stop, energy and amount when they stop. Stopping reads
+    the row, so a session started before a restart or on another worker stops normally.
+
+    Args:
+        charger_id (int): Primary key of the charger, or None for an unknown charger.
+        allocator (TransactionIdAllocator): Where transaction ids come from.
+    """
+
+    def __init__(self, charger_id, allocator):
+        self.charger_id = charger_id
+        self.allocator = allocator
+        self.active = {}
+
+    async def start(self, connector_id, id_tag, meter_start, started_at, customer=None):
+        """
+        Returns:
+            ChargingSession: The session open on the connector.
+        """
+        current = self.active.get(connector_id)
+        if current is not None:
+            if current.id_tag == id_tag and current.meter_start == meter_start:
+                return current
+            logger.warning(
+                "Connector %s started a session while transaction %s was open, stopping it",
+                connector_id, current.transaction_id
+            )
+            await self.stop(current.transaction_id, meter_start, started_at, reason='Other')
+
+        session = ChargingSession(await self.allocator.allocate(), connector_id, id_tag, meter_start)
+        self.active[connector_id] = session
+        if self.charger_id is not None and customer is not None:
+            await database_sync_to_async(create_transaction)(session, self.charger_id, customer, started_at)
+        else:
+            logger.error("Transaction %s is not recorded: unknown charger or customer", session.transaction_id)
+        return session
+
+    async def stop(self, transaction_id, meter_stop, stopped_at, reason=None):
+        """
+        Returns:
+            Transaction: The stopped session, or None if it was never recorded.
+        """
+        for connector_id, session in list(self.active.items()):
+            if session.transaction_id == transaction_id:
+                del self.active[connector_id]
+        stopped = await database_sync_to_async(finish_transaction)(transaction_id, meter_stop, stopped_at, reason)
+        if stopped is None:
+            logger.warning("StopTransaction for unknown transaction %s", transaction_id)
+        return stopped
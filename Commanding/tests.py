@@ -1,3 +1,1127 @@
-from django.test import TestCase
+from datetime import datetime, timedelta, timezone
+import asyncio
+import io
+import json
+import logging
+import numpy as np
+import time
+from asgiref.sync import async_to_sync, sync_to_async
+from channels.testing import WebsocketCommunicator
+from channels.exceptions import ChannelFull
+from channels.layers import InMemoryChannelLayer, get_channel_layer
+from channels.routing import URLRouter
+from ocpp import messages as ocpp_messages
+from ocpp.exceptions import NotSupportedError, ProtocolError, PropertyConstraintViolationError
+from ocpp.messages import Call, CallResult
+from ocpp.v16 import call_result
+from rest_framework_simplejwt.tokens import AccessToken
+from django.test import SimpleTestCase, TestCase, override_settings
+from EVChargingSystem.testing import create_organization, create_station
+from Charging.models import EVCharger
+from Charging.registry import charger_registry
+from Users.auth import JWTAuthMiddleware
+from Users.models import User, Customer
+from .liveness import LivenessMonitor, TimerWheel, get_liveness_monitor, mark_unavailable, UNAVAILABLE
+from .loadbalancer import allocate, LoadBalancer, LoadReporter
+from .logs import QueueLogHandler, SamplingFilter
+from .metrics import MetricsRegistry
+from .broadcast import StatusBroadcaster
+from .codec import get_codec
+from .commands import CommandRunner
+from .consumers import ChargePoint, SubscriptionConsumer, parse_frame, parse_meter_values
+from .presence import ChargerPresence
+from .routing import websocket_urlpatterns
+from .models import (
+    StatusInterval, StatusLog, HeartbeatLog, MeterValueChunk, IdSequence, Transaction, CommandJob,
+    ChargerRollup, RollupWatermark,
+)
+from .persistence import LogWriter, MeterValueWriter
+from .rollups import RollupEngine, rewind_watermarks
+from .sessions import ConnectorSessions, TransactionIdAllocator
 
-# Create your tests here.
+class LogWriterTests(TestCase):
+
+    def setUp(self):
+        EVCharger.objects.create(station=create_station(), serial_number="CHG")
+
+    async def test_backlog_is_written_without_waiting(self):
+        writer = LogWriter(batch_size=10, flush_interval=30)
+        for _ in range(35):
+            await writer.put(HeartbeatLog, "CHG", payload={})
+        await asyncio.sleep(0.5)
+        # Full batches are written back to back, the last 5 rows wait for the flush interval
+        self.assertEqual((writer.rows_written, writer.depth), (30, 5))
+        await writer.close()
+        self.assertEqual(await HeartbeatLog.objects.acount(), 35)
+
+    async def test_failed_row_is_dropped_alone(self):
+        writer = LogWriter(batch_size=100, retries=0)
+        for i in range(9):
+            await writer.put(StatusLog, "CHG", status="Available")
+        await writer.put(StatusLog, "CHG", status=None)
+        await writer.flush()
+        self.assertEqual((writer.rows_written, writer.rows_dropped), (9, 1))
+        self.assertEqual(await StatusLog.objects.acount(), 9)
+
+    async def test_unknown_charger(self):
+        writer = LogWriter(batch_size=100)
+        await writer.put(HeartbeatLog, "CHG", payload={})
+        await writer.put(HeartbeatLog, "NONE", payload={})
+        await writer.flush()
+        self.assertEqual((writer.rows_written, writer.rows_unknown), (1, 1))
+
+    async def test_unknown_charger_counted_once(self):
+        writer = LogWriter(batch_size=100, retries=1)
+        writer.retry_delay = 0
+        await writer.put(StatusLog, "CHG", status=None)
+        await writer.put(StatusLog, "NONE", status="Available")
+        await writer.flush()
+        # The batch is tried twice, then split, but the unknown row is dropped once
+        self.assertEqual((writer.rows_written, writer.rows_dropped, writer.rows_unknown), (0, 1, 1))
+
+class RecordingConnection:
+    """Stands in for the websocket consumer and keeps the decoded frames the charge point sends."""
+
+    def __init__(self):
+        self.sent = []
+
+    async def send(self, message):
+        self.sent.append(json.loads(message))
+
+class DispatchTests(SimpleTestCase):
+
+    def test_missing_codec_warns_once(self):
+        with self.assertLogs('Commanding.codec', logging.WARNING) as logs:
+            for _ in range(3):
+                self.assertEqual(get_codec('yaml'), get_codec('json'))
+        self.assertEqual(len(logs.records), 1)
+
+    def test_parse_frame(self):
+        call = parse_frame([2, "1", "Heartbeat", {}])
+        self.assertIsInstance(call, Call)
+        self.assertEqual((call.unique_id, call.action), ("1", "Heartbeat"))
+        self.assertIsInstance(parse_frame([3, "1", {}]), CallResult)
+        with self.assertRaises(ProtocolError):
+            parse_frame([])
+        with self.assertRaises(ProtocolError):
+            parse_frame([2, "1"])
+        with self.assertRaises(PropertyConstraintViolationError):
+            parse_frame([7, "1", "Heartbeat", {}])
+
+    def dispatch(self, frame, inline_validation=True):
+        connection = RecordingConnection()
+        charge_point = ChargePoint("CHG", connection, inline_validation=inline_validation)
+        async_to_sync(charge_point.dispatch)(frame)
+        return charge_point, connection.sent
+
+    def test_call(self):
+        _, sent = self.dispatch([2, "1", "Heartbeat", {}])
+        self.assertEqual(len(sent), 1)
+        self.assertEqual(sent[0][:2], [3, "1"])
+        self.assertIn('currentTime', sent[0][2])
+
+    def test_invalid_payload(self):
+        for inline_validation in (True, False):
+            _, sent = self.dispatch([2, "1", "BootNotification", {'chargePointVendor': "ACME"}], inline_validation)
+            self.assertEqual(sent[0][:3], [4, "1", "ProtocolError"])
+        # Validating inline is a setting of the charge point, not of the ocpp module
+        self.assertTrue(ocpp_messages.ASYNC_VALIDATION)
+
+    def test_unparseable_frame(self):
+        _, sent = self.dispatch({'not': 'a frame'})
+        self.assertEqual(sent, [])
+
+    def test_call_result_is_queued(self):
+        charge_point, sent = self.dispatch([3, "1", {'status': 'Accepted'}])
+        self.assertEqual(sent, [])
+        self.assertEqual(charge_point._response_queue.get_nowait().payload, {'status': 'Accepted'})
+
+class FailingLayer(InMemoryChannelLayer):
+    """An in-memory channel layer whose next ``failures`` group sends raise."""
+
+    def __init__(self, failures=0):
+        super().__init__()
+        self.failures = failures
+
+    async def group_send(self, group, message):
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("channel layer unavailable")
+        await super().group_send(group, message)
+
+class StatusBroadcasterTests(SimpleTestCase):
+
+    async def subscribe(self, layer, group):
+        channel_name = await layer.new_channel()
+        await layer.group_add(group, channel_name)
+        return channel_name
+
+    async def receive_all(self, layer, channel_name):
+        messages = []
+        while True:
+            try:
+                messages.append(await asyncio.wait_for(layer.receive(channel_name), 0.05))
+            except asyncio.TimeoutError:
+                return messages
+
+    async def test_bursts_are_coalesced(self):
+        layer = InMemoryChannelLayer()
+        charger = await self.subscribe(layer, 'ev_charger_CHG0')
+        station = await self.subscribe(layer, 'ev_station_ST')
+        broadcaster = StatusBroadcaster(layer, window=60)
+        broadcaster.seed("CHG0", "Available")
+        broadcaster.seed("CHG1", "Available")
+
+        self.assertTrue(broadcaster.publish("ST", "CHG0", "Preparing"))
+        broadcaster.publish("ST", "CHG0", "Charging")
+        broadcaster.publish("ST", "CHG1", "Preparing")
+        broadcaster.publish("ST", "CHG1", "Available")
+        await broadcaster.flush()
+
+        self.assertEqual([message['status'] for message in await self.receive_all(layer, charger)], ["Charging"])
+        self.assertEqual([message['updates'] for message in await self.receive_all(layer, station)],
+                         [[{'charger_id': "CHG0", 'status': "Charging"}]])
+        self.assertFalse(broadcaster.publish("ST", "CHG0", "Charging"))
+
+    async def test_forget(self):
+        broadcaster = StatusBroadcaster(InMemoryChannelLayer(), window=60)
+        broadcaster.seed("CHG0", "Available")
+        broadcaster.forget("CHG0")
+        broadcaster.publish("ST", "CHG0", "Unavailable")
+        await broadcaster.flush()
+        self.assertEqual(broadcaster._published, {})
+
+    async def test_failed_send_is_retried(self):
+        layer = FailingLayer(failures=1)
+        station = await self.subscribe(layer, 'ev_station_ST')
+        broadcaster = StatusBroadcaster(layer, window=60)
+        broadcaster.seed("CHG0", "Available")
+        broadcaster.publish("ST", "CHG0", "Charging")
+        broadcaster.heartbeat("ST", "CHG0", "2025-01-01T00:00:00+00:00")
+
+        await broadcaster.flush()
+        self.assertEqual(await self.receive_all(layer, station), [])
+        await broadcaster.flush()
+        self.assertEqual([message['type'] for message in await self.receive_all(layer, station)],
+                         ['broadcast_status_batch', 'broadcast_heartbeat_batch'])
+        self.assertEqual(broadcaster._published, {"CHG0": "Charging"})
+        broadcaster._flush_task.cancel()
+
+class MeterValueTests(TestCase):
+
+    def setUp(self):
+        self.charger = EVCharger.objects.create(station=create_station(), serial_number="CHG")
+
+    def test_parse(self):
+        samples = parse_meter_values([
+            {'timestamp': '2025-01-01T10:15:00Z', 'sampledValue': [
+                {'value': '1.5', 'unit': 'kWh'},
+                {'value': '16', 'measurand': 'Current.Import', 'unit': 'A'},
+                {'value': '50', 'measurand': 'Frequency'},
+            ]},
+            # No offset: OCPP timestamps are UTC
+            {'timestamp': '2025-01-01T10:16:00', 'sampledValue': [{'value': '1600'}]},
+            {'timestamp': '2025-01-01T10:17:00Z', 'sampledValue': [{'value': '7', 'measurand': 'Frequency'}]},
+        ])
+        self.assertEqual(samples, [
+            {'timestamp': datetime(2025, 1, 1, 10, 15, tzinfo=timezone.utc), 'energy': 1500.0, 'current': 16.0},
+            {'timestamp': datetime(2025, 1, 1, 10, 16, tzinfo=timezone.utc), 'energy': 1600.0},
+        ])
+        invalid_date, = parse_meter_values([{'timestamp': '2025-13-01T00:00:00Z', 'sampledValue': [{'value': '1'}]}])
+        self.assertTrue(invalid_date['timestamp'].tzinfo)
+
+    def test_append_and_range(self):
+        at = datetime(2025, 1, 1, 10, tzinfo=timezone.utc)
+        MeterValueChunk.objects.append_samples({self.charger.id: [
+            {'timestamp': at.replace(minute=30), 'energy': 300.0},
+            {'timestamp': at.replace(hour=11, minute=5), 'energy': 1100.0},
+        ]})
+        MeterValueChunk.objects.append_samples({self.charger.id: [
+            {'timestamp': at.replace(minute=10), 'energy': 100.0},
+            {'timestamp': datetime(2025, 1, 1, 10, 45), 'energy': 450.0},
+        ]})
+        self.assertEqual(MeterValueChunk.objects.count(), 2)
+        samples = MeterValueChunk.objects.range(self.charger, at, at.replace(hour=11))
+        self.assertEqual(samples['energy'].tolist(), [100.0, 300.0, 450.0])
+        self.assertTrue(np.isnan(samples['power']).all())
+
+    async def test_writer_keeps_batch(self):
+        writer = MeterValueWriter(batch_size=100)
+        for sample in parse_meter_values([
+            {'timestamp': '2025-01-01T10:15:00', 'sampledValue': [{'value': '1'}]},
+            {'timestamp': '2025-01-01T10:16:00Z', 'sampledValue': [{'value': '2'}]},
+        ]):
+            await writer.put(MeterValueChunk, "CHG", **sample)
+        await writer.flush()
+        self.assertEqual((writer.rows_written, writer.rows_dropped), (2, 0))
+
+class RollupEngineTests(TestCase):
+
+    def setUp(self):
+        self.charger = EVCharger.objects.create(station=create_station(), serial_number="CHG")
+        self.at = datetime(2025, 1, 1, 10, tzinfo=timezone.utc)
+        self.engine = RollupEngine(lateness=120, retention={'raw': 7, '1m': 7, '15m': 90, '1h': None, '1d': None})
+
+    def add_samples(self, *samples):
+        MeterValueChunk.objects.append_samples({self.charger.id: [
+            {'timestamp': self.at + timedelta(seconds=seconds), **values} for seconds, values in samples
+        ]})
+
+    def add_heartbeats(self, *seconds):
+        for offset in seconds:
+            HeartbeatLog.objects.create(charger=self.charger, received_at=self.at + timedelta(seconds=offset))
+
+    def minute(self, minutes):
+        return ChargerRollup.objects.get(resolution='1m', bucket=self.at + timedelta(minutes=minutes))
+
+    def test_buckets(self):
+        self.add_samples(
+            (10, {'power': 1000.0, 'energy': 100.0}),
+            (40, {'power': 3000.0, 'energy': 150.0}),
+            (80, {'energy': 200.0}),
+        )
+        self.add_heartbeats(5, 15)
+        self.engine.run(now=self.at + timedelta(minutes=20))
+
+        first = self.minute(0)
+        self.assertEqual((first.samples, first.power_min, first.power_max, first.power_avg), (2, 1000.0, 3000.0, 2000.0))
+        self.assertEqual((first.energy_delta, first.energy_end, first.heartbeats), (50.0, 150.0, 2))
+        self.assertAlmostEqual(first.uptime, 100 * 2 * self.engine.heartbeat_interval / 60)
+        second = self.minute(1)
+        self.assertEqual((second.samples, second.power_avg, second.energy_delta), (0, None, 50.0))
+        quarter = ChargerRollup.objects.get(resolution='15m', bucket=self.at)
+        self.assertEqual((quarter.energy_delta, quarter.heartbeats), (100.0, 2))
+
+    def test_watermark(self):
+        self.add_samples((10, {'energy': 100.0}))
+        now = self.at + timedelta(minutes=10, seconds=30)
+        self.assertEqual(self.engine.run(now=now)['1m'], 1)
+        self.assertEqual(RollupWatermark.objects.get(resolution='1m').position, self.at + timedelta(minutes=8))
+        self.assertEqual(self.engine.run(now=now)['1m'], 0)
+
+    def test_late_samples(self):
+        self.add_samples((10, {'energy': 100.0}))
+        now = self.at + timedelta(minutes=10)
+        self.engine.run(now=now)
+        self.add_samples((5 * 60, {'energy': 180.0}))
+        rewind_watermarks(self.at + timedelta(minutes=5, seconds=10), now=now)
+        self.assertEqual(RollupWatermark.objects.get(resolution='1m').position, self.at + timedelta(minutes=5))
+        self.engine.run(now=now)
+        self.assertEqual(self.minute(5).energy_delta, 80.0)
+
+    def test_rewound_during_run(self):
+        self.add_samples((10, {'energy': 100.0}))
+        self.engine.run(now=self.at + timedelta(minutes=10))
+        engine = self.engine
+        rollup_raw = engine.rollup_raw
+
+        def rollup_raw_with_late_sample(start, end):
+            rows = rollup_raw(start, end)
+            if not self.late:
+                # A writer commits a late sample, and its rewind, while this window is computed
+                self.late = True
+                self.add_samples((5 * 60, {'energy': 180.0}))
+                rewind_watermarks(self.at + timedelta(minutes=5), now=self.at)
+            return rows
+
+        self.late = False
+        engine.rollup_raw = rollup_raw_with_late_sample
+        engine.run(now=self.at + timedelta(minutes=20))
+        self.assertEqual(self.minute(5).energy_delta, 80.0)
+        self.assertEqual(RollupWatermark.objects.get(resolution='1m').position, self.at + timedelta(minutes=18))
+
+    async def test_writer_rewinds_watermarks(self):
+        await RollupWatermark.objects.acreate(resolution='1m', position=self.at + timedelta(minutes=8))
+        writer = MeterValueWriter(batch_size=100)
+        await writer.put(MeterValueChunk, "CHG", timestamp=self.at + timedelta(minutes=5, seconds=10), energy=1.0)
+        with self.settings(ROLLUP_RETENTION={'raw': None}):
+            await writer.flush()
+        watermark = await RollupWatermark.objects.aget(resolution='1m')
+        self.assertEqual(watermark.position, self.at + timedelta(minutes=5))
+
+    def test_prune(self):
+        self.add_samples((10, {'energy': 100.0}))
+        self.add_heartbeats(5)
+        StatusLog.objects.create(charger=self.charger, status="Available", date=self.at)
+        self.engine.run(now=self.at + timedelta(days=10))
+
+        self.assertFalse(MeterValueChunk.objects.exists())
+        self.assertFalse(HeartbeatLog.objects.exists())
+        # Status history is not rolled up, so it is kept
+        self.assertEqual(StatusLog.objects.count(), 1)
+        self.assertFalse(ChargerRollup.objects.filter(resolution='1m').exists())
+        self.assertTrue(ChargerRollup.objects.filter(resolution='15m', bucket=self.at).exists())
+
+    def test_prune_keeps_data_not_rolled_up(self):
+        self.add_samples((10, {'energy': 100.0}))
+        self.engine.prune(self.at + timedelta(days=10), self.at)
+        self.assertTrue(MeterValueChunk.objects.exists())
+
+class MetricsTests(SimpleTestCase):
+
+    def test_render(self):
+        registry = MetricsRegistry()
+        frames = registry.counter('frames_total', 'Frames.', ['action'])
+        frames.inc('Heartbeat')
+        frames.inc('Heartbeat')
+        frames.inc('Say "hi"\n', amount=3)
+        registry.gauge('connected', 'Connected chargers.')
+        registry.gauge('depth', 'Queue depth.', ['writer'], callback=lambda: {('LogWriter',): 1.5})
+        latency = registry.histogram('seconds', 'Latency.', ['stage'], buckets=(0.1, 1.0))
+        latency.observe(0.05, 'total')
+        latency.observe(0.5, 'total')
+        latency.observe(5, 'total')
+
+        self.assertEqual(registry.render(), '\n'.join([
+            '# HELP frames_total Frames.',
+            '# TYPE frames_total counter',
+            'frames_total{action="Heartbeat"} 2',
+            'frames_total{action="Say \\"hi\\"\\n"} 3',
+            '# HELP connected Connected chargers.',
+            '# TYPE connected gauge',
+            'connected 0',
+            '# HELP depth Queue depth.',
+            '# TYPE depth gauge',
+            'depth{writer="LogWriter"} 1.5',
+            '# HELP seconds Latency.',
+            '# TYPE seconds histogram',
+            'seconds_bucket{stage="total",le="0.1"} 1',
+            'seconds_bucket{stage="total",le="1.0"} 2',
+            'seconds_bucket{stage="total",le="+Inf"} 3',
+            'seconds_sum{stage="total"} 5.55',
+            'seconds_count{stage="total"} 3',
+        ]) + '\n')
+
+    def test_disabled(self):
+        registry = MetricsRegistry(enabled=False)
+        frames = registry.counter('frames_total', 'Frames.', ['action'])
+        connected = registry.gauge('connected', 'Connected chargers.')
+        latency = registry.histogram('seconds', 'Latency.', ['stage'])
+        frames.inc('Heartbeat')
+        connected.inc()
+        latency.observe(0.5, 'total')
+        self.assertEqual((dict(frames.values()), dict(connected.values()), latency._values), ({}, {(): 0}, {}))
+
+class QueueLogHandlerTests(SimpleTestCase):
+
+    def setUp(self):
+        self.stream = io.StringIO()
+        self.handler = QueueLogHandler(stream=self.stream, maxsize=2)
+        self.logger = logging.getLogger('Commanding.tests.queue')
+        self.logger.setLevel(logging.INFO)
+        self.logger.propagate = False
+        self.logger.addHandler(self.handler)
+        self.addCleanup(self.logger.removeHandler, self.handler)
+        self.addCleanup(self.handler.close)
+
+    def lines(self):
+        self.handler.close()
+        return [json.loads(line) for line in self.stream.getvalue().splitlines()]
+
+    def test_formats_when_logged(self):
+        statuses = ["Available"]
+        self.logger.info("Statuses %s", statuses, extra={'action': 'StatusNotification'})
+        # The line holds the arguments as they were when the record was logged
+        statuses.append("Charging")
+        try:
+            raise ValueError("boom")
+        except ValueError:
+            self.logger.exception("Failed")
+
+        first, second = self.lines()
+        self.assertEqual((first['message'], first['action']), ("Statuses ['Available']", 'StatusNotification'))
+        self.assertEqual(second['message'], "Failed")
+        self.assertIn("ValueError: boom", second['exception'])
+
+    def test_sampling(self):
+        self.handler.addFilter(SamplingFilter({'Heartbeat': 0.5}))
+        self.logger.info("Received Heartbeat", extra={'action': 'Heartbeat'})
+        self.logger.info("Received Heartbeat", extra={'action': 'Heartbeat'})
+        self.logger.warning("Late Heartbeat", extra={'action': 'Heartbeat'})
+        self.assertEqual([line['message'] for line in self.lines()], ["Received Heartbeat", "Late Heartbeat"])
+
+    def test_full_queue(self):
+        self.handler.close()
+        for _ in range(4):
+            self.logger.info("Handled MeterValues")
+        self.assertEqual(self.handler.dropped, 2)
+
+class TimerWheelTests(SimpleTestCase):
+
+    def test_expiry(self):
+        wheel = TimerWheel(resolution=1.0, slots=8, now=0)
+        wheel.schedule('A', 3)
+        wheel.schedule('B', 5)
+        self.assertEqual(wheel.advance(2), [])
+        self.assertEqual(wheel.advance(3), ['A'])
+        self.assertEqual(wheel.advance(10), ['B'])
+        self.assertEqual(len(wheel), 0)
+
+    def test_reschedule(self):
+        wheel = TimerWheel(resolution=1.0, slots=8, now=0)
+        wheel.schedule('A', 3)
+        wheel.schedule('A', 6)
+        self.assertEqual(wheel.advance(5), [])
+        self.assertEqual(wheel.advance(6), ['A'])
+
+    def test_later_turn(self):
+        # A deadline more than one turn of the wheel away shares a slot with earlier ones
+        wheel = TimerWheel(resolution=1.0, slots=4, now=0)
+        wheel.schedule('A', 2)
+        wheel.schedule('B', 6)
+        self.assertEqual(wheel.advance(2), ['A'])
+        self.assertEqual(wheel.advance(5), [])
+        self.assertEqual(wheel.advance(6), ['B'])
+
+    def test_cancel(self):
+        wheel = TimerWheel(resolution=1.0, slots=8, now=0)
+        wheel.schedule('A', 3)
+        wheel.cancel('A')
+        self.assertEqual(wheel.advance(4), [])
+
+class MarkUnavailableTests(TestCase):
+
+    def test_mark_unavailable(self):
+        station = create_station()
+        for i, status in enumerate(["Available", "Charging", UNAVAILABLE]):
+            EVCharger.objects.create(station=station, serial_number=f"CHG{i}", status=status)
+        at = datetime(2025, 1, 1, tzinfo=timezone.utc)
+        StatusInterval.objects.transition(EVCharger.objects.get(serial_number="CHG0").id, "Available", at)
+
+        changed = mark_unavailable(["CHG0", "CHG1", "CHG2"], at)
+
+        self.assertEqual(changed, {"CHG0": "Available", "CHG1": "Charging"})
+        self.assertEqual(EVCharger.objects.filter(status=UNAVAILABLE).count(), 3)
+        self.assertEqual(StatusInterval.objects.filter(status=UNAVAILABLE, end__isnull=True).count(), 2)
+        self.assertEqual(StatusInterval.objects.filter(status="Available").get().end, at)
+
+class RacingMonitor(LivenessMonitor):
+    """Receives a frame of each charger while it is being marked unavailable."""
+
+    async def mark_unavailable(self, serial_numbers, at):
+        changed = await super().mark_unavailable(serial_numbers, at)
+        for serial_number in serial_numbers:
+            self.seen(serial_number, "ST", "live")
+        return changed
+
+class LivenessMonitorTests(TestCase):
+
+    def setUp(self):
+        EVCharger.objects.create(station=create_station(), serial_number="CHG", status="Charging")
+
+    def status(self):
+        return EVCharger.objects.get().status
+
+    async def test_expire(self):
+        await charger_registry.load("CHG", refresh=True)
+        monitor = LivenessMonitor(InMemoryChannelLayer(), timeout=30)
+        monitor.seen("CHG", "ST", "gone")
+        # Its deadline passed
+        monitor.wheel.cancel("CHG")
+        await monitor.expire(["CHG"])
+        self.assertEqual(await sync_to_async(self.status)(), UNAVAILABLE)
+        self.assertEqual(charger_registry.get("CHG").offline_status, "Charging")
+        # The frame that brings it back gives it its status back
+        monitor.seen("CHG", "ST", "back")
+        await monitor.returned("CHG", "ST")
+        self.assertEqual(await sync_to_async(self.status)(), "Charging")
+        self.assertIsNone((await charger_registry.load("CHG", refresh=True)).offline_status)
+        monitor._task.cancel()
+
+    async def test_seen_while_expiring(self):
+        monitor = RacingMonitor(InMemoryChannelLayer(), timeout=30)
+        monitor.seen("CHG", "ST", "live")
+        monitor.wheel.cancel("CHG")
+        await monitor.expire(["CHG"])
+        self.assertEqual(await sync_to_async(self.status)(), "Charging")
+        intervals = await sync_to_async(list)(StatusInterval.objects.order_by('start').values_list('status', flat=True))
+        self.assertEqual(intervals[-1], "Charging")
+        monitor._task.cancel()
+
+    async def test_disconnected(self):
+        monitor = LivenessMonitor(InMemoryChannelLayer(), timeout=30)
+        monitor.seen("CHG", "ST", "new")
+        # The websocket this worker had before the charger reconnected closes late
+        await monitor.disconnected("CHG", "old")
+        self.assertIn("CHG", monitor.wheel)
+        await monitor.disconnected("CHG", "new")
+        self.assertNotIn("CHG", monitor.wheel)
+        self.assertEqual(monitor._owners, {})
+        self.assertEqual(await sync_to_async(self.status)(), UNAVAILABLE)
+        monitor._task.cancel()
+
+@override_settings(
+    CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}},
+    STATUS_BROADCAST_WINDOW=0.01,
+)
+class MonitoringConsumerTests(TestCase):
+
+    def setUp(self):
+        EVCharger.objects.create(station=create_station(), serial_number="CHG", status="Available")
+
+    def state(self):
+        """The charger's status and the status of its open interval."""
+        charger = EVCharger.objects.get()
+        interval = StatusInterval.objects.filter(charger=charger, end__isnull=True).first()
+        return charger.status, interval.status if interval else None
+
+    async def connect(self):
+        communicator = WebsocketCommunicator(
+            URLRouter(websocket_urlpatterns), "/ws/charging/station/ST/CHG/", subprotocols=["ocpp1.6"]
+        )
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        # The status and the welcome message
+        await communicator.receive_json_from()
+        await communicator.receive_json_from()
+        return communicator
+
+    async def call(self, communicator, action, payload):
+        """Send a CALL and wait until the consumer is done with it."""
+        await communicator.send_json_to([2, action, action, payload])
+        # Frames are handled one at a time, so once the heartbeat is answered the call was handled
+        await communicator.send_json_to([2, "sync", "Heartbeat", {}])
+        while True:
+            frame = await communicator.receive_json_from()
+            if isinstance(frame, list) and frame[:2] == [3, "sync"]:
+                break
+
+    async def test_status_written_through(self):
+        communicator = await self.connect()
+        charging = {'connectorId': 1, 'errorCode': 'NoError', 'status': 'Charging'}
+        await self.call(communicator, "StatusNotification", charging)
+        # Changed behind the registry's back, as by the liveness monitor of another worker
+        await EVCharger.objects.aupdate(status=UNAVAILABLE)
+        await self.call(communicator, "StatusNotification", charging)
+        self.assertEqual(await sync_to_async(self.state)(), ("Charging", "Charging"))
+        await communicator.disconnect()
+
+    async def test_status_restored_on_reconnect(self):
+        communicator = await self.connect()
+        await self.call(communicator, "StatusNotification", {'connectorId': 1, 'errorCode': 'NoError', 'status': 'Charging'})
+        await communicator.disconnect()
+        self.assertEqual(await sync_to_async(self.state)(), (UNAVAILABLE, UNAVAILABLE))
+
+        # Back after a network blip: an OCPP 1.6 charger sends no StatusNotification for it
+        communicator = WebsocketCommunicator(
+            URLRouter(websocket_urlpatterns), "/ws/charging/station/ST/CHG/", subprotocols=["ocpp1.6"]
+        )
+        await communicator.connect()
+        self.assertEqual(await communicator.receive_json_from(), {'status': 'Charging'})
+        self.assertEqual(await sync_to_async(self.state)(), ("Charging", "Charging"))
+        await communicator.disconnect()
+
+    async def test_status_restored_on_frame(self):
+        communicator = await self.connect()
+        await self.call(communicator, "StatusNotification", {'connectorId': 1, 'errorCode': 'NoError', 'status': 'Charging'})
+        monitor = get_liveness_monitor(get_channel_layer())
+        # Its deadline passed while the socket stayed open
+        monitor.wheel.cancel("CHG")
+        await monitor.expire(["CHG"])
+        self.assertEqual(await sync_to_async(self.state)(), (UNAVAILABLE, UNAVAILABLE))
+        await self.call(communicator, "Heartbeat", {})
+        self.assertEqual(await sync_to_async(self.state)(), ("Charging", "Charging"))
+        await communicator.disconnect()
+
+    async def test_command_reads_status(self):
+        await charger_registry.load("CHG")
+        # Started on another worker, whose registry is the only one that knows
+        await EVCharger.objects.aupdate(status='charging')
+        communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), "/ws/charging/station/ST/CHG/charge/")
+        await communicator.connect()
+        await communicator.send_json_to({'action': 'RemoteStartTransaction', 'payload': {'idTag': 'TAG'}})
+        self.assertEqual(await communicator.receive_json_from(), {'error': 'target charger is busy, cannot start charging.'})
+        await communicator.disconnect()
+
+class ChargingSessionTests(TestCase):
+
+    def setUp(self):
+        station = create_station()
+        self.charger = EVCharger.objects.create(station=station, serial_number="CHG")
+        customer_user = User.objects.create_user("driver", password="driver", type="customer")
+        self.customer = Customer.objects.create(user=customer_user, car_plate="AB123CD")
+        self.at = datetime(2025, 1, 1, tzinfo=timezone.utc)
+
+    def test_allocator_reserves_blocks(self):
+        async def allocate():
+            allocator = TransactionIdAllocator(block_size=10)
+            return [await allocator.allocate() for _ in range(25)]
+
+        first, second = async_to_sync(allocate)(), async_to_sync(allocate)()
+        self.assertEqual(first, list(range(1, 26)))
+        # The second worker starts after the blocks the first one reserved
+        self.assertEqual(second, list(range(31, 56)))
+        self.assertEqual(IdSequence.objects.get(name='transaction').next_value, 61)
+
+    @override_settings(ENERGY_PRICE_PER_KWH=0.5)
+    def test_session(self):
+        async def charge():
+            sessions = ConnectorSessions(self.charger.id, TransactionIdAllocator(block_size=10))
+            started = await sessions.start(1, "TAG", 1000, self.at, self.customer)
+            retried = await sessions.start(1, "TAG", 1000, self.at, self.customer)
+            other = await sessions.start(2, "TAG2", 0, self.at, self.customer)
+            await sessions.stop(started.transaction_id, 13500, self.at, 'Local')
+            return started, retried, other, sessions.active
+
+        started, retried, other, active = async_to_sync(charge)()
+        self.assertIs(retried, started)
+        self.assertNotEqual(other.transaction_id, started.transaction_id)
+        self.assertEqual(list(active), [2])
+        session = Transaction.objects.get(transaction_id=started.transaction_id)
+        self.assertEqual((session.energy, session.amount, session.command), (12.5, 6.25, 'StopTransaction'))
+        # Started when the charger said, not when it was received
+        self.assertEqual(session.started_at, self.at)
+        self.assertEqual(Transaction.objects.get(transaction_id=other.transaction_id).stopped_at, None)
+
+class AllocateTests(SimpleTestCase):
+
+    def test_fair_share(self):
+        np.testing.assert_allclose(allocate([0, 0, 0], [30], [32, 32, 32], [1, 1, 1], 6), [10, 10, 10])
+
+    def test_unused_share_goes_to_others(self):
+        np.testing.assert_allclose(allocate([0, 0, 0], [40], [7, 32, 32], [1, 1, 1], 6), [7, 16.5, 16.5])
+
+    def test_priority_weights(self):
+        # Above the minimum, the charger of weight 2 gets twice the share of the others
+        np.testing.assert_allclose(allocate([0, 0, 0], [38], [32, 32, 32], [1, 2, 1], 6), [11, 16, 11])
+
+    def test_not_enough_for_every_minimum(self):
+        np.testing.assert_allclose(allocate([0, 0, 0], [13], [32, 32, 32], [1, 2, 1], 6), [6 + 1 / 3, 6 + 2 / 3, 0])
+
+    def test_stations_are_independent(self):
+        allocated = allocate([1, 0, 1, 0], [100, 20], [32, 32, 32, 8], [1, 1, 1, 1], 6)
+        np.testing.assert_allclose(allocated, [10, 32, 10, 8])
+
+class FullLayer(InMemoryChannelLayer):
+    """A channel layer whose channels are full until ``full`` is cleared."""
+    full = True
+
+    async def send(self, channel, message):
+        if self.full:
+            raise ChannelFull()
+        await super().send(channel, message)
+
+class LoadReporterTests(SimpleTestCase):
+
+    async def receive_loads(self, layer):
+        message = await asyncio.wait_for(layer.receive('lb'), 1)
+        return sorted(message['loads'])
+
+    async def test_changes_and_refresh(self):
+        layer = InMemoryChannelLayer()
+        reporter = LoadReporter(layer, channel='lb', interval=60, refresh=3600)
+        reporter.report("A", "a", True, 16.0)
+        reporter.report("B", "b", False)
+        reporter._flush_task.cancel()
+        await reporter.flush()
+        self.assertEqual(await self.receive_loads(layer), [["A", "a", True, 16.0], ["B", "b", False, None]])
+
+        reporter._flush_task = None
+        reporter.report("B", "b", False)
+        # Nothing changed, nothing to send
+        self.assertIsNone(reporter._flush_task)
+
+        reporter._refresh_due = 0
+        reporter.report("B", "b", False)
+        reporter._flush_task.cancel()
+        await reporter.flush()
+        self.assertEqual(await self.receive_loads(layer), [["A", "a", True, None], ["B", "b", False, None]])
+        self.assertGreater(reporter._refresh_due, 0)
+
+    async def test_channel_full(self):
+        layer = FullLayer()
+        reporter = LoadReporter(layer, channel='lb', interval=60, refresh=3600)
+        reporter.report("A", "a", True, 16.0)
+        reporter._flush_task.cancel()
+        reporter._flush_task = None
+        await reporter.flush()
+        reporter._flush_task.cancel()
+        layer.full = False
+        await reporter.flush()
+        self.assertEqual(await self.receive_loads(layer), [["A", "a", True, 16.0]])
+
+class LoadBalancerTests(TestCase):
+
+    def setUp(self):
+        station = create_station(max_current=40)
+        other = create_station("OT", station.organization)
+        EVCharger.objects.create(station=station, serial_number="CHG0", capacity=32)
+        EVCharger.objects.create(station=station, serial_number="CHG1", capacity=16)
+        EVCharger.objects.create(station=station, serial_number="CHG2")
+        EVCharger.objects.create(station=other, serial_number="FREE")
+
+    def test_limits(self):
+        balancer = LoadBalancer(InMemoryChannelLayer())
+        balancer.refresh()
+        balancer.update([
+            ["CHG0", "c0", True, None],
+            ["CHG1", "c1", True, None],
+            ["CHG2", "c2", False, None],
+            ["FREE", "c3", True, None],
+        ])
+        self.assertEqual(balancer.compute(), {"CHG0": 24.0, "CHG1": 16.0, "CHG2": 0.0})
+
+    def test_only_changed_limits_are_sent(self):
+        layer = InMemoryChannelLayer()
+        balancer = LoadBalancer(layer)
+        balancer.update([["CHG0", "c0", True, None], ["CHG1", "c1", True, None]])
+
+        self.assertEqual(async_to_sync(balancer.tick)(), 2)
+        message = async_to_sync(layer.receive)("c0")
+        self.assertEqual(message['command'], 'SetChargingProfile')
+        self.assertEqual(message['payload']['csChargingProfiles']['chargingSchedule']['chargingSchedulePeriod'],
+                         [{'startPeriod': 0, 'limit': 24.0}])
+        self.assertEqual(async_to_sync(balancer.tick)(), 0)
+
+        # CHG1 draws well under its 16 A, the 6 A it does not use go to CHG0
+        balancer.update([["CHG1", "c1", True, 8.0]])
+        self.assertEqual(balancer.compute(), {"CHG0": 30.0, "CHG1": 10.0})
+        async_to_sync(balancer.tick)()
+        # Held at its draw plus the headroom, CHG1 keeps its limit
+        balancer.update([["CHG1", "c1", True, 8.0]])
+        self.assertEqual(balancer.compute(), {})
+
+class StubChargePoint:
+    """
+    Answers each call with the next of ``answers``: a call_result, an exception, None to time out
+    or ``'hang'`` to never answer.
+    """
+
+    def __init__(self, answers):
+        self.answers = list(answers)
+        self.unique_ids = []
+        self._response_timeout = 30
+
+    async def call(self, request, suppress=True, unique_id=None):
+        self.unique_ids.append(unique_id)
+        answer = self.answers.pop(0)
+        if answer is None:
+            raise asyncio.TimeoutError
+        if answer == 'hang':
+            await asyncio.sleep(self._response_timeout)
+        if isinstance(answer, Exception):
+            raise answer
+        await asyncio.sleep(0.01)
+        return answer
+
+class CommandRunnerTests(SimpleTestCase):
+
+    def test_retry_after_timeout(self):
+        charge_point = StubChargePoint([None, call_result.Reset(status='Accepted')])
+        result = async_to_sync(CommandRunner(charge_point).run)('Reset', {'type': 'Soft'}, 'abc', timeout=1, retries=1)
+        self.assertEqual(result, {'status': 'completed', 'payload': {'status': 'Accepted'}})
+        self.assertEqual(charge_point.unique_ids, ['abc', 'abc'])
+
+    def test_timeout(self):
+        result = async_to_sync(CommandRunner(StubChargePoint([None, None])).run)('Reset', {'type': 'Soft'}, retries=1)
+        self.assertEqual(result['status'], 'timeout')
+
+    def test_command_timeout(self):
+        # The command's own timeout ends the wait; the charge point's is not touched
+        charge_point = StubChargePoint(['hang', call_result.Reset(status='Accepted')])
+        result = async_to_sync(CommandRunner(charge_point).run)('Reset', {'type': 'Soft'}, timeout=0.05, retries=1)
+        self.assertEqual(result['status'], 'completed')
+        self.assertEqual(charge_point._response_timeout, 30)
+
+    def test_reset_not_retried(self):
+        charge_point = StubChargePoint([None, call_result.Reset(status='Accepted')])
+        result = async_to_sync(CommandRunner(charge_point).run)('Reset', {'type': 'Soft'})
+        self.assertEqual(result['status'], 'timeout')
+        self.assertEqual(len(charge_point.unique_ids), 1)
+
+    def test_retry_opt_in(self):
+        charge_point = StubChargePoint([None, call_result.GetConfiguration(configuration_key=[])])
+        result = async_to_sync(CommandRunner(charge_point).run)('GetConfiguration', {})
+        self.assertEqual(result['status'], 'completed')
+        self.assertEqual(len(charge_point.unique_ids), 2)
+
+    def test_expired(self):
+        async def run():
+            runner = CommandRunner(StubChargePoint([call_result.Reset(status='Accepted')]))
+            # The command waits for the lock past the time its caller stops waiting
+            async with runner._lock:
+                pending = asyncio.ensure_future(runner.run('Reset', {'type': 'Soft'}, expires_at=time.time() + 0.05))
+                await asyncio.sleep(0.1)
+            return runner, await pending
+
+        runner, result = async_to_sync(run)()
+        self.assertEqual(result['status'], 'timeout')
+        self.assertEqual(runner.charge_point.unique_ids, [])
+
+    def test_call_error(self):
+        charge_point = StubChargePoint([NotSupportedError(description="No reset")])
+        result = async_to_sync(CommandRunner(charge_point).run)('Reset', {'type': 'Soft'})
+        self.assertEqual(result['status'], 'error')
+        self.assertEqual(result['error']['code'], 'NotSupported')
+
+    def test_invalid(self):
+        result = async_to_sync(CommandRunner(StubChargePoint([])).run)('Launch', {})
+        self.assertEqual(result['status'], 'invalid')
+
+    def test_in_flight_cap(self):
+        async def run():
+            runner = CommandRunner(StubChargePoint([call_result.Reset(status='Accepted')] * 3), max_in_flight=2)
+            return await asyncio.gather(*(runner.run('Reset', {'type': 'Soft'}) for _ in range(3)))
+
+        self.assertEqual([result['status'] for result in async_to_sync(run)()], ['completed', 'completed', 'busy'])
+
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class SendCommandViewTests(TestCase):
+
+    def setUp(self):
+        station = create_station()
+        EVCharger.objects.create(station=station, serial_number="CHG")
+        EVCharger.objects.create(station=station, serial_number="OFF")
+        other_station = create_station("OT", create_organization("OT", "other"))
+        EVCharger.objects.create(station=other_station, serial_number="OTHER")
+        self.headers = {'Authorization': f'Bearer {AccessToken.for_user(station.organization.user)}'}
+
+    async def test_result(self):
+        layer = get_channel_layer()
+        channel_name = await layer.new_channel()
+        await ChargerPresence(layer).register("CHG", channel_name)
+
+        async def consumer():
+            # Stands in for the charger's consumer: answers the command on its reply channel
+            event = await layer.receive(channel_name)
+            await layer.send(event['reply_to'], {
+                'type': 'command.result', 'command_id': event['command_id'],
+                'status': 'completed', 'payload': {'status': 'Accepted'},
+            })
+            return event
+
+        answered = asyncio.ensure_future(consumer())
+        response = await self.async_client.post(
+            '/commanding/station/ST/command/',
+            {'command': 'Reset', 'target_charger': 'CHG', 'payload': {'type': 'Hard'}},
+            content_type='application/json', headers=self.headers,
+        )
+        event = await answered
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {
+            'command_id': event['command_id'], 'status': 'completed', 'payload': {'status': 'Accepted'},
+        })
+        self.assertEqual((event['command'], event['payload']), ('Reset', {'type': 'Hard'}))
+
+    async def test_not_connected(self):
+        response = await self.async_client.post(
+            '/commanding/station/ST/command/', {'command': 'Reset', 'target_charger': 'OFF'},
+            content_type='application/json', headers=self.headers,
+        )
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.json()['status'], 'not_connected')
+
+    async def test_other_chargers(self):
+        layer = get_channel_layer()
+        await ChargerPresence(layer).register("OTHER", await layer.new_channel())
+        for station_code, serial_number in [('OT', 'OTHER'), ('ST', 'OTHER'), ('OT', 'CHG'), ('ST', 'NONE')]:
+            response = await self.async_client.post(
+                f'/commanding/station/{station_code}/command/',
+                {'command': 'Reset', 'target_charger': serial_number},
+                content_type='application/json', headers=self.headers,
+            )
+            self.assertEqual(response.json(), {'error': 'Charger not found'})
+
+    async def test_unauthenticated(self):
+        response = await self.async_client.post(
+            '/commanding/station/ST/command/', {'command': 'Reset', 'target_charger': 'CHG'},
+            content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 401)
+
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class BulkCommandTests(TestCase):
+
+    def setUp(self):
+        station = create_station()
+        for serial_number in ["CHG0", "CHG1", "CHG2"]:
+            EVCharger.objects.create(station=station, serial_number=serial_number, vendor="ACME")
+        other_station = create_station("OT", create_organization("OT", "other"))
+        EVCharger.objects.create(station=other_station, serial_number="OTHER", vendor="ACME")
+        self.headers = {'Authorization': f'Bearer {AccessToken.for_user(station.organization.user)}'}
+
+    async def connect(self, layer, serial_number, answer):
+        """Register a stand-in consumer for ``serial_number`` that answers every command with ``answer``."""
+        channel_name = await layer.new_channel()
+        await ChargerPresence(layer).register(serial_number, channel_name)
+
+        async def consumer():
+            while True:
+                event = await layer.receive(channel_name)
+                await layer.send(event['reply_to'], {'type': 'command.result', **answer})
+
+        return asyncio.ensure_future(consumer())
+
+    async def test_stream(self):
+        layer = get_channel_layer()
+        consumers = [
+            await self.connect(layer, "CHG0", {'status': 'completed', 'payload': {'status': 'Accepted'}}),
+            await self.connect(layer, "CHG1", {'status': 'completed', 'payload': {'status': 'Rejected'}}),
+            await self.connect(layer, "OTHER", {'status': 'completed', 'payload': {'status': 'Accepted'}}),
+        ]
+        response = await self.async_client.post(
+            '/commanding/commands/bulk/?stream=1',
+            {'command': 'Reset', 'payload': {'type': 'Soft'}, 'targets': {'vendor': 'ACME'}},
+            content_type='application/json', headers=self.headers,
+        )
+        lines = [json.loads(line) async for line in response.streaming_content]
+        for consumer in consumers:
+            consumer.cancel()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((lines[0]['state'], lines[0]['total']), ('running', 3))
+        self.assertEqual(
+            sorted((line['charger'], line['status']) for line in lines[1:-1]),
+            [("CHG0", 'completed'), ("CHG1", 'completed'), ("CHG2", 'not_connected')],
+        )
+        self.assertEqual(lines[-1]['counts'], {'completed': 2, 'not_connected': 1})
+        job = await CommandJob.objects.aget(id=lines[0]['job'])
+        self.assertEqual((job.done, job.state), (3, 'finished'))
+        self.assertEqual(await job.results.filter(status='not_connected').acount(), 1)
+
+        progress = await self.async_client.get(f'/commanding/commands/jobs/{job.id}/', headers=self.headers)
+        self.assertEqual(progress.json()['counts'], {'completed': 2, 'not_connected': 1})
+
+    async def test_background(self):
+        layer = get_channel_layer()
+        consumer = await self.connect(layer, "CHG0", {'status': 'completed', 'payload': {'status': 'Accepted'}})
+        response = await self.async_client.post(
+            '/commanding/commands/bulk/',
+            {'command': 'Reset', 'payload': {'type': 'Soft'}, 'targets': {'vendor': 'ACME'}},
+            content_type='application/json', headers=self.headers,
+        )
+        self.assertEqual((response.status_code, response.json()['state']), (202, 'running'))
+
+        # The rollout goes on after the response, on the server's event loop
+        job = await CommandJob.objects.aget(id=response.json()['job'])
+        while job.finished_at is None:
+            await asyncio.sleep(0.01)
+            await job.arefresh_from_db()
+        consumer.cancel()
+        self.assertEqual(job.counts, {'completed': 1, 'not_connected': 2})
+
+    async def test_permissions(self):
+        body = {'command': 'Reset', 'payload': {'type': 'Soft'}, 'targets': {'vendor': 'ACME'}}
+        response = await self.async_client.post('/commanding/commands/bulk/', body, content_type='application/json')
+        self.assertEqual(response.status_code, 401)
+        customer = await sync_to_async(User.objects.create_user)("driver", password="driver", type="customer")
+        response = await self.async_client.post(
+            '/commanding/commands/bulk/', body, content_type='application/json',
+            headers={'Authorization': f'Bearer {AccessToken.for_user(customer)}'},
+        )
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(await CommandJob.objects.aexists())
+
+    async def test_invalid(self):
+        for body in [
+            {'command': 'Reset', 'payload': {'type': 'Soft'}},
+            {'command': 'Reset', 'payload': {'type': 'Soft'}, 'targets': {'city': 'Rome'}},
+            {'command': 'Reset', 'payload': {'kind': 'Soft'}, 'targets': {'station': 'ST'}},
+            {'command': 'Reset', 'payload': {'type': 'Soft'}, 'targets': {'serial_numbers': 'CHG0'}},
+            {'command': 'Reset', 'payload': {'type': 'Soft'}, 'targets': {'station': ['ST']}},
+        ]:
+            response = await self.async_client.post(
+                '/commanding/commands/bulk/', body, content_type='application/json', headers=self.headers,
+            )
+            self.assertEqual(response.status_code, 400)
+        self.assertFalse(await CommandJob.objects.aexists())
+
+    async def test_orphaned(self):
+        user = await sync_to_async(lambda: EVCharger.objects.get(serial_number="CHG0").station.organization.user)()
+        job = await CommandJob.objects.acreate(command='Reset', created_by=user, total=3, done=1)
+        await CommandJob.objects.filter(id=job.id).aupdate(updated_at=job.updated_at - timedelta(minutes=5))
+        running = await CommandJob.objects.acreate(command='Reset', created_by=user, total=3)
+
+        response = await self.async_client.get(f'/commanding/commands/jobs/{job.id}/', headers=self.headers)
+        self.assertEqual(response.json()['state'], 'interrupted')
+        response = await self.async_client.get(f'/commanding/commands/jobs/{running.id}/', headers=self.headers)
+        self.assertEqual(response.json()['state'], 'running')
+
+@override_settings(
+    CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}},
+    SUBSCRIPTION_FLUSH_WINDOW=0.01,
+)
+class SubscriptionConsumerTests(TestCase):
+
+    def setUp(self):
+        self.organization = organization = create_organization()
+        for station_code in ["ST0", "ST1"]:
+            station = create_station(station_code, organization)
+            EVCharger.objects.create(station=station, serial_number=f"{station_code}-CHG", status="Available")
+        self.token = str(AccessToken.for_user(organization.user))
+
+    async def subscribe(self, message, token=None):
+        communicator = WebsocketCommunicator(
+            JWTAuthMiddleware(SubscriptionConsumer.as_asgi()), f"/ws/charging/subscribe/?token={token or self.token}"
+        )
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        await communicator.send_json_to(message)
+        return communicator, await communicator.receive_json_from()
+
+    async def test_snapshot_and_updates(self):
+        communicator, snapshot = await self.subscribe({'action': 'subscribe', 'organization': 'OP'})
+        self.assertEqual(snapshot['stations'], ["ST0", "ST1"])
+        self.assertEqual(
+            [(charger['charger_id'], charger['status'], charger['last_heartbeat']) for charger in snapshot['chargers']],
+            [("ST0-CHG", "Available", None), ("ST1-CHG", "Available", None)],
+        )
+
+        broadcaster = StatusBroadcaster(get_channel_layer(), window=0)
+        broadcaster.publish("ST0", "ST0-CHG", "Preparing")
+        broadcaster.publish("ST0", "ST0-CHG", "Charging")
+        broadcaster.publish("ST1", "ST1-CHG", "Faulted")
+        broadcaster.heartbeat("ST1", "ST1-CHG", "2026-01-01T00:00:00+00:00")
+        await broadcaster.flush()
+
+        # Both stations and both kinds of updates arrive in one frame, the latest status per charger
+        updates = await communicator.receive_json_from()
+        self.assertEqual(updates['event'], 'updates')
+        self.assertEqual(
+            sorted((update['charger_id'], update['status']) for update in updates['status']),
+            [("ST0-CHG", "Charging"), ("ST1-CHG", "Faulted")],
+        )
+        self.assertEqual(updates['heartbeats'], [
+            {'station_code': "ST1", 'charger_id': "ST1-CHG", 'time': "2026-01-01T00:00:00+00:00"},
+        ])
+
+        await communicator.send_json_to({'action': 'unsubscribe', 'stations': ["ST0"]})
+        self.assertEqual((await communicator.receive_json_from())['stations'], ["ST1"])
+        await communicator.disconnect()
+
+    async def test_station_without_chargers(self):
+        await sync_to_async(create_station)("ST2", self.organization)
+        communicator, snapshot = await self.subscribe({'action': 'subscribe', 'stations': ["ST2"]})
+        self.assertEqual((snapshot['stations'], snapshot['chargers']), (["ST2"], []))
+
+        # A charger added after the snapshot still reaches the socket
+        broadcaster = StatusBroadcaster(get_channel_layer(), window=0)
+        broadcaster.publish("ST2", "ST2-CHG", "Available")
+        await broadcaster.flush()
+        updates = await communicator.receive_json_from()
+        self.assertEqual(updates['status'], [{'station_code': "ST2", 'charger_id': "ST2-CHG", 'status': "Available"}])
+        await communicator.disconnect()
+
+    async def test_other_organization(self):
+        other = await sync_to_async(create_organization)("OT", "other")
+        token = str(AccessToken.for_user(other.user))
+        for message in [{'action': 'subscribe', 'organization': 'OP'}, {'action': 'subscribe', 'stations': ["ST0"]}]:
+            communicator, snapshot = await self.subscribe(message, token)
+            self.assertEqual((snapshot['stations'], snapshot['chargers']), ([], []))
+
+            # Nothing the other organization's chargers do reaches the socket
+            broadcaster = StatusBroadcaster(get_channel_layer(), window=0)
+            broadcaster.publish("ST0", "ST0-CHG", "Charging")
+            await broadcaster.flush()
+            self.assertTrue(await communicator.receive_nothing(0.05))
+            await communicator.disconnect()
+
+    async def test_limits(self):
+        with self.settings(SUBSCRIPTION_MAX_STATIONS=1):
+            communicator, answer = await self.subscribe({'action': 'subscribe', 'stations': ["ST0", "ST1"]})
+        self.assertIn('error', answer)
+        await communicator.disconnect()
+
+        communicator = WebsocketCommunicator(JWTAuthMiddleware(SubscriptionConsumer.as_asgi()), "/ws/charging/subscribe/")
+        connected, code = await communicator.connect()
+        self.assertEqual((connected, code), (False, 4401))
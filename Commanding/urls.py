@@ -0,0 +1,10 @@
+from django.urls import path
+from .views import SendCommandAPIView, BulkCommandView, CommandJobView
+
+app_name = 'commanding'
+
+urlpatterns = [
+    path('station/<str:station_code>/command/', SendCommandAPIView.as_view(), name='send-command'),
+    path('commands/bulk/', BulkCommandView.as_view(), name='bulk-command'),
+    path('commands/jobs/<int:job_id>/', CommandJobView.as_view(), name='command-job'),
+]
@@ -1,11 +1,30 @@
-from rest_framework.views import APIView
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from ocpp.v16 import call
+from ocpp.charge_point import camel_to_snake_case
+from rest_framework import status
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
-from rest_framework import status
-from channels.layers import get_channel_layer
-from asgiref.sync import async_to_sync
+from rest_framework.utils.encoders import JSONEncoder
+from rest_framework.views import APIView
+from EVChargingSystem.pagination import NDJSON_CONTENT_TYPE, wants_stream
+from .commands import RESULT_STATUSES, send_command
+from .fleet import FleetCommand, TARGET_FILTERS, interrupt_orphaned_jobs, resolve_targets
+from .models import CommandJob
+from . import metrics as ocpp_metrics
 
 class SendCommandAPIView(APIView):
+    """
+    Sends an OCPP command to a charger and answers with its result.
+
+    The body is ``{"command": ..., "target_charger": ..., "payload": {...}}``, with an optional
+    ``timeout`` in seconds; the charger must be one of the station's and, for users that are
+    not staff, of their organization, or the answer is 404. The response carries the ``command_id``, the ``status`` of the
+    command and the charger's ``payload`` (or the ``error``), with the HTTP status of
+    ``RESULT_STATUSES``: 504 when the charger did not answer, 429 when it has too many commands
+    pending.
+    """
     permission_classes = [IsAuthenticated]
 
     def post(self, request, station_code):
@@ -14,16 +33,114 @@ class SendCommandAPIView(APIView):
 
         if not command or not target_charger:
             return Response({'error': 'Missing command or target_charger'}, status=status.HTTP_400_BAD_REQUEST)
+        timeout = request.data.get('timeout')
+        if timeout is not None and (not isinstance(timeout, (int, float)) or not 0 < timeout <= 300):
+            return Response({'error': 'timeout must be a number of seconds up to 300'}, status=status.HTTP_400_BAD_REQUEST)
+        if not isinstance(target_charger, str) or not resolve_targets(
+            request.user, {'station': station_code, 'serial_numbers': [target_charger]}
+        ):
+            return Response({'error': 'Charger not found'}, status=status.HTTP_404_NOT_FOUND)
+
+        # Route the command straight to the worker that holds the charger's websocket
+        result = async_to_sync(send_command)(
+            get_channel_layer(), target_charger, command, request.data.get('payload'), timeout=timeout
+        )
+        return Response(result, status=RESULT_STATUSES[result['status']])
+
+async def start_fleet(job, chargers, stream):
+    """
+    Start the rollout of ``job`` to ``chargers`` and, if ``stream``, return its
+    :meth:`FleetCommand.stream`, taken before any result arrives.
+
+    Called through ``async_to_sync`` from a view served under ASGI, this runs on the server's
+    event loop, so the rollout outlives the request that started it.
+    """
+    fleet = FleetCommand(job, chargers, get_channel_layer())
+    fleet.listening = stream
+    items = fleet.stream() if stream else None
+    fleet.start()
+    return items
+
+class BulkCommandView(APIView):
+    """
+    Sends one OCPP command to every charger matching a target, as a :class:`CommandJob`.
 
-        group_name = f'ev_station_{station_code}'
-        channel_layer = get_channel_layer()
+    The body is ``{"command": ..., "payload": {...}, "targets": {...}}``, where ``targets``
+    combines ``station`` (code), ``organization`` (acronym), ``status``, ``model``, ``vendor`` and
+    ``serial_numbers``; users that are not staff only reach their organization's chargers. The
+    command is sent to the chargers with bounded concurrency (see ``Commanding.fleet``).
 
-        async_to_sync(channel_layer.group_send)(
-            group_name,
-            {
-                'type': 'send_command',
-                'command': command,
-                'target_charger': target_charger,
-            }
+    The response is the job, with 202, while the rollout goes on in the background; its progress
+    is read from ``commands/jobs/<id>/``. With ``?stream=1`` the response instead streams, as
+    NDJSON, the job, the result of each charger as it arrives and the finished job.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        user = request.user
+        if not user.is_staff and user.type != 'organization':
+            return Response({'detail': 'Only operators can send commands to their chargers.'},
+                            status=status.HTTP_403_FORBIDDEN)
+
+        command, payload, targets = request.data.get('command'), request.data.get('payload') or {}, request.data.get('targets')
+        if not isinstance(targets, dict) or not targets:
+            return Response({'error': f"targets must select chargers by {', '.join(TARGET_FILTERS)}"},
+                            status=status.HTTP_400_BAD_REQUEST)
+        unknown = set(targets) - set(TARGET_FILTERS)
+        if unknown:
+            return Response({'error': f"Unknown targets: {', '.join(sorted(unknown))}"}, status=status.HTTP_400_BAD_REQUEST)
+        serial_numbers = targets.get('serial_numbers', [])
+        if not isinstance(serial_numbers, list) or not all(isinstance(value, str) for value in serial_numbers):
+            return Response({'error': "serial_numbers must be a list of serial numbers"}, status=status.HTTP_400_BAD_REQUEST)
+        invalid = sorted(key for key, value in targets.items() if key != 'serial_numbers' and not isinstance(value, str))
+        if invalid:
+            return Response({'error': f"Targets must be strings: {', '.join(invalid)}"}, status=status.HTTP_400_BAD_REQUEST)
+        # Reject a bad command once rather than once per charger
+        try:
+            getattr(call, command)(**camel_to_snake_case(payload))
+        except (AttributeError, TypeError) as e:
+            return Response({'error': f"Invalid command {command}: {e}"}, status=status.HTTP_400_BAD_REQUEST)
+
+        chargers = resolve_targets(user, targets)
+        job = CommandJob.objects.create(
+            command=command, payload=payload, targets=targets, created_by=user, total=len(chargers)
         )
-        return Response({'status': 'command sent'}, status=status.HTTP_200_OK)
+        started = job.as_dict()
+        items = async_to_sync(start_fleet)(job, chargers, wants_stream(request))
+        if items is None:
+            return Response(started, status=status.HTTP_202_ACCEPTED)
+
+        encoder = JSONEncoder()
+
+        async def lines():
+            async for item in items:
+                yield encoder.encode(item) + '\n'
+
+        return StreamingHttpResponse(lines(), content_type=NDJSON_CONTENT_TYPE)
+
+class CommandJobView(APIView):
+    """
+    The progress of a :class:`CommandJob` started by the user (or any job, for staff).
+
+    Jobs orphaned by a process that stopped are marked ``interrupted`` first.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, job_id):
+        interrupt_orphaned_jobs()
+        jobs = CommandJob.objects.all() if request.user.is_staff else CommandJob.objects.filter(created_by=request.user)
+        job = jobs.filter(id=job_id).first()
+        if job is None:
+            raise Http404("No such command job")
+        return Response(job.as_dict())
+
+async def metrics(request):
+    """
+    Exposes the OCPP consumer metrics of this process in the Prometheus text format.
+
+    The view is async so that, under ASGI, it reads the metrics on the same event loop that
+    updates them.
+    """
+    if not ocpp_metrics.registry.enabled:
+        raise Http404("Metrics are disabled")
+    return HttpResponse(ocpp_metrics.registry.render(), content_type=ocpp_metrics.CONTENT_TYPE)
@@ -14,15 +14,16 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'EVChargingSystem.settings')
 django.setup()
 
 from django.core.asgi import get_asgi_application
-from channels.routing import ProtocolTypeRouter, URLRouter
-from channels.auth import AuthMiddlewareStack
+from channels.routing import ProtocolTypeRouter, URLRouter, ChannelNameRouter
+from Users.auth import JWTAuthMiddleware
 from Commanding import routing
 
 application = ProtocolTypeRouter({
     "http": get_asgi_application(),
-    "websocket": AuthMiddlewareStack(
+    "websocket": JWTAuthMiddleware(
         URLRouter(
             routing.websocket_urlpatterns
         )
     ),
+    "channel": ChannelNameRouter(routing.channel_routes),
 })
\ No newline at end of file
@@ -0,0 +1,95 @@
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import StreamingHttpResponse
+from rest_framework.pagination import CursorPagination
+from rest_framework.utils.encoders import JSONEncoder
+
+NDJSON_CONTENT_TYPE = 'application/x-ndjson'
+
+class KeysetPagination(CursorPagination):
+    """
+    Cursor pagination on the primary key, used by the station, charger and invoice lists; the
+    other list endpoints keep returning plain lists.
+
+    Each page is fetched with ``WHERE id > <last id of the previous page> ORDER BY id LIMIT n``,
+    which costs the same on the last page as on the first and never counts the table.
+    Clients follow the ``next`` and ``previous`` links; ``page_size`` picks the number of rows
+    per page, up to ``API_MAX_PAGE_SIZE``.
+    """
+    ordering = 'id'
+    page_size = getattr(settings, "API_PAGE_SIZE", 100)
+    page_size_query_param = 'page_size'
+    max_page_size = getattr(settings, "API_MAX_PAGE_SIZE", 1000)
+
+def wants_stream(request):
+    """Return True if the client asked for the whole list as NDJSON with ``?stream=1``."""
+    return request.query_params.get('stream', '').lower() in ('1', 'true')
+
+def stream_queryset(queryset, serializer_class, context=None, chunk_size=None):
+    """
+    Stream every row of ``queryset`` as newline-delimited JSON.
+
+    Rows are read ``chunk_size`` at a time by primary key (``WHERE pk > <last pk> LIMIT n``) and
+    each chunk is serialized and sent before the next one is read, so memory use does not
+    depend on the size of the table. Served by the ASGI handler (the request in ``context`` is
+    an ``ASGIRequest``) the rows come from an async generator that reads each chunk in a
+    thread, since Django would otherwise consume a synchronous iterator whole before sending it.
+    """
+    chunk_size = chunk_size or getattr(settings, "API_STREAM_CHUNK_SIZE", 2000)
+    context = context or {}
+    serializer = serializer_class(context=context)
+    encoder = JSONEncoder()
+    queryset = queryset.order_by('pk')
+
+    def read_chunk(after):
+        """Return the primary key of the last row of the chunk after ``after`` and the chunk as NDJSON."""
+        chunk = list((queryset if after is None else queryset.filter(pk__gt=after))[:chunk_size])
+        if not chunk:
+            return None, ''
+        return chunk[-1].pk, ''.join(encoder.encode(serializer.to_representation(instance)) + '\n' for instance in chunk)
+
+    def rows():
+        last_pk, data = read_chunk(None)
+        while data:
+            yield data
+            last_pk, data = read_chunk(last_pk)
+
+    async def arows():
+        last_pk, data = await sync_to_async(read_chunk)(None)
+        while data:
+            yield data
+            last_pk, data = await sync_to_async(read_chunk)(last_pk)
+
+    request = getattr(context.get('request'), '_request', context.get('request'))
+    content = arows() if isinstance(request, ASGIRequest) else rows()
+    return StreamingHttpResponse(content, content_type=NDJSON_CONTENT_TYPE)
+
+def list_response(request, queryset, serializer_class):
+    """
+    Build the response of a function-based list view: a page of ``queryset``, or the whole of it
+    streamed as NDJSON if the client asked for it.
+    """
+    context = {'request': request}
+    if wants_stream(request):
+        return stream_queryset(queryset, serializer_class, context=context)
+
+    paginator = KeysetPagination()
+    page = paginator.paginate_queryset(queryset, request)
+    serializer = serializer_class(page, many=True, context=context)
+    return paginator.get_paginated_response(serializer.data)
+
+class StreamingListMixin:
+    """
+    Lets the ``list`` action of a generic view or viewset stream its rows as NDJSON on request
+    instead of returning a page.
+    """
+
+    def list(self, request, *args, **kwargs):
+        if wants_stream(request):
+            return stream_queryset(
+                self.filter_queryset(self.get_queryset()),
+                self.get_serializer_class(),
+                context=self.get_serializer_context(),
+            )
+        return super().list(request, *args, **kwargs)
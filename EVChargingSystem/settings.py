@@ -10,6 +10,8 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
+import os
+from importlib.util import find_spec
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -112,12 +114,55 @@ CHANNEL_LAYERS = {
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# PostgreSQL when DB_ENGINE=postgres, configured from the POSTGRES_* variables; SQLite otherwise
+DB_ENGINE = os.environ.get('DB_ENGINE', 'sqlite')
+
+# Threads of asgiref's default executor (read by asgiref from the same variable), plus the thread
+# every database_sync_to_async call of the consumers runs in; each needs its own connection
+ASGI_THREADS = int(os.environ.get('ASGI_THREADS', min(32, (os.cpu_count() or 1) + 4)))
+DB_POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', ASGI_THREADS + 1))
+
+if DB_ENGINE == 'postgres':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('POSTGRES_DB', 'ev_charging'),
+            'USER': os.environ.get('POSTGRES_USER', 'ev_charging'),
+            'PASSWORD': os.environ.get('POSTGRES_PASSWORD', ''),
+            'HOST': os.environ.get('POSTGRES_HOST', 'ev_charging_postgres'),
+            'PORT': os.environ.get('POSTGRES_PORT', '5432'),
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {},
+        }
     }
-}
+    if find_spec('psycopg_pool'):
+        # Connections are returned to the pool when a database_sync_to_async call finishes
+        DATABASES['default']['OPTIONS']['pool'] = {
+            'min_size': int(os.environ.get('DB_POOL_MIN_SIZE', 2)),
+            'max_size': DB_POOL_MAX_SIZE,
+            'timeout': float(os.environ.get('DB_POOL_TIMEOUT', 10)),
+        }
+    else:
+        # Without psycopg_pool, keep each executor thread's connection open between calls
+        DATABASES['default']['CONN_MAX_AGE'] = int(os.environ.get('DB_CONN_MAX_AGE', 600))
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'db.sqlite3',
+            'OPTIONS': {
+                # Writers take the lock up front and wait for it instead of failing with
+                # "database is locked"
+                'init_command': 'PRAGMA synchronous=NORMAL;',
+                'transaction_mode': 'IMMEDIATE',
+                'timeout': 20,
+            },
+        }
+    }
+    if os.environ.get('SQLITE_WAL', '').lower() in ('1', 'true'):
+        # WAL lets readers run while the write-behind queues write. It converts the database
+        # file for good and adds -wal/-shm files next to it, so it is opt-in
+        DATABASES['default']['OPTIONS']['init_command'] = 'PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL;'
 
 
 # Password validation
@@ -161,4 +206,166 @@ STATIC_URL = 'static/'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 CORS_ALLOW_ALL_ORIGINS = True
-HEARTBEAT_INTERVAL = 10
\ No newline at end of file
+HEARTBEAT_INTERVAL = 10
+
+# Write-behind persistence of OCPP log rows (HeartbeatLog, StatusLog)
+OCPP_LOG_BATCH_SIZE = 500  # rows per bulk_create
+OCPP_LOG_FLUSH_INTERVAL = 1.0  # seconds a row may wait before being flushed
+OCPP_LOG_QUEUE_MAXSIZE = 10000  # producers wait once this many rows are queued
+OCPP_LOG_WRITE_RETRIES = 2  # failed batches are written again before being split to find the bad rows
+OCPP_LOG_RETRY_DELAY = 0.5  # seconds before the first retry, doubled for each one after
+
+# Seconds a charger stays registered as connected (in Redis) without a frame refreshing it
+CHARGER_PRESENCE_TTL = 3 * HEARTBEAT_INTERVAL
+
+# Seconds charger status changes are coalesced before being broadcast to subscribers
+STATUS_BROADCAST_WINDOW = 0.5
+
+# OCPP frame handling: JSON codec for websocket frames ('json' or 'orjson') and whether payloads
+# are validated against the OCPP schemas on the event loop instead of in the thread pool
+OCPP_JSON_CODEC = 'json'
+OCPP_INLINE_VALIDATION = True
+
+# Write-behind ingestion of MeterValues samples into hourly MeterValueChunk rows
+METER_VALUES_BATCH_SIZE = 2000
+METER_VALUES_FLUSH_INTERVAL = 5.0
+
+# History rollups (manage.py rollup_history): seconds to wait for late data before a bucket is
+# final, and days to keep raw rows (once rolled up) and each rollup resolution (None = forever)
+ROLLUP_LATENESS = 120
+ROLLUP_RETENTION = {
+    'raw': 7,
+    '1m': 7,
+    '15m': 90,
+    '1h': 730,
+    '1d': None,
+}
+
+# REST list endpoints: rows per cursor page of the station, charger and invoice lists (default
+# and largest a client may ask for with ?page_size=), and rows fetched per database round trip
+# when a list is streamed with ?stream=1
+API_PAGE_SIZE = 100
+API_MAX_PAGE_SIZE = 1000
+API_STREAM_CHUNK_SIZE = 2000
+
+# Per-action/stage timings and counters of the OCPP consumers, exposed on /metrics; when False
+# nothing is recorded and /metrics returns 404
+METRICS_ENABLED = True
+
+# Logging of the OCPP message path: JSON lines written by a background thread, with the share
+# of records kept per high-volume action (warnings and errors are never sampled out)
+OCPP_LOG_SAMPLING = {
+    'Heartbeat': 0.01,
+    'MeterValues': 0.1,
+}
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'json': {
+            '()': 'Commanding.logs.JsonFormatter',
+        },
+    },
+    'filters': {
+        'ocpp_sampling': {
+            '()': 'Commanding.logs.SamplingFilter',
+            'rates': OCPP_LOG_SAMPLING,
+        },
+    },
+    'handlers': {
+        'ocpp_queue': {
+            '()': 'Commanding.logs.QueueLogHandler',
+            'formatter': 'json',
+            'filters': ['ocpp_sampling'],
+        },
+    },
+    'loggers': {
+        'Commanding': {
+            'handlers': ['ocpp_queue'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+        'Charging': {
+            'handlers': ['ocpp_queue'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+    },
+}
+
+# Runs the tests with the loggers above raised to warnings (see EVChargingSystem.testing)
+TEST_RUNNER = 'EVChargingSystem.testing.TestRunner'
+
+# Range partitioning of StatusLog and HeartbeatLog on PostgreSQL: one partition per 'day' or
+# 'month', created this many periods ahead by every rollup_history pass
+LOG_PARTITION_PERIOD = 'day'
+LOG_PARTITIONS_AHEAD = 3
+
+# Longest time range the charger status history endpoint answers for
+STATUS_HISTORY_MAX_DAYS = 31
+
+# Seconds between two checks of the chargers' liveness deadlines (CHARGER_PRESENCE_TTL after
+# their last frame); a silent charger is marked unavailable at most this late
+LIVENESS_TICK = 1.0
+
+# Charging sessions: OCPP transaction ids each worker reserves from the database at a time, and
+# the price a session's energy is billed at when it stops
+TRANSACTION_ID_BLOCK_SIZE = 1000
+ENERGY_PRICE_PER_KWH = 0.25
+
+# Load balancing of the stations that have a max_current: channel of the `runworker` process
+# the websocket workers report charger loads to every LOAD_REPORT_INTERVAL seconds (None turns
+# reporting off), and the balancer's pass interval and current limits, in A. Every
+# LOAD_BALANCING_REFRESH seconds the balancer rereads the station limits and the workers report
+# the state of all their chargers again
+LOAD_BALANCER_CHANNEL = 'load-balancer'
+LOAD_REPORT_INTERVAL = 1.0
+LOAD_BALANCING_INTERVAL = 5.0
+LOAD_BALANCING_REFRESH = 60.0
+LOAD_BALANCING_MIN_CURRENT = 6.0
+LOAD_BALANCING_DEFAULT_CURRENT = 32.0
+LOAD_BALANCING_HEADROOM = 2.0
+LOAD_BALANCING_MIN_CHANGE = 1.0
+
+# Commands sent to chargers: seconds to wait for the answer (per action, COMMAND_TIMEOUT by
+# default), resends when none arrives, for the actions that are safe to repeat only, and
+# commands a charger may have pending at once
+COMMAND_TIMEOUT = 30
+COMMAND_TIMEOUTS = {
+    'UpdateFirmware': 60,
+    'GetDiagnostics': 60,
+}
+COMMAND_RETRIES = 1
+COMMAND_RETRY_ACTIONS = {
+    'ChangeAvailability',
+    'ChangeConfiguration',
+    'ClearChargingProfile',
+    'GetCompositeSchedule',
+    'GetConfiguration',
+    'GetLocalListVersion',
+    'SetChargingProfile',
+    'TriggerMessage',
+}
+COMMAND_MAX_IN_FLIGHT = 20
+
+# Bulk commands: commands of a job in flight at once, results written to the job per batch (at
+# least every BULK_COMMAND_FLUSH_INTERVAL seconds), and seconds after which a running job that
+# was not written is taken as orphaned by a stopped process
+BULK_COMMAND_CONCURRENCY = 500
+BULK_COMMAND_FLUSH_SIZE = 500
+BULK_COMMAND_FLUSH_INTERVAL = 1.0
+BULK_COMMAND_ORPHAN_AFTER = 60
+
+# Dashboard subscriptions (ws/charging/subscribe/): stations one socket may follow, and seconds
+# status and heartbeat updates are merged before being sent as one frame
+SUBSCRIPTION_MAX_STATIONS = 1000
+SUBSCRIPTION_FLUSH_WINDOW = 0.5
+
+# Websocket authentication (Users.auth): users kept with their customer and organization, and
+# for how many seconds, and verified tokens kept until they expire. Changes to a user only evict
+# it from the cache of the process that saved them, so the TTL is how long other workers may
+# still accept a deactivated user
+WEBSOCKET_AUTH_CACHE_SIZE = 10000
+WEBSOCKET_AUTH_CACHE_TTL = 300
+WEBSOCKET_AUTH_TOKEN_CACHE_SIZE = 50000
@@ -0,0 +1,87 @@
+import logging
+from django.conf import settings
+from django.db import connection
+from django.test.runner import DiscoverRunner
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+from Charging.models import Station
+from Users.models import User, Organization
+
+class TestRunner(DiscoverRunner):
+    """
+    The project's test runner: the loggers configured in ``LOGGING`` only record warnings and
+    errors while the tests run.
+    """
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self._log_levels = {}
+        for name in settings.LOGGING.get('loggers', {}):
+            logger = logging.getLogger(name)
+            self._log_levels[name] = logger.level
+            logger.setLevel(logging.WARNING)
+
+    def teardown_test_environment(self, **kwargs):
+        for name, level in self._log_levels.items():
+            logging.getLogger(name).setLevel(level)
+        super().teardown_test_environment(**kwargs)
+
+def create_organization(acronym="OP", username="operator"):
+    """Create an organization and the user it belongs to, whose password is its username."""
+    user = User.objects.create_user(username, password=username, type="organization")
+    return Organization.objects.create(user=user, organization_name=acronym, acronym=acronym)
+
+def create_station(station_code="ST", organization=None, **fields):
+    """Create a station, of a new ``OP`` organization unless ``organization`` is given."""
+    return Station.objects.create(
+        organization=organization or create_organization(),
+        station_code=station_code, name=station_code, location="-", **fields
+    )
+
+class QueryBudgetMixin:
+    """
+    Test case mixin asserting that API list endpoints run a constant number of queries.
+
+    ``assertQueryBudget`` requests the endpoint while the table grows through ``sizes`` rows and
+    fails if the number of queries changes with the number of rows returned (an N+1 on a related
+    field) or exceeds ``budget``.
+    """
+
+    def api_client(self, user=None):
+        if user is None:
+            user = User.objects.create_user("budget-admin", password="budget", type="admin")
+        client = APIClient()
+        client.force_authenticate(user)
+        return client
+
+    def count_queries(self, client, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(url)
+        self.assertEqual(response.status_code, 200, response.content)
+        data = response.json()
+        # Some list endpoints return a cursor page
+        return len(queries.captured_queries), data['results'] if isinstance(data, dict) else data
+
+    def assertQueryBudget(self, url, create_rows, budget, sizes=(1, 5, 20), client=None):
+        """
+        Args:
+            url (str): The list endpoint to request.
+            create_rows (callable): Called with ``(start, stop)``; creates the rows numbered ``start`` to ``stop - 1``.
+            budget (int): Maximum number of queries the endpoint may run.
+            sizes (tuple): Numbers of rows the endpoint is requested with.
+            client (APIClient): Authenticated client, an admin by default.
+        """
+        client = client or self.api_client()
+        counts = {}
+        created = 0
+        for size in sizes:
+            create_rows(created, size)
+            created = size
+            counts[size], data = self.count_queries(client, url)
+            self.assertGreaterEqual(len(data), size, f"{url} returned fewer rows than were created")
+
+        self.assertEqual(
+            len(set(counts.values())), 1,
+            f"{url} runs a number of queries that grows with the result size: {counts}"
+        )
+        self.assertLessEqual(counts[sizes[-1]], budget, f"{url} exceeds its budget of {budget} queries: {counts}")
@@ -16,10 +16,13 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import path, include
+from Commanding.views import metrics
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('', include('Users.urls')),
     path('charging/', include('Charging.urls')),
     path('invoices/', include('Invoicing.urls')),
+    path('commanding/', include('Commanding.urls')),
+    path('metrics', metrics, name='metrics'),
 ]
\ No newline at end of file
@@ -0,0 +1,138 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timezone as dt_timezone
+from django.db import connection, transaction
+from django.db.models import Max, Min, Q, Sum
+from Users.models import Customer, PaymentMethod
+from .models import Invoice
+
+logger = logging.getLogger(__name__)
+
+def month_bounds(year, month):
+    """Return the first day of the month and the start and end of the month as UTC datetimes."""
+    first_day = date(year, month, 1)
+    next_month = date(year + month // 12, month % 12 + 1, 1)
+    start = datetime(first_day.year, first_day.month, 1, tzinfo=dt_timezone.utc)
+    end = datetime(next_month.year, next_month.month, 1, tzinfo=dt_timezone.utc)
+    return first_day, start, end
+
+class InvoiceRun:
+    """
+    Generates the invoices of one month with a handful of set-based queries.
+
+    Every customer gets an invoice, with a total of 0 if they did not charge that month. The
+    totals are computed by a single grouped ``Sum`` of the month's transactions per customer.
+    Users who already have an invoice for the month are excluded in that same query (an anti-join
+    on ``Invoice``), so a run that was interrupted can simply be started again: it only creates
+    the invoices that are still missing. Invoices are inserted with ``bulk_create`` in chunks of
+    ``batch_size``, and the unique (user, date) constraint makes concurrent runs harmless; the
+    invoices a concurrent run inserted first are not counted as created.
+
+    With ``workers`` > 1 the user id range is split into that many shards that are invoiced in
+    parallel threads, each on its own database connection. SQLite only allows one writer at a
+    time, so there the shards are invoiced one after the other.
+    """
+
+    def __init__(self, year, month, batch_size=1000, workers=1):
+        self.year = year
+        self.month = month
+        self.batch_size = batch_size
+        self.workers = workers
+        self.first_day, self.start, self.end = month_bounds(year, month)
+
+    def pending_totals(self, user_id_range=None):
+        """Monthly totals of the customers that have no invoice for the month yet, ordered by user id."""
+        invoiced = Invoice.objects.filter(
+            date__gte=self.first_day, date__lt=self.end.date()
+        ).values('user_id')
+        customers = Customer.objects.exclude(user_id__in=invoiced)
+        if user_id_range is not None:
+            low, high = user_id_range
+            customers = customers.filter(user_id__gte=low, user_id__lt=high)
+        return customers.values('id', 'user_id').annotate(
+            total=Sum('customer_transaction__amount', filter=Q(
+                customer_transaction__started_at__gte=self.start, customer_transaction__started_at__lt=self.end,
+            ))
+        ).order_by('user_id')
+
+    def shards(self):
+        bounds = Customer.objects.aggregate(low=Min('user_id'), high=Max('user_id'))
+        if bounds['low'] is None:
+            return []
+        low, high = bounds['low'], bounds['high'] + 1
+        size = max(1, -(-(high - low) // self.workers))
+        return [(start, min(start + size, high)) for start in range(low, high, size)]
+
+    def run(self):
+        """
+        Create the missing invoices of the month.
+
+        Returns:
+            dict: Number of invoices ``created`` and of customers ``skipped`` for lack of a payment method.
+        """
+        if self.workers <= 1:
+            return self.run_shard(None)
+        if connection.vendor == 'sqlite':
+            logger.warning("SQLite allows a single writer, invoicing the shards one at a time")
+            results = [self.run_shard(shard) for shard in self.shards()]
+        else:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                results = list(executor.map(self.run_shard_in_thread, self.shards()))
+
+        result = {'created': 0, 'skipped': 0}
+        for shard_result in results:
+            for key in result:
+                result[key] += shard_result[key]
+        return result
+
+    def run_shard_in_thread(self, user_id_range):
+        try:
+            return self.run_shard(user_id_range)
+        finally:
+            connection.close()
+
+    def run_shard(self, user_id_range):
+        result = {'created': 0, 'skipped': 0}
+        last_user_id = None
+        while True:
+            # Keyset pagination: each batch starts after the last user of the previous one
+            totals = self.pending_totals(user_id_range)
+            if last_user_id is not None:
+                totals = totals.filter(user_id__gt=last_user_id)
+            batch = list(totals[:self.batch_size])
+            if not batch:
+                break
+            self.create_invoices(batch, result)
+            last_user_id = batch[-1]['user_id']
+        logger.info(f"Invoiced users {user_id_range or 'all'} for {self.first_day:%Y-%m}: {result}")
+        return result
+
+    def create_invoices(self, rows, result):
+        # An invoice needs a payment method; bill the customer's first one
+        payment_methods = dict(
+            PaymentMethod.objects.filter(
+                customer_id__in=[row['id'] for row in rows]
+            ).values('customer_id').annotate(first=Min('id')).values_list('customer_id', 'first')
+        )
+
+        invoices = []
+        for row in rows:
+            payment_method_id = payment_methods.get(row['id'])
+            if payment_method_id is None:
+                logger.warning(f"User {row['user_id']} has no payment method, not invoiced")
+                result['skipped'] += 1
+                continue
+            invoices.append(Invoice(
+                user_id=row['user_id'],
+                payment_method_id=payment_method_id,
+                total_amount=row['total'] or 0,
+                due_amount=row['total'] or 0,
+                date=self.first_day,
+            ))
+
+        # Conflicting rows are skipped silently, so count the invoices of the batch before and after
+        batch = Invoice.objects.filter(date=self.first_day, user_id__in=[invoice.user_id for invoice in invoices])
+        with transaction.atomic():
+            existing = batch.count()
+            Invoice.objects.bulk_create(invoices, ignore_conflicts=True)
+            result['created'] += batch.count() - existing
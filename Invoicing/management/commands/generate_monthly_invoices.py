@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand, CommandError
+from datetime import datetime
+from Invoicing.billing import InvoiceRun
+
+class Command(BaseCommand):
+    help = 'Generate invoices for all customers for the current month'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--month', help='Month to invoice as YYYY-MM (defaults to the current month)')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Invoices inserted per bulk_create')
+        parser.add_argument('--workers', type=int, default=1,
+                            help='Number of parallel workers, each invoicing a range of user ids (ignored on SQLite)')
+
+    def handle(self, *args, **options):
+        if options['month']:
+            try:
+                month = datetime.strptime(options['month'], '%Y-%m')
+            except ValueError:
+                raise CommandError("--month must be formatted as YYYY-MM")
+        else:
+            month = datetime.now()
+
+        # Already invoiced users are skipped, so an interrupted run can be resumed by running it again
+        result = InvoiceRun(
+            month.year, month.month, batch_size=options['batch_size'], workers=options['workers']
+        ).run()
+
+        if result['skipped']:
+            self.stdout.write(self.style.WARNING(
+                f"{result['skipped']} customers have no payment method and were not invoiced"
+            ))
+        self.stdout.write(self.style.SUCCESS(f"{result['created']} invoices created for {month:%Y-%m}"))
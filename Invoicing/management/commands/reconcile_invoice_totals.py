@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand, CommandError
+from datetime import datetime
+from django.db.models import F, Q
+from Invoicing.models import Invoice
+
+class Command(BaseCommand):
+    help = 'Verify the stored invoice totals against the transactions and optionally fix them'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--month', help='Only check invoices of this month (YYYY-MM)')
+        parser.add_argument('--fix', action='store_true', help='Rewrite the totals that do not match')
+        parser.add_argument('--tolerance', type=float, default=0.005, help='Largest difference accepted as equal')
+
+    def handle(self, *args, **options):
+        invoices = Invoice.objects.all()
+        if options['month']:
+            try:
+                month = datetime.strptime(options['month'], '%Y-%m')
+            except ValueError:
+                raise CommandError("--month must be formatted as YYYY-MM")
+            invoices = invoices.filter(date__year=month.year, date__month=month.month)
+
+        # One query compares every stored total with the one recomputed from the transactions
+        tolerance = options['tolerance']
+        mismatched = invoices.with_computed_total().filter(
+            Q(total_amount__gt=F('computed_total') + tolerance) | Q(total_amount__lt=F('computed_total') - tolerance)
+        )
+        rows = list(mismatched.values_list('id', 'user__username', 'date', 'total_amount', 'computed_total'))
+        for invoice_id, username, date, stored, computed in rows:
+            self.stdout.write(self.style.WARNING(
+                f"Invoice {invoice_id} ({username}, {date:%Y-%m}): stored {stored}, transactions sum to {computed}"
+            ))
+
+        if rows and options['fix']:
+            fixed = Invoice.objects.filter(id__in=[row[0] for row in rows]).refresh_totals()
+            self.stdout.write(self.style.SUCCESS(f"Fixed {fixed} invoice totals"))
+        elif not rows:
+            self.stdout.write(self.style.SUCCESS(f"All {invoices.count()} invoice totals match"))
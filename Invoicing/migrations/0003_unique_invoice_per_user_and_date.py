@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:25
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def remove_duplicate_invoices(apps, schema_editor):
+    # Keep the oldest invoice of each (user, date), so the unique constraint can be added
+    Invoice = apps.get_model('Invoicing', 'Invoice')
+    duplicates = Invoice.objects.values('user', 'date').annotate(count=Count('id'), keep=Min('id')).filter(count__gt=1)
+    for duplicate in duplicates:
+        Invoice.objects.filter(user=duplicate['user'], date=duplicate['date']).exclude(id=duplicate['keep']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Invoicing', '0002_initial'),
+        ('Users', '0004_alter_user_last_login'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_invoices, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='invoice',
+            constraint=models.UniqueConstraint(fields=('user', 'date'), name='unique_invoice_per_user_and_date'),
+        ),
+    ]
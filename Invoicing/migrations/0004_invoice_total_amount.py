@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:26
+
+from django.db import migrations, models
+from django.db.models import FloatField, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, ExtractMonth, ExtractYear
+
+
+def fill_total_amount(apps, schema_editor):
+    Invoice = apps.get_model('Invoicing', 'Invoice')
+    Transaction = apps.get_model('Commanding', 'Transaction')
+    totals = Transaction.objects.filter(
+        customer__user=OuterRef('user'),
+        date__year=ExtractYear(OuterRef('date')),
+        date__month=ExtractMonth(OuterRef('date')),
+    ).values('customer__user').annotate(total=Sum('amount')).values('total')
+    Invoice.objects.update(total_amount=Coalesce(Subquery(totals, output_field=FloatField()), Value(0.0)))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Invoicing', '0003_unique_invoice_per_user_and_date'),
+        ('Commanding', '0008_chargerrollup_rollupwatermark'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='invoice',
+            name='total_amount',
+            field=models.FloatField(default=0),
+        ),
+        migrations.RunPython(fill_total_amount, migrations.RunPython.noop),
+    ]
@@ -1,7 +1,35 @@
 from django.db import models
 from Users.models import PaymentMethod, User
-from django.db.models import Sum
-from decimal import Decimal
+from django.db.models import FloatField, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, ExtractMonth, ExtractYear
+from Commanding.models import Transaction
+
+
+def monthly_transaction_total():
+    """
+    Subquery summing the amounts of the outer invoice user's transactions started in the
+    invoice's month.
+    """
+    totals = Transaction.objects.filter(
+        customer__user=OuterRef('user'),
+        started_at__year=ExtractYear(OuterRef('date')),
+        started_at__month=ExtractMonth(OuterRef('date')),
+    ).values('customer__user').annotate(total=Sum('amount')).values('total')
+    return Coalesce(Subquery(totals, output_field=FloatField()), Value(0.0))
+
+
+class InvoiceQuerySet(models.QuerySet):
+
+    def with_computed_total(self):
+        """Annotate each invoice with ``computed_total``, its total recomputed from the transactions."""
+        return self.annotate(computed_total=monthly_transaction_total())
+
+    def refresh_totals(self):
+        """
+        Recompute the stored totals of the invoices in this queryset with a single UPDATE.
+        ``due_amount`` is left as it is.
+        """
+        return self.update(total_amount=monthly_transaction_total())
 
 
 class Invoice(models.Model):
@@ -13,20 +41,20 @@ class Invoice(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     paid_amount = models.FloatField(default=0)
     due_amount = models.FloatField(default=0)
+    # Sum of the user's transaction amounts in the invoice's month. Set when the invoice is
+    # generated and kept up to date by the Transaction signals in Invoicing.signals, which only
+    # apply the change of each amount; due_amount is not derived from it.
+    total_amount = models.FloatField(default=0)
     status = models.CharField(max_length=100, default='Unpaid', choices=INVOICE_STATUS)
     payment_method = models.ForeignKey(PaymentMethod, on_delete=models.CASCADE)
     date = models.DateField()
 
-    @property
-    def total_amount(self):
-        """
-        Aggregate all transaction amounts for this user and return the total.
-        """
-        total = self.user.user_transaction.filter(
-            date__year=self.date.year,
-            date__month=self.date.month
-        ).aggregate(total=Sum('amount'))['total']
-        return total or Decimal('0.00')
+    objects = InvoiceQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'date'], name='unique_invoice_per_user_and_date'),
+        ]
 
     def __str__(self):
         return f"Invoice for {self.user.username} - {self.date}"
@@ -0,0 +1,33 @@
+from django.db.models import F
+from django.db.models.signals import post_init, post_save, post_delete
+from django.dispatch import receiver
+from Commanding.models import Transaction
+from .models import Invoice
+
+def invoice_of(transaction):
+    return Invoice.objects.filter(
+        user__customer_user__id=transaction.customer_id,
+        date__year=transaction.started_at.year,
+        date__month=transaction.started_at.month,
+    )
+
+@receiver(post_init, sender=Transaction)
+def remember_amount(sender, instance, **kwargs):
+    # The amount as loaded, i.e. the one the invoice total already counts
+    instance._invoiced_amount = instance.__dict__.get('amount')
+
+@receiver(post_save, sender=Transaction)
+def add_to_invoice_total(sender, instance, created, update_fields=None, **kwargs):
+    # Only the change of the amount is applied to the invoice of the transaction's month, if it
+    # exists; the full recompute is left to the reconcile_invoice_totals command
+    if update_fields is not None and 'amount' not in update_fields:
+        return
+    delta = (instance.amount or 0) - (0 if created else instance._invoiced_amount or 0)
+    instance._invoiced_amount = instance.amount
+    if delta:
+        invoice_of(instance).update(total_amount=F('total_amount') + delta)
+
+@receiver(post_delete, sender=Transaction)
+def remove_from_invoice_total(sender, instance, **kwargs):
+    if instance._invoiced_amount:
+        invoice_of(instance).update(total_amount=F('total_amount') - instance._invoiced_amount)
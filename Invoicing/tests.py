@@ -1,3 +1,116 @@
+from datetime import date, datetime, timezone
+from io import StringIO
+from django.core.management import call_command
 from django.test import TestCase
+from Charging.models import EVCharger
+from Commanding.models import Transaction
+from EVChargingSystem.testing import QueryBudgetMixin, create_station
+from Users.models import User, Customer, PaymentMethod
+from .billing import InvoiceRun
+from .models import Invoice
 
-# Create your tests here.
+class ListQueryBudgetTests(QueryBudgetMixin, TestCase):
+
+    def create_invoices(self, start, stop):
+        for i in range(start, stop):
+            user = User.objects.create_user(f"customer{i}", password="customer", type="customer")
+            customer = Customer.objects.create(user=user, car_plate=f"P{i}")
+            payment_method = PaymentMethod.objects.create(
+                customer=customer, name="Card", number="4" * 16, expiry_year=30, expiry_month=1, cvv="123"
+            )
+            Invoice.objects.create(user=user, payment_method=payment_method, total_amount=i, date=date(2025, 1, 1))
+
+    def test_list_invoices(self):
+        self.assertQueryBudget('/invoices/all/', self.create_invoices, budget=1)
+
+class InvoiceRunTests(TestCase):
+
+    def setUp(self):
+        self.charger = EVCharger.objects.create(station=create_station(), serial_number="CHG")
+        self.customers = [self.create_customer(i) for i in range(3)]
+
+    def create_customer(self, i, payment_method=True):
+        user = User.objects.create_user(f"customer{i}", password="customer", type="customer")
+        customer = Customer.objects.create(user=user, car_plate=f"P{i}")
+        if payment_method:
+            PaymentMethod.objects.create(
+                customer=customer, name="Card", number="4" * 16, expiry_year=30, expiry_month=1, cvv="123"
+            )
+        return customer
+
+    def charge(self, customer, amount, at):
+        transaction = Transaction.objects.create(customer=customer, command="StopTransaction", amount=amount, charger=self.charger)
+        Transaction.objects.filter(id=transaction.id).update(started_at=at)
+
+    def test_run(self):
+        self.charge(self.customers[0], 10.0, datetime(2025, 1, 5, tzinfo=timezone.utc))
+        self.charge(self.customers[0], 5.0, datetime(2025, 1, 31, 23, tzinfo=timezone.utc))
+        self.charge(self.customers[1], 7.0, datetime(2025, 2, 1, tzinfo=timezone.utc))
+        self.create_customer(3, payment_method=False)
+
+        self.assertEqual(InvoiceRun(2025, 1, batch_size=2).run(), {'created': 3, 'skipped': 1})
+        totals = dict(Invoice.objects.values_list('user__username', 'total_amount'))
+        # Customers that did not charge that month are invoiced too
+        self.assertEqual(totals, {'customer0': 15.0, 'customer1': 0.0, 'customer2': 0.0})
+        self.assertEqual(InvoiceRun(2025, 1).run(), {'created': 0, 'skipped': 1})
+
+    def test_workers(self):
+        self.assertEqual(InvoiceRun(2025, 1, batch_size=1, workers=2).run(), {'created': 3, 'skipped': 0})
+
+    def test_conflicts_are_not_counted(self):
+        run = InvoiceRun(2025, 1)
+        rows = list(run.pending_totals())
+        # A concurrent run invoiced the first customer in the meantime
+        Invoice.objects.create(
+            user=self.customers[0].user, payment_method=self.customers[0].customer_payment_method.get(), date=date(2025, 1, 1)
+        )
+        result = {'created': 0, 'skipped': 0}
+        run.create_invoices(rows, result)
+        self.assertEqual(result, {'created': 2, 'skipped': 0})
+        self.assertEqual(Invoice.objects.count(), 3)
+
+class InvoiceTotalTests(TestCase):
+
+    def setUp(self):
+        charger = EVCharger.objects.create(station=create_station(), serial_number="CHG")
+        user = User.objects.create_user("customer", password="customer", type="customer")
+        self.customer = Customer.objects.create(user=user, car_plate="P")
+        payment_method = PaymentMethod.objects.create(
+            customer=self.customer, name="Card", number="4" * 16, expiry_year=30, expiry_month=1, cvv="123"
+        )
+        self.invoice = Invoice.objects.create(user=user, payment_method=payment_method, date=date.today().replace(day=1))
+        self.transaction = Transaction.objects.create(customer=self.customer, command="StartTransaction", charger=charger)
+
+    def total(self):
+        self.invoice.refresh_from_db()
+        return self.invoice.total_amount
+
+    def test_signals(self):
+        self.transaction.amount = 4.5
+        self.transaction.save(update_fields=['amount'])
+        self.assertEqual(self.total(), 4.5)
+        # A reloaded transaction only adds the difference
+        transaction = Transaction.objects.get(id=self.transaction.id)
+        transaction.amount = 5.0
+        transaction.save()
+        self.assertEqual(self.total(), 5.0)
+        with self.assertNumQueries(1):
+            transaction.save(update_fields=['command'])
+        with self.assertNumQueries(1):
+            transaction.save()
+        transaction.delete()
+        self.assertEqual(self.total(), 0.0)
+
+    def test_reconcile(self):
+        self.transaction.amount = 3.0
+        self.transaction.save()
+        Invoice.objects.update(total_amount=1.0, due_amount=2.0)
+
+        out = StringIO()
+        call_command('reconcile_invoice_totals', stdout=out)
+        self.assertIn("stored 1.0, transactions sum to 3.0", out.getvalue())
+        self.assertEqual(self.total(), 1.0)
+
+        call_command('reconcile_invoice_totals', '--fix', stdout=out)
+        self.assertIn("Fixed 1 invoice totals", out.getvalue())
+        self.assertEqual((self.total(), self.invoice.due_amount), (3.0, 2.0))
@@ -5,11 +5,13 @@ from rest_framework.response import Response
 from .models import Invoice
 from .serializers import InvoiceSerializer
 from django.shortcuts import get_object_or_404
+from EVChargingSystem.pagination import KeysetPagination, StreamingListMixin
 
 # List all invoices
-class InvoiceListView(generics.ListAPIView):
+class InvoiceListView(StreamingListMixin, generics.ListAPIView):
     serializer_class = InvoiceSerializer
     permission_classes = [IsAuthenticated, IsAdminUser]
+    pagination_class = KeysetPagination
 
     def get_queryset(self):
         # Instead of filtering by user, list all invoices (no filter)
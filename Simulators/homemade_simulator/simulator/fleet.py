@@ -0,0 +1,358 @@
+# region Imports
+import argparse
+import asyncio
+import json
+import logging
+import math
+import random
+import time
+import uuid
+from collections import defaultdict
+from datetime import datetime, timezone
+
+import websockets
+
+from client import generate_random_readings
+# endregion
+
+logger = logging.getLogger(__name__)
+
+class LatencyHistogram:
+    """
+    Round-trip latency histogram with logarithmic buckets.
+
+    Each bucket is ``2 ** (1 / resolution)`` times wider than the previous one, starting at
+    ``lowest`` seconds, so percentiles are accurate to about 9% (with the default resolution
+    of 8) whatever the spread of the latencies, in constant memory.
+    """
+
+    def __init__(self, lowest=0.0001, resolution=8):
+        self.lowest = lowest
+        self.resolution = resolution
+        self.buckets = defaultdict(int)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        index = 0 if seconds <= self.lowest else int(math.log2(seconds / self.lowest) * self.resolution) + 1
+        self.buckets[index] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def upper_bound(self, index):
+        return self.lowest * 2 ** (index / self.resolution)
+
+    def percentile(self, percent):
+        """Return the upper bound, in seconds, of the bucket holding the given percentile."""
+        if not self.count:
+            return None
+        rank = math.ceil(self.count * percent / 100)
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= rank:
+                return min(self.upper_bound(index), self.max)
+        return self.max
+
+    def summary(self):
+        def ms(seconds):
+            return None if seconds is None else round(seconds * 1000, 3)
+        return {
+            'count': self.count,
+            'mean_ms': ms(self.total / self.count) if self.count else None,
+            'p50_ms': ms(self.percentile(50)),
+            'p90_ms': ms(self.percentile(90)),
+            'p99_ms': ms(self.percentile(99)),
+            'p999_ms': ms(self.percentile(99.9)),
+            'max_ms': ms(self.max),
+        }
+
+class FleetStats:
+    """Latency histograms and error counters shared by all the virtual chargers of a run."""
+
+    def __init__(self):
+        self.latency = defaultdict(LatencyHistogram)
+        self.timeouts = defaultdict(int)
+        self.errors = defaultdict(int)
+        self.connected = 0
+        self.connect_latency = LatencyHistogram()
+        self.started_at = time.monotonic()
+
+    def report(self):
+        elapsed = time.monotonic() - self.started_at
+        return {
+            'elapsed_s': round(elapsed, 1),
+            'connected': self.connected,
+            'connect': self.connect_latency.summary(),
+            'actions': {
+                action: {
+                    **histogram.summary(),
+                    'per_second': round(histogram.count / elapsed, 1) if elapsed else None,
+                    'timeouts': self.timeouts[action],
+                }
+                for action, histogram in sorted(self.latency.items())
+            },
+            'errors': dict(self.errors),
+        }
+
+def now_iso():
+    return datetime.now(timezone.utc).isoformat()
+
+class VirtualCharger:
+    """
+    One simulated charge point on its own websocket, run as a handful of asyncio tasks.
+
+    After the BootNotification the charger sends a Heartbeat every ``heartbeat_interval``
+    seconds and starts transactions at random (on average ``transactions_per_hour`` times an
+    hour). While a transaction is running it reports MeterValues every ``meter_interval`` seconds,
+    and stops it after ``session_duration`` seconds. The round trip of every CALL, from sending it
+    to receiving its CALLRESULT, is recorded in the fleet's histograms. Calls from the backend are
+    acknowledged with an empty CALLRESULT.
+    """
+
+    def __init__(self, serial_number, options, stats):
+        self.serial_number = serial_number
+        self.url = f"{options.url.rstrip('/')}/{options.station}/{serial_number}/"
+        self.options = options
+        self.stats = stats
+        self.ws = None
+        self.pending = {}
+        self.energy = random.uniform(0, 100000)
+
+    async def run(self, stop):
+        """Keep the charger connected until ``stop`` is set, reconnecting after failures."""
+        backoff = 1
+        while not stop.is_set():
+            try:
+                await self.session(stop)
+                backoff = 1
+            except (OSError, asyncio.TimeoutError, websockets.exceptions.WebSocketException) as e:
+                self.stats.errors[type(e).__name__] += 1
+                logger.debug(f"{self.serial_number}: {e!r}, reconnecting in {backoff}s")
+                try:
+                    await asyncio.wait_for(stop.wait(), backoff)
+                except asyncio.TimeoutError:
+                    pass
+                backoff = min(backoff * 2, 60)
+
+    async def session(self, stop):
+        headers = {'Authorization': f"Bearer {self.options.token}"} if self.options.token else None
+        started = time.monotonic()
+        async with websockets.connect(
+            self.url,
+            subprotocols=['ocpp1.6'],
+            additional_headers=headers,
+            open_timeout=self.options.timeout,
+            ping_interval=None,
+        ) as ws:
+            self.ws = ws
+            self.stats.connect_latency.record(time.monotonic() - started)
+            self.stats.connected += 1
+            reader = asyncio.create_task(self.read())
+            tasks = []
+            try:
+                await self.call('BootNotification', {
+                    'chargePointVendor': 'Fleet',
+                    'chargePointModel': 'Simulated',
+                    'chargePointSerialNumber': self.serial_number,
+                })
+                await self.call('StatusNotification', {
+                    'connectorId': 1, 'errorCode': 'NoError', 'status': 'Available', 'timestamp': now_iso(),
+                })
+                tasks = [asyncio.create_task(self.heartbeats()), asyncio.create_task(self.transactions())]
+                stopped = asyncio.create_task(stop.wait())
+                await asyncio.wait([reader, stopped], return_when=asyncio.FIRST_COMPLETED)
+                stopped.cancel()
+            finally:
+                self.stats.connected -= 1
+                for task in tasks + [reader]:
+                    task.cancel()
+                for future in self.pending.values():
+                    future.cancel()
+                self.pending.clear()
+            if reader.done() and not reader.cancelled() and reader.exception():
+                raise reader.exception()
+
+    async def read(self):
+        async for message in self.ws:
+            try:
+                frame = json.loads(message)
+            except ValueError:
+                self.stats.errors['invalid_json'] += 1
+                continue
+            # The backend also sends plain JSON status messages, which are not OCPP frames
+            if not isinstance(frame, list) or len(frame) < 3:
+                continue
+            if frame[0] == 2:
+                await self.ws.send(json.dumps([3, frame[1], {}]))
+            elif frame[0] in (3, 4):
+                future = self.pending.pop(frame[1], None)
+                if future is not None and not future.done():
+                    future.set_result(frame)
+
+    async def call(self, action, payload):
+        """Send a CALL and wait for its result. Returns the result payload, or None on timeout or error."""
+        unique_id = str(uuid.uuid4())
+        future = asyncio.get_running_loop().create_future()
+        self.pending[unique_id] = future
+        started = time.monotonic()
+        await self.ws.send(json.dumps([2, unique_id, action, payload]))
+        try:
+            frame = await asyncio.wait_for(future, self.options.timeout)
+        except asyncio.TimeoutError:
+            self.pending.pop(unique_id, None)
+            self.stats.timeouts[action] += 1
+            return None
+        self.stats.latency[action].record(time.monotonic() - started)
+        if frame[0] == 4:
+            self.stats.errors[f"{action}:{frame[2]}"] += 1
+            return None
+        return frame[2]
+
+    async def heartbeats(self):
+        interval = self.options.heartbeat_interval
+        # Spread the fleet over the interval instead of sending every heartbeat at once
+        await asyncio.sleep(random.uniform(0, interval))
+        while True:
+            await self.call('Heartbeat', {})
+            await asyncio.sleep(interval)
+
+    async def transactions(self):
+        rate = self.options.transactions_per_hour / 3600
+        if rate <= 0:
+            return
+        while True:
+            await asyncio.sleep(random.expovariate(rate))
+            await self.charge()
+
+    async def charge(self):
+        result = await self.call('StartTransaction', {
+            'connectorId': 1, 'idTag': 'FLEET', 'meterStart': int(self.energy), 'timestamp': now_iso(),
+        })
+        transaction_id = (result or {}).get('transactionId', 0)
+        await self.call('StatusNotification', {
+            'connectorId': 1, 'errorCode': 'NoError', 'status': 'Charging', 'timestamp': now_iso(),
+        })
+
+        ends_at = time.monotonic() + self.options.session_duration
+        while time.monotonic() < ends_at:
+            await asyncio.sleep(min(self.options.meter_interval, max(0, ends_at - time.monotonic())))
+            readings = generate_random_readings()
+            self.energy += readings['power_W'] * self.options.meter_interval / 3600
+            await self.call('MeterValues', {
+                'connectorId': 1,
+                'transactionId': transaction_id,
+                'meterValue': [{
+                    'timestamp': now_iso(),
+                    'sampledValue': [
+                        {'measurand': 'Energy.Active.Import.Register', 'unit': 'Wh', 'value': f"{self.energy:.3f}"},
+                        {'measurand': 'Power.Active.Import', 'unit': 'W', 'value': str(readings['power_W'])},
+                        {'measurand': 'Current.Import', 'unit': 'A', 'value': str(readings['current_A'])},
+                        {'measurand': 'Voltage', 'unit': 'V', 'value': str(readings['voltage_V'])},
+                    ],
+                }],
+            })
+
+        await self.call('StopTransaction', {
+            'transactionId': transaction_id, 'meterStop': int(self.energy), 'timestamp': now_iso(),
+        })
+        await self.call('StatusNotification', {
+            'connectorId': 1, 'errorCode': 'NoError', 'status': 'Available', 'timestamp': now_iso(),
+        })
+
+def ramp_delays(count, profile, ramp, step_size):
+    """
+    Yield the delay, from the start of the run, at which each of the ``count`` chargers connects.
+
+    ``instant`` connects them all at once, ``linear`` spreads them evenly over ``ramp`` seconds
+    and ``step`` connects them in groups of ``step_size`` spread evenly over ``ramp`` seconds.
+    """
+    for i in range(count):
+        if profile == 'instant' or ramp <= 0:
+            yield 0.0
+        elif profile == 'linear':
+            yield ramp * i / count
+        else:
+            steps = math.ceil(count / step_size)
+            yield ramp * (i // step_size) / steps
+
+async def run_fleet(options):
+    stats = FleetStats()
+    stop = asyncio.Event()
+    chargers = [
+        VirtualCharger(f"{options.prefix}{i:05d}", options, stats) for i in range(options.offset, options.offset + options.chargers)
+    ]
+
+    async def start(charger, delay):
+        await asyncio.sleep(delay)
+        await charger.run(stop)
+
+    tasks = [
+        asyncio.create_task(start(charger, delay))
+        for charger, delay in zip(chargers, ramp_delays(len(chargers), options.profile, options.ramp, options.step_size))
+    ]
+
+    started = time.monotonic()
+    while time.monotonic() - started < options.duration:
+        await asyncio.sleep(min(options.report_interval, options.duration - (time.monotonic() - started)))
+        report = stats.report()
+        logger.info(
+            f"{report['elapsed_s']}s: {report['connected']}/{options.chargers} connected, "
+            + ", ".join(
+                f"{action} {summary['count']} (p99 {summary['p99_ms']}ms)" for action, summary in report['actions'].items()
+            )
+        )
+
+    stop.set()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    return stats.report()
+
+def raise_file_limit():
+    """Every charger holds a socket; allow as many open files as the hard limit permits."""
+    try:
+        import resource
+    except ImportError:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Drive a fleet of simulated OCPP 1.6 chargers against the MonitoringConsumer. '
+                    'Create the chargers first with: python manage.py create_simulated_chargers <station> --count N'
+    )
+    parser.add_argument('--url', default='ws://localhost:8000/ws/charging/station', help='Base websocket URL')
+    parser.add_argument('--station', default='DTS-CC-001', help='Station code of the chargers')
+    parser.add_argument('--chargers', type=int, default=1000, help='Number of virtual chargers')
+    parser.add_argument('--prefix', default='SIM', help='Serial numbers are PREFIX00000, PREFIX00001, ...')
+    parser.add_argument('--offset', type=int, default=0, help='Number of the first charger, to split a fleet across processes')
+    parser.add_argument('--token', help='JWT sent as the Authorization bearer token')
+    parser.add_argument('--profile', choices=['instant', 'linear', 'step'], default='linear', help='Ramp-up profile')
+    parser.add_argument('--ramp', type=float, default=60, help='Seconds over which the fleet connects')
+    parser.add_argument('--step-size', type=int, default=100, help='Chargers per step of the step profile')
+    parser.add_argument('--duration', type=float, default=300, help='Seconds the run lasts, ramp-up included')
+    parser.add_argument('--heartbeat-interval', type=float, default=10, help='Seconds between heartbeats')
+    parser.add_argument('--meter-interval', type=float, default=30, help='Seconds between MeterValues while charging')
+    parser.add_argument('--transactions-per-hour', type=float, default=2, help='Average transactions started per charger per hour')
+    parser.add_argument('--session-duration', type=float, default=600, help='Seconds a transaction lasts')
+    parser.add_argument('--timeout', type=float, default=30, help='Seconds to wait for a connection or a CALLRESULT')
+    parser.add_argument('--report-interval', type=float, default=10, help='Seconds between progress lines')
+    parser.add_argument('--output', help='Write the final report to this JSON file')
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    # client.py configures DEBUG logging when it is imported
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s', force=True)
+    options = parse_args(argv)
+    raise_file_limit()
+    report = asyncio.run(run_fleet(options))
+    print(json.dumps(report, indent=2))
+    if options.output:
+        with open(options.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == '__main__':
+    main()
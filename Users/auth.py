@@ -0,0 +1,227 @@
+import asyncio
+import logging
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import parse_qs
+from channels.db import database_sync_to_async
+from channels.middleware import BaseMiddleware
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import AccessToken
+from .models import User
+
+logger = logging.getLogger(__name__)
+
+class UserEntry:
+    """
+    An active user with the customer and organization it is linked to, if any, kept in memory.
+    """
+    __slots__ = ('user', 'customer', 'organization')
+
+    def __init__(self, user, customer=None, organization=None):
+        self.user = user
+        self.customer = customer
+        self.organization = organization
+
+    def __repr__(self):
+        return f"<UserEntry {self.user.username}>"
+
+class TTLCache:
+    """
+    A least recently used cache of at most ``size`` entries, each kept for ``ttl`` seconds.
+
+    Entries are dropped from the signal handlers, which run in whatever thread saved the model,
+    so the cache is guarded by a lock.
+    """
+
+    def __init__(self, size, ttl):
+        self.size = size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return default
+            expires_at, value = item
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return default
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            return self._entries.pop(key, None) is not None
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+class UserCache:
+    """
+    Process-wide cache of the users behind websocket tokens.
+
+    A token is verified once: its user id is kept until the token expires, in an LRU of
+    ``WEBSOCKET_AUTH_TOKEN_CACHE_SIZE`` tokens. The user it names is read with its customer and
+    organization in one query and kept for ``WEBSOCKET_AUTH_CACHE_TTL`` seconds, in an LRU of
+    ``WEBSOCKET_AUTH_CACHE_SIZE`` users; users that are unknown or inactive are cached too, as
+    None. Concurrent connections of the same user share one query, so a reconnect storm costs
+    one query per user at most, and none for users already cached.
+
+    Entries are dropped by the ``User``, ``Customer`` and ``Organization`` save/delete signals
+    (see ``Users.signals``); a load that was running while its user changed is not cached. The
+    signals only reach the cache of the process that saved the model: other processes, such as
+    the other ASGI workers, keep serving their entry until it expires. A user deactivated, or
+    moved to another customer or organization, may therefore open new connections with the old
+    entry for up to ``WEBSOCKET_AUTH_CACHE_TTL`` seconds, which bounds how stale the cache gets.
+    """
+
+    def __init__(self, size=None, ttl=None, token_size=None):
+        self.users = TTLCache(
+            size or getattr(settings, "WEBSOCKET_AUTH_CACHE_SIZE", 10000),
+            ttl or getattr(settings, "WEBSOCKET_AUTH_CACHE_TTL", 300),
+        )
+        self.tokens = TTLCache(token_size or getattr(settings, "WEBSOCKET_AUTH_TOKEN_CACHE_SIZE", 50000), 0)
+        self._loading = {}
+        self._invalidations = 0
+
+    def user_id(self, token):
+        """
+        Return the user id of a raw access token, or None if the token is invalid or expired.
+        """
+        user_id = self.tokens.get(token)
+        if user_id is not None:
+            return user_id
+        try:
+            access_token = AccessToken(token)
+        except TokenError as e:
+            logger.info("Token validation failed: %s", e)
+            return None
+        user_id = access_token.get(api_settings.USER_ID_CLAIM)
+        if user_id is None:
+            return None
+        # Tokens may carry the id as a string, cache entries are keyed by the string either way
+        user_id = str(user_id)
+        self.tokens.set(token, user_id, ttl=access_token['exp'] - time.time())
+        return user_id
+
+    def load_sync(self, user_id):
+        user = (User.objects.select_related('customer_user', 'organization_user')
+                .filter(id=user_id, is_active=True).first())
+        if user is None:
+            return None
+        return UserEntry(
+            user,
+            getattr(user, 'customer_user', None),
+            getattr(user, 'organization_user', None),
+        )
+
+    async def load(self, user_id):
+        """
+        Return the :class:`UserEntry` of ``user_id``, or None if there is no such active user.
+        """
+        entry = self.users.get(user_id, False)
+        if entry is not False:
+            return entry
+
+        loop = asyncio.get_running_loop()
+        loading = self._loading.get(user_id)
+        if loading is not None and loading.get_loop() is loop:
+            return await asyncio.shield(loading)
+
+        loading = self._loading[user_id] = loop.create_future()
+        invalidations = self._invalidations
+        try:
+            entry = await database_sync_to_async(self.load_sync)(user_id)
+        except asyncio.CancelledError:
+            loading.cancel()
+            raise
+        except Exception as e:
+            loading.set_exception(e)
+            # Nobody else may be waiting for this load
+            loading.exception()
+            raise
+        finally:
+            if self._loading.get(user_id) is loading:
+                del self._loading[user_id]
+        if invalidations == self._invalidations:
+            self.users.set(user_id, entry)
+        loading.set_result(entry)
+        return entry
+
+    async def authenticate(self, token):
+        """
+        Returns:
+            UserEntry: The user of the access token ``token``, or None.
+        """
+        if not token:
+            return None
+        user_id = self.user_id(token)
+        if user_id is None:
+            return None
+        return await self.load(user_id)
+
+    def invalidate(self, *user_ids):
+        """Drop the entries of ``user_ids`` from this process's cache."""
+        self._invalidations += 1
+        for user_id in user_ids:
+            if self.users.pop(str(user_id)):
+                logger.debug("User %s evicted from the websocket auth cache", user_id)
+
+    def clear(self):
+        self._invalidations += 1
+        self.users.clear()
+        self.tokens.clear()
+
+user_cache = UserCache()
+
+def get_token(scope):
+    """
+    Return the JWT of the ``authorization`` header (``Bearer <token>``) of a websocket scope or,
+    since browsers cannot set headers on a websocket, of its ``token`` query parameter.
+    """
+    for name, value in scope.get('headers', ()):
+        if name == b'authorization':
+            _, _, token = value.decode().partition(' ')
+            return token or None
+    return parse_qs(scope.get('query_string', b'').decode()).get('token', [None])[0]
+
+class JWTAuthMiddleware(BaseMiddleware):
+    """
+    Authenticates websocket connections by their JWT, through the :class:`UserCache`.
+
+    Sets ``scope['user']`` to the user of the token, or to an AnonymousUser, and
+    ``scope['customer']`` and ``scope['organization']`` to the user's customer and
+    organization, or None.
+    """
+
+    def __init__(self, inner, cache=None):
+        super().__init__(inner)
+        self.cache = cache or user_cache
+
+    async def __call__(self, scope, receive, send):
+        entry = await self.cache.authenticate(get_token(scope))
+        scope = dict(
+            scope,
+            user=entry.user if entry else AnonymousUser(),
+            customer=entry.customer if entry else None,
+            organization=entry.organization if entry else None,
+        )
+        return await super().__call__(scope, receive, send)
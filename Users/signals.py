@@ -1,7 +1,9 @@
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
 from django.contrib.auth.models import Group
 from django.conf import settings
+from .auth import user_cache
+from .models import Customer, Organization
 
 @receiver(post_save, sender=settings.AUTH_USER_MODEL)
 def assign_user_group(sender, instance, created, **kwargs):
@@ -12,3 +14,15 @@ def assign_user_group(sender, instance, created, **kwargs):
             instance.groups.add(group)
         except Group.DoesNotExist:
             pass  # Or log this
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+def invalidate_user_cache(sender, instance, **kwargs):
+    user_cache.invalidate(instance.pk)
+
+@receiver(post_save, sender=Customer)
+@receiver(post_delete, sender=Customer)
+@receiver(post_save, sender=Organization)
+@receiver(post_delete, sender=Organization)
+def invalidate_user_cache_relations(sender, instance, **kwargs):
+    user_cache.invalidate(instance.user_id)
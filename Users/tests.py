@@ -1,3 +1,113 @@
+import asyncio
+from rest_framework_simplejwt.tokens import AccessToken
 from django.test import TestCase
+from EVChargingSystem.testing import QueryBudgetMixin, create_station
+from Charging.models import EVCharger
+from Commanding.models import Transaction
+from .auth import UserCache, JWTAuthMiddleware, user_cache
+from .models import User, Organization, Customer, PaymentMethod
 
-# Create your tests here.
+def create_customer(i):
+    user = User.objects.create_user(f"customer{i}", password="customer", type="customer")
+    return Customer.objects.create(user=user, car_plate=f"P{i}")
+
+class ListQueryBudgetTests(QueryBudgetMixin, TestCase):
+
+    def create_customers(self, start, stop):
+        for i in range(start, stop):
+            create_customer(i)
+
+    def create_organizations(self, start, stop):
+        for i in range(start, stop):
+            user = User.objects.create_user(f"org{i}", password="org", type="organization")
+            Organization.objects.create(user=user, organization_name=f"Org {i}", acronym=f"O{i}")
+
+    def create_payment_methods(self, start, stop):
+        for i in range(start, stop):
+            PaymentMethod.objects.create(
+                customer=create_customer(i), name="Card", number="4" * 16, expiry_year=30, expiry_month=1, cvv="123"
+            )
+
+    def test_list_users(self):
+        self.assertQueryBudget('/users/', self.create_customers, budget=3)
+
+    def test_list_customers(self):
+        self.assertQueryBudget('/customers/', self.create_customers, budget=1)
+
+    def test_list_organizations(self):
+        self.assertQueryBudget('/organizations/', self.create_organizations, budget=1)
+
+    def test_list_payment_methods(self):
+        self.assertQueryBudget('/payments/', self.create_payment_methods, budget=1)
+
+    def test_list_not_paginated(self):
+        self.create_organizations(0, 3)
+        response = self.api_client().get('/organizations/')
+        self.assertEqual(len(response.json()), 3)
+
+    def test_list_organization_customers(self):
+        station = create_station()
+        user = station.organization.user
+        charger = EVCharger.objects.create(station=station, serial_number="CHG")
+
+        def create_transactions(start, stop):
+            for i in range(start, stop):
+                Transaction.objects.create(customer=create_customer(i), command="start", amount=1, charger=charger)
+
+        self.assertQueryBudget(
+            '/organization/mycustomers/', create_transactions, budget=3, client=self.api_client(user)
+        )
+
+class CountingUserCache(UserCache):
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.loads = 0
+
+    def load_sync(self, user_id):
+        self.loads += 1
+        return super().load_sync(user_id)
+
+class WebsocketAuthTests(TestCase):
+
+    def setUp(self):
+        self.customer = create_customer(0)
+        self.token = str(AccessToken.for_user(self.customer.user))
+
+    async def test_reconnect_storm(self):
+        cache = CountingUserCache()
+        entries = await asyncio.gather(*(cache.authenticate(self.token) for _ in range(100)))
+        entries.append(await cache.authenticate(self.token))
+        self.assertEqual(cache.loads, 1)
+        self.assertTrue(all(entry is entries[0] for entry in entries))
+        self.assertEqual((entries[0].user.id, entries[0].customer.id, entries[0].organization),
+                         (self.customer.user_id, self.customer.id, None))
+
+    async def test_invalid_tokens(self):
+        cache = CountingUserCache()
+        for token in [None, "", "not-a-token", self.token[:-2]]:
+            self.assertIsNone(await cache.authenticate(token))
+        self.assertEqual(cache.loads, 0)
+
+    async def test_invalidated_on_update(self):
+        entry = await user_cache.authenticate(self.token)
+        self.assertIsNotNone(entry)
+
+        user = entry.user
+        user.is_active = False
+        await user.asave()
+        self.assertIsNone(await user_cache.authenticate(self.token))
+
+    async def test_middleware(self):
+        scopes = []
+
+        async def app(scope, receive, send):
+            scopes.append(scope)
+
+        middleware = JWTAuthMiddleware(app, cache=CountingUserCache())
+        await middleware({'type': 'websocket', 'headers': [(b'authorization', f'Bearer {self.token}'.encode())]}, None, None)
+        await middleware({'type': 'websocket', 'query_string': f'token={self.token}'.encode()}, None, None)
+        await middleware({'type': 'websocket', 'headers': []}, None, None)
+
+        self.assertEqual([scope['user'].is_authenticated for scope in scopes], [True, True, False])
+        self.assertEqual([scope['customer'] for scope in scopes], [self.customer] * 2 + [None])
@@ -10,11 +10,12 @@ from rest_framework_simplejwt.views import (
     TokenObtainPairView,
 )
 from django.contrib.auth import authenticate
+from EVChargingSystem.pagination import StreamingListMixin, stream_queryset, wants_stream
 from .models import *
 from Charging.models import *
 from Commanding.models import *
 
-class PermissionedModelViewSet(viewsets.ModelViewSet):
+class PermissionedModelViewSet(StreamingListMixin, viewsets.ModelViewSet):
     """
     A reusable viewset that restricts access to the object owner or admin.
     """
@@ -76,13 +77,14 @@ class LoginView(TokenObtainPairView):
         return Response({"error": "Invalid credentials"}, status=status.HTTP_401_UNAUTHORIZED)
 
 class UserViewSet(PermissionedModelViewSet):
-    queryset = User.objects.all()
+    # The serializer lists every field, including the groups and permissions many-to-many fields
+    queryset = User.objects.prefetch_related('groups', 'user_permissions')
     serializer_class = UserSerializer
     lookup_field = 'username'
 
 
 class CustomerViewSet(PermissionedModelViewSet):
-    queryset = Customer.objects.all()
+    queryset = Customer.objects.select_related('user')
     serializer_class = CustomerSerializer
     lookup_field = 'user__username'
 
@@ -97,11 +99,11 @@ class CustomerViewSet(PermissionedModelViewSet):
     #     return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
 
 class OrganizationViewSet(PermissionedModelViewSet):
-    queryset = Organization.objects.all()
+    queryset = Organization.objects.select_related('user')
     serializer_class = OrganizationSerializer
     lookup_field = 'acronym'
 
-class PaymentMethodViewSet(viewsets.ModelViewSet):
+class PaymentMethodViewSet(StreamingListMixin, viewsets.ModelViewSet):
     queryset = PaymentMethod.objects.all()
     serializer_class = PaymentMethodSerializer
 
@@ -147,7 +149,7 @@ def retrieve_organization_customer(request, username):
         return Response({"error": "This customer is not related to your organization."}, status=403)
 
     try:
-        customer = Customer.objects.get(user__username=username)
+        customer = Customer.objects.select_related('user').get(user__username=username)
     except Customer.DoesNotExist:
         return Response({"error": "Customer not found."}, status=404)
 
@@ -178,10 +180,12 @@ def organization_customers_list(request):
         charger__in=chargers
     ).values_list("customer_id", flat=True).distinct()
 
-    customers = Customer.objects.filter(id__in=customer_ids)
+    customers = Customer.objects.filter(id__in=customer_ids).select_related('user')
 
     if not customers.exists():
         return Response({"message": "You have no customers yet."}, status=200)
 
+    if wants_stream(request):
+        return stream_queryset(customers, CustomerSerializer, context={'request': request})
     serializer = CustomerSerializer(customers, many=True)
     return Response(serializer.data)
\ No newline at end of file